@@ -18,6 +18,13 @@ class Settings(BaseSettings):
     DB_PASS: str
     DB_NAME: str
 
+    # Telegram allows roughly one edit per second in a chat
+    ACTION_EDIT_INTERVAL: float = 1.0
+    # sharded contest deployment, `0=http://contest-0:8000,1=http://contest-1:8000`
+    CONTEST_WORKERS: str = ''
+    # follow all matches over one WebSocket per contest worker instead of a stream per player
+    CONTEST_FEED: bool = True
+
     @property
     def TOKEN(self) -> str:
         if os.environ.get('DEPLOY'):
@@ -0,0 +1,98 @@
+import asyncio
+import logging
+from collections.abc import AsyncIterator
+
+import httpx
+from commonlib.models import ActionMetadata, ContestAction, ContestResult
+from commonlib.services import ContestClient as BaseContestClient
+from pydantic import BaseModel
+
+from .sharding import shard_of
+
+
+class MatchEvent(BaseModel):
+    """
+    Event of the match, `type` is one of turn, spells, cast, chunk, action and result
+    """
+
+    seq: int
+    type: str
+    user_id: int | None = None
+    spell_ids: list[int] | None = None
+    metadata: ActionMetadata | None = None
+    chunk: str | None = None
+    action: ContestAction | None = None
+    result: ContestResult | None = None
+
+
+# pause before reconnecting to the events, doubled after every reconnect without new events
+RECONNECT_DELAY = 1.0
+MAX_RECONNECT_DELAY = 30.0
+
+
+class ShardTransport(httpx.AsyncBaseTransport):
+    """
+    Sends the requests of a match to the contest worker of the shard encoded in its director id
+    """
+
+    def __init__(self, shards: dict[int, str], transport: httpx.AsyncBaseTransport | None = None):
+        self._shards = {shard: httpx.URL(url) for shard, url in shards.items()}
+        self._transport = transport or httpx.AsyncHTTPTransport()
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        director_id = request.url.params.get('director_id')
+        if director_id is not None:
+            worker = self._shards[shard_of(int(director_id))]
+            request.url = request.url.copy_with(scheme=worker.scheme, host=worker.host, port=worker.port)
+            request.headers['Host'] = worker.netloc.decode()
+        return await self._transport.handle_async_request(request)
+
+    async def aclose(self) -> None:
+        await self._transport.aclose()
+
+
+class ContestClient(BaseContestClient):
+    """
+    Extends the commonlib client with the endpoints which are not shared with other services yet.
+    With `shards`, requests are routed to the contest worker of the match.
+    """
+
+    def __init__(self, base_url: str, shards: dict[int, str] | None = None):
+        super().__init__(base_url)
+        if shards:
+            # the base constructor takes no transport, its client is replaced before it opens a connection
+            self.client = httpx.AsyncClient(base_url=base_url, transport=ShardTransport(shards))
+
+    async def events(self, director_id: int, user_id: int) -> AsyncIterator[MatchEvent]:
+        """
+        Events of the match until the result.
+        Reconnects after the last received event when the connection is lost or the stream ends early.
+        """
+        after = 0
+        delay = RECONNECT_DELAY
+        while True:
+            try:
+                async for event in self._events(director_id, user_id, after):
+                    after = event.seq
+                    delay = RECONNECT_DELAY
+                    yield event
+                    if event.type == 'result':
+                        return
+                logging.log(logging.WARNING, f'Events of director {director_id} ended before the result, reconnecting')
+            except httpx.TransportError:
+                logging.log(logging.WARNING, f'Events of director {director_id} are interrupted, reconnecting')
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, MAX_RECONNECT_DELAY)
+
+    async def _events(self, director_id: int, user_id: int, after: int) -> AsyncIterator[MatchEvent]:
+        async with self.client.stream(
+            'GET',
+            '/events',
+            params={'director_id': director_id, 'user_id': user_id, 'after': after},
+            timeout=None,
+        ) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                # `id` and `event` lines repeat the fields of the data
+                if line.startswith('data: '):
+                    yield MatchEvent.model_validate_json(line.removeprefix('data: '))
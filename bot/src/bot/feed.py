@@ -0,0 +1,172 @@
+import asyncio
+import json
+import logging
+from collections.abc import AsyncIterator
+from dataclasses import dataclass, field
+
+import aiohttp
+from pydantic import BaseModel, ValidationError
+
+from .contest import RECONNECT_DELAY, MatchEvent
+from .sharding import shard_of
+
+
+class FeedMessage(BaseModel):
+    """
+    Message of `/ws/events`, an event of the match or the reason the match is not followed
+    """
+
+    director_id: int
+    event: MatchEvent | None = None
+    error: str | None = None
+
+
+@dataclass
+class Subscription:
+    # events received so far, replayed to the players who start following the match later
+    events: list[MatchEvent] = field(default_factory=list)
+    # queues of the players of this bot, None ends the events
+    queues: list[asyncio.Queue[MatchEvent | None]] = field(default_factory=list)
+    user_ids: set[int] = field(default_factory=set)
+
+    @property
+    def after(self) -> int:
+        return self.events[-1].seq if self.events else 0
+
+
+class Connection:
+    """
+    WebSocket to one contest worker, which carries the events of all matches of the worker followed by the bot.
+    After a reconnect, the matches are subscribed to again after their last received events.
+    """
+
+    def __init__(self, session: aiohttp.ClientSession, url: str):
+        self._session = session
+        self._url = url
+        self._subscriptions: dict[int, Subscription] = {}
+        self._ws: aiohttp.ClientWebSocketResponse | None = None
+        self._connected = asyncio.Event()
+        self._task: asyncio.Task | None = None
+
+    async def events(self, director_id: int, user_id: int) -> AsyncIterator[MatchEvent]:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+        subscription = self._subscriptions.setdefault(director_id, Subscription())
+        queue: asyncio.Queue[MatchEvent | None] = asyncio.Queue()
+        for event in subscription.events:
+            queue.put_nowait(event)
+        subscription.queues.append(queue)
+        subscription.user_ids.add(user_id)
+        try:
+            await self._send('subscribe', director_id, user_id, subscription.after)
+            while (event := await queue.get()) is not None:
+                yield event
+                if event.type == 'result':
+                    return
+        finally:
+            subscription.queues.remove(queue)
+            if not subscription.queues and self._subscriptions.get(director_id) is subscription:
+                del self._subscriptions[director_id]
+                await self._send('unsubscribe', director_id)
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+        if self._ws is not None:
+            await self._ws.close()
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                async with self._session.ws_connect(self._url + '/ws/events', heartbeat=30) as ws:
+                    self._ws = ws
+                    # the matches followed from now on are subscribed to by `events`
+                    self._connected.set()
+                    for director_id, subscription in list(self._subscriptions.items()):
+                        for user_id in list(subscription.user_ids):
+                            await self._request(ws, 'subscribe', director_id, user_id, subscription.after)
+                    async for message in ws:
+                        if message.type == aiohttp.WSMsgType.TEXT:
+                            self._route(FeedMessage.model_validate_json(message.data))
+            except (aiohttp.ClientError, ConnectionError, ValidationError):
+                # a closed socket or a malformed message, the matches are subscribed to again after the reconnect
+                pass
+            finally:
+                self._connected.clear()
+                self._ws = None
+            logging.warning(f'Events feed of {self._url} is interrupted, reconnecting')
+            await asyncio.sleep(RECONNECT_DELAY)
+
+    def _route(self, message: FeedMessage) -> None:
+        subscription = self._subscriptions.get(message.director_id)
+        if subscription is None:
+            return
+        if message.error is not None:
+            logging.warning(f'Events of director {message.director_id} are not available: {message.error}')
+            del self._subscriptions[message.director_id]
+            for queue in subscription.queues:
+                queue.put_nowait(None)
+            return
+        assert message.event is not None
+        if message.event.seq <= subscription.after:
+            # repeated after a reconnect
+            return
+        subscription.events.append(message.event)
+        for queue in subscription.queues:
+            queue.put_nowait(message.event)
+
+    async def _send(self, action: str, director_id: int, user_id: int | None = None, after: int = 0) -> None:
+        """
+        The request is sent when connected, otherwise it is made by the reconnect
+        """
+        if self._connected.is_set() and self._ws is not None:
+            try:
+                await self._request(self._ws, action, director_id, user_id, after)
+            except ConnectionError:
+                pass
+
+    @staticmethod
+    async def _request(
+        ws: aiohttp.ClientWebSocketResponse,
+        action: str,
+        director_id: int,
+        user_id: int | None = None,
+        after: int = 0,
+    ) -> None:
+        await ws.send_str(
+            json.dumps({'action': action, 'director_id': director_id, 'user_id': user_id, 'after': after})
+        )
+
+
+class EventFeed:
+    """
+    Events of all matches of the bot over one WebSocket per contest worker,
+    so the number of connections does not grow with the number of matches.
+    """
+
+    def __init__(self, base_url: str, shards: dict[int, str] | None = None):
+        self._base_url = base_url
+        self._shards = shards or {}
+        self._session: aiohttp.ClientSession | None = None
+        self._connections: dict[str, Connection] = {}
+
+    async def events(self, director_id: int, user_id: int) -> AsyncIterator[MatchEvent]:
+        """
+        Events of the match until the result, the same as `ContestClient.events`
+        """
+        async for event in self._connection(director_id).events(director_id, user_id):
+            yield event
+
+    async def close(self) -> None:
+        for connection in self._connections.values():
+            await connection.close()
+        if self._session is not None:
+            await self._session.close()
+
+    def _connection(self, director_id: int) -> Connection:
+        url = self._shards[shard_of(director_id)] if self._shards else self._base_url
+        if url not in self._connections:
+            if self._session is None:
+                self._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=None))
+            self._connections[url] = Connection(self._session, url)
+        return self._connections[url]
@@ -1,19 +1,59 @@
 import asyncio
 import logging
+import time
 
+import httpx
 from aiogram import F
 from aiogram.filters.callback_data import CallbackData
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.scene import Scene, on
 from aiogram.types import CallbackQuery
 from aiogram.utils.keyboard import InlineKeyboardBuilder
-from commonlib.models import ContestAction, ContestResult, Wizard
-from commonlib.services import ContestClient
+from commonlib.models import ContestResult, Wizard
 
 from ..config import settings
+from ..contest import ContestClient
+from ..feed import EventFeed
+from ..sharding import parse_shards
 from ..utils import bot
 
-contest_client = ContestClient(settings.CONTEST_SERVICE_URL)
+contest_client = ContestClient(settings.CONTEST_SERVICE_URL, shards=parse_shards(settings.CONTEST_WORKERS))
+event_feed = EventFeed(settings.CONTEST_SERVICE_URL, shards=parse_shards(settings.CONTEST_WORKERS))
+
+
+class ProgressiveMessage:
+    """
+    Message that grows together with the streamed text.
+    It is sent on the first chunk and then edited no more often than once per `interval` seconds.
+    """
+
+    def __init__(self, chat_id: int, interval: float):
+        self._chat_id = chat_id
+        self._interval = interval
+        self._text = ''
+        self._sent_text = ''
+        self._message_id: int | None = None
+        self._last_update = 0.0
+
+    async def append(self, chunk: str) -> None:
+        self._text += chunk
+        if time.monotonic() - self._last_update >= self._interval:
+            await self._update()
+
+    async def finish(self) -> None:
+        await self._update()
+
+    async def _update(self) -> None:
+        if not self._text.strip() or self._text == self._sent_text:
+            return
+        text = self._text
+        if self._message_id is None:
+            message = await bot.send_message(chat_id=self._chat_id, text=text)
+            self._message_id = message.message_id
+        else:
+            await bot.edit_message_text(chat_id=self._chat_id, message_id=self._message_id, text=text)
+        self._sent_text = text
+        self._last_update = time.monotonic()
 
 
 class MatchScene(Scene, state='MatchScene'):
@@ -32,8 +72,36 @@ class MatchScene(Scene, state='MatchScene'):
         asyncio.create_task(self.start_match(user_id=user_id, state=state))
 
     async def start_match(self, user_id: int, state: FSMContext) -> None:
-        while (result := await self.do_match_iteration(state)) is None:
-            pass
+        """
+        Follows the events of the match until the result
+        """
+        director_id = await state.get_value('director_id')
+        narration: ProgressiveMessage | None = None
+        events = event_feed.events if settings.CONTEST_FEED else contest_client.events
+        async for event in events(director_id, user_id):
+            match event.type:
+                case 'turn' if event.user_id != user_id:
+                    await bot.send_message(chat_id=user_id, text='The opponent is choosing spell...')
+                case 'spells' if event.user_id == user_id:
+                    await self.send_make_turn_message(state, event.spell_ids)
+                case 'cast':
+                    wizard = event.metadata.caster_wizard
+                    spell = event.metadata.spell
+                    await bot.send_message(chat_id=user_id, text=f'<b>{wizard.name}</b> casted <b>{spell.name}</b>!')
+                    narration = ProgressiveMessage(chat_id=user_id, interval=settings.ACTION_EDIT_INTERVAL)
+                case 'chunk' if narration is not None:
+                    await narration.append(event.chunk)
+                case 'action' if narration is not None:
+                    await narration.finish()
+                    narration = None
+                case 'action':
+                    # the cast and its chunks were missed, e.g. while reconnecting
+                    await bot.send_message(chat_id=user_id, text=event.action.action)
+                case 'result':
+                    await self.send_result(user_id, event.result)
+
+    @staticmethod
+    async def send_result(user_id: int, result: ContestResult) -> None:
         if result.tie:
             await bot.send_message(
                 chat_id=user_id,
@@ -43,43 +111,10 @@ class MatchScene(Scene, state='MatchScene'):
 
         await bot.send_message(chat_id=user_id, text=f'The winner is <b>{result.winner.name}</b>')
 
-    async def do_match_iteration(self, state: FSMContext) -> ContestResult | None:
-        user_id = await state.get_value('user_id')
-        director_id = await state.get_value('director_id')
-
-        user_to_make_turn = await contest_client.get_user_to_make_turn(director_id)
-
-        if user_to_make_turn == user_id:
-            await self.send_make_turn_message(state)
-        else:
-            (
-                await bot.send_message(
-                    chat_id=user_id,
-                    text='The opponent is choosing spell...',
-                ),
-            )
-
-        action: ContestAction = await contest_client.get_action(director_id)
-
-        wizard = action.metadata.caster_wizard
-        spell = action.metadata.spell
-
-        await bot.send_message(chat_id=user_id, text=f'<b>{wizard.name}</b> casted <b>{spell.name}</b>!')
-
-        await bot.send_message(
-            chat_id=user_id,
-            text=action.action,
-        )
-
-        return action.result
-
-    async def send_make_turn_message(self, state) -> None:
+    async def send_make_turn_message(self, state, available_spells_ids: list[int]) -> None:
         user_id = await state.get_value('user_id')
-        director_id = await state.get_value('director_id')
         wizard = await state.get_value('wizard')
 
-        available_spells_ids = await contest_client.get_available_spells(director_id=director_id, user_id=user_id)
-
         spells_dict = {spell.id: spell for spell in wizard.spells}
 
         builder = InlineKeyboardBuilder()
@@ -109,4 +144,11 @@ class MatchScene(Scene, state='MatchScene'):
         assert spell_selection_message is not None
 
         await bot.delete_message(chat_id=query.from_user.id, message_id=spell_selection_message.message_id)
-        await contest_client.cast_spell(director_id=director_id, user_id=user_id, spell_id=spell_id)
+        try:
+            await contest_client.cast_spell(director_id=director_id, user_id=user_id, spell_id=spell_id)
+        except httpx.HTTPStatusError as e:
+            if e.response.status_code != 409:
+                raise
+            # the turn was already played by the autopilot or the match was forfeited
+            detail = e.response.json()['detail']
+            await bot.send_message(chat_id=query.from_user.id, text=f'The spell is not cast: {detail}')
@@ -0,0 +1,20 @@
+# the lowest bits of a director id are the shard of the contest worker which runs the match,
+# a copy of coordinator/sharding.py, which is the reference for the id layout
+SHARD_BITS = 16
+
+
+def shard_of(director_id: int) -> int:
+    return director_id & ((1 << SHARD_BITS) - 1)
+
+
+def parse_shards(workers: str) -> dict[int, str]:
+    """
+    :param workers: comma-separated `shard=url` pairs, e.g. `0=http://contest-0:8000,1=http://contest-1:8000`
+    :return: worker urls by shard
+    """
+    shards = {}
+    for worker in workers.split(','):
+        if worker.strip():
+            shard, url = worker.split('=', 1)
+            shards[int(shard)] = url.strip()
+    return shards
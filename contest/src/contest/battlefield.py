@@ -1,9 +1,20 @@
+import logging
+from collections.abc import AsyncIterator
+
+import httpx
 from commonlib.models import ContestResult, Message, Pair, Spell, SpellBase, SpellType, Wizard
-from commonlib.services.llm import LLMClient
+from pydantic import BaseModel
 
-from .config import settings
+from .config import Settings, settings
+from .journal import JournalTransport, match_journal
+from .llm import LLMClient
+from .scheduler import create_scheduler
+from .transcript import Transcript, estimate_tokens, transcript_tokens
 
-llm_client = LLMClient(settings.LLM_SERVICE_URL)
+llm_client = LLMClient(
+    settings.LLM_SERVICE_URL,
+    transport=JournalTransport(match_journal) if match_journal is not None else None,
+)
 
 DUMMY_SPELL = Spell(
     id=-1,
@@ -14,33 +25,62 @@ DUMMY_SPELL = Spell(
 )
 
 
+class BattlefieldState(BaseModel):
+    """
+    Serializable part of the battlefield, the wizards are kept by the director
+    """
+
+    used_spells: list[int] = []
+    actions: list[Message] = []
+    summary: str = ''
+    summarized: int = 0
+    next_user_to_make_turn: int | None = None
+    session_id: str | None = None
+    scheduler: dict = {}
+
+
 class Battlefield:
-    def __init__(self):
+    def __init__(self, config: Settings | None = None, client: LLMClient | None = None):
+        # a replay plays the match with its recorded settings and the LLM answers from the journal
+        self._settings = settings if config is None else config
+        self._llm = llm_client if client is None else client
         self._wizards: dict[int, Wizard] = {}
         self._used_spells: set[int] = set()
-        self._actions: list[Message] = []
+        # decided together with the previous action when turns are fused
+        self._next_user_to_make_turn: int | None = None
+        self._session_id: str | None = None
+        self._scheduler = create_scheduler(
+            self._settings.TURN_SCHEDULER,
+            wizards=self._wizards,
+            ask_llm=self._ask_llm_for_turn,
+            ambiguity_margin=self._settings.TURN_AMBIGUITY_MARGIN,
+        )
+        self._transcript = Transcript(
+            summarize=self._llm.summarize_actions,
+            compact=self._settings.TRANSCRIPT_COMPACTION,
+            keep_turns=self._settings.TRANSCRIPT_KEEP_TURNS,
+            token_budget=self._settings.TRANSCRIPT_TOKEN_BUDGET,
+            summary_tokens=self._settings.TRANSCRIPT_SUMMARY_TOKENS,
+        )
 
     def set_wizard(self, user_id: int, wizard: Wizard):
         self._wizards[user_id] = wizard
 
     async def start_contest(self):
         wizards = Pair(self._wizards.values())
-        await llm_client.start_contest(wizards)
+        await self._llm.start_contest(wizards)
+        if self._settings.LLM_SESSIONS:
+            self._session_id = await self._llm.create_session(wizards)
 
     async def get_user_to_make_turn(self) -> int:
         """
         Determines the player that should act this turn based on happened events
         :return: user_id of player that should play this turn.
         """
-        wizards = Pair(self._wizards.values())
-        wizard_index = await llm_client.determine_turn(
-            actions=self._actions,
-            wizards=wizards.model_dump(),
-        )
-        for user_id, wizard in self._wizards.items():
-            if wizard.id == wizards[wizard_index].id:
-                return user_id
-        assert False
+        try:
+            return await self._scheduler.next_turn()
+        finally:
+            self._next_user_to_make_turn = None
 
     async def get_available_spells(self, user_id: int) -> list[int]:
         """
@@ -51,20 +91,78 @@ class Battlefield:
 
     async def cast_spell(self, user_id: int, spell_id: int) -> str:
         wizard = self._wizards[user_id]
+        spell = self._use_spell(wizard, spell_id)
+        if self._settings.FUSED_TURNS:
+            return await self._generate_turn(user_id, spell)
+        action = await self._generate_action(user_id, spell)
+        return action
 
-        if spell_id == -1:
-            spell = DUMMY_SPELL
+    async def cast_spell_stream(self, user_id: int, spell_id: int) -> AsyncIterator[str]:
+        """
+        Same as `cast_spell`, but yields the action text chunk by chunk while it is generated.
+        Fused turns are generated as JSON, so the action is yielded at once.
+        """
+        if self._settings.FUSED_TURNS:
+            yield await self.cast_spell(user_id, spell_id)
+            return
+        wizard = self._wizards[user_id]
+        spell = self._use_spell(wizard, spell_id)
+        if self._session_id is not None:
+            chunks = self._llm.session_generate_action_stream(self._session_id, **self._session_params(user_id, spell))
         else:
-            assert spell_id not in self._used_spells
-
-            spell = self._find_spell(wizard, spell_id)
-            self._used_spells.add(spell.id)
+            chunks = self._llm.generate_action_stream(**self._generate_action_params(wizard, spell))
+        response = None
+        async for chunk in chunks:
+            if chunk.response is not None:
+                response = chunk.response
+            elif chunk.chunk:
+                yield chunk.chunk
+        assert response is not None, 'Action stream ended without the response'
+        self._transcript.append(response.new_actions)
+
+    def close(self) -> None:
+        self._transcript.close()
+
+    async def end_session(self) -> None:
+        """
+        Frees the session of the match on the llm side, the llm service keeps a limited number of them
+        """
+        session_id, self._session_id = self._session_id, None
+        if session_id is None:
+            return
+        try:
+            await self._llm.session_delete(session_id)
+        except httpx.HTTPError:
+            # the session expires on the llm side anyway
+            logging.warning('Session %s of the match was not deleted', session_id, exc_info=True)
+
+    def snapshot(self) -> BattlefieldState:
+        actions, summary, summarized = self._transcript.snapshot()
+        return BattlefieldState(
+            used_spells=sorted(self._used_spells),
+            actions=actions,
+            summary=summary,
+            summarized=summarized,
+            next_user_to_make_turn=self._next_user_to_make_turn,
+            session_id=self._session_id,
+            scheduler=self._scheduler.snapshot(),
+        )
 
-        action = await self._generate_action(wizard, spell)
-        return action
+    def restore(self, state: BattlefieldState) -> None:
+        """
+        Continues the contest from the snapshot. Wizards are to be set before.
+        """
+        self._used_spells = set(state.used_spells)
+        self._transcript.restore(state.actions, state.summary, state.summarized)
+        self._next_user_to_make_turn = state.next_user_to_make_turn
+        self._session_id = state.session_id
+        self._scheduler.restore(state.scheduler)
 
     async def get_winner(self) -> ContestResult:
-        winner_name = await llm_client.pick_winner(self._actions)
+        if self._session_id is not None:
+            winner_name = await self._llm.session_pick_winner(self._session_id)
+        else:
+            winner_name = await self._llm.pick_winner(self._transcript_messages())
         if winner_name is None:
             return ContestResult(tie=True)
         for wizard in self._wizards.values():
@@ -72,15 +170,79 @@ class Battlefield:
                 return ContestResult(winner=wizard)
         raise ValueError(f'No wizard named {winner_name}')
 
-    async def _generate_action(self, wizard: Wizard, spell: SpellBase) -> str:
-        response = await llm_client.generate_action(
-            previous_actions=self._actions,
-            wizard=wizard.model_dump(),
-            spell=SpellBase(**spell.model_dump()).model_dump(),
-        )
-        self._actions += response.new_actions
+    async def _ask_llm_for_turn(self) -> int:
+        if self._next_user_to_make_turn is not None:
+            return self._next_user_to_make_turn
+        wizards = Pair(self._wizards.values())
+        if self._session_id is not None:
+            wizard_index = await self._llm.session_determine_turn(self._session_id)
+        else:
+            wizard_index = await self._llm.determine_turn(
+                actions=self._transcript_messages(),
+                wizards=wizards.model_dump(),
+            )
+        return self._user_of(wizards[wizard_index])
+
+    async def _generate_action(self, user_id: int, spell: SpellBase) -> str:
+        if self._session_id is not None:
+            response = await self._llm.session_generate_action(self._session_id, **self._session_params(user_id, spell))
+        else:
+            response = await self._llm.generate_action(**self._generate_action_params(self._wizards[user_id], spell))
+        self._transcript.append(response.new_actions)
+        return response.description
+
+    async def _generate_turn(self, user_id: int, spell: SpellBase) -> str:
+        wizards = Pair(self._wizards.values())
+        if self._session_id is not None:
+            response = await self._llm.session_generate_turn(self._session_id, **self._session_params(user_id, spell))
+        else:
+            response = await self._llm.generate_turn(
+                **self._generate_action_params(self._wizards[user_id], spell),
+                wizards=wizards.model_dump(),
+            )
+        self._transcript.append(response.new_actions)
+        self._next_user_to_make_turn = self._user_of(wizards[response.next_wizard])
         return response.description
 
+    def _generate_action_params(self, wizard: Wizard, spell: SpellBase) -> dict:
+        return {
+            'previous_actions': self._transcript_messages(),
+            'wizard': wizard.model_dump(),
+            'spell': SpellBase(**spell.model_dump()).model_dump(),
+        }
+
+    def _transcript_messages(self) -> list[Message]:
+        """
+        Transcript for a request, its size is observed for every request it is sent with
+        """
+        messages = self._transcript.messages()
+        transcript_tokens.observe(estimate_tokens(messages))
+        return messages
+
+    def _session_params(self, user_id: int, spell: SpellBase) -> dict:
+        """
+        The session keeps the history and the wizards, so only the current turn is sent.
+        The wizard is sent as its index in the session, which follows the order the wizards were set in.
+        """
+        return {
+            'wizard_index': list(self._wizards).index(user_id),
+            'spell': SpellBase(**spell.model_dump()).model_dump(),
+        }
+
+    def _user_of(self, wizard: Wizard) -> int:
+        for user_id, candidate in self._wizards.items():
+            if candidate.id == wizard.id:
+                return user_id
+        assert False, f'Not reachable. \n{wizard=}'
+
+    def _use_spell(self, wizard: Wizard, spell_id: int) -> Spell:
+        if spell_id == -1:
+            return DUMMY_SPELL
+        assert spell_id not in self._used_spells
+        spell = self._find_spell(wizard, spell_id)
+        self._used_spells.add(spell.id)
+        return spell
+
     @staticmethod
     def _find_spell(wizard: Wizard, spell_id: int) -> Spell:
         for spell in wizard.spells:
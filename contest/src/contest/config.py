@@ -1,10 +1,68 @@
 # mypy: ignore-errors
+import typing as tp
+from pathlib import Path
+
 from pydantic_settings import BaseSettings
 
 
 class Settings(BaseSettings):
     LLM_SERVICE_URL: str = 'http://llm:8000'
     TURNS_COUNT: int = 4
+    STREAM_ACTIONS: bool = True
+    # narrate the action and pick the next caster with one LLM call
+    FUSED_TURNS: bool = False
+    # determine the next caster while players are still receiving the action
+    SPECULATIVE_TURNS: bool = True
+
+    # `llm` asks the LLM every turn, `initiative` schedules by speed,
+    # `hybrid` asks the LLM only when the initiative is tied
+    TURN_SCHEDULER: tp.Literal['llm', 'initiative', 'hybrid'] = 'llm'
+    # initiative difference, in shares of the total speed, which is considered a tie
+    TURN_AMBIGUITY_MARGIN: float = 0.0
+
+    # the caster who does not cast for TURN_TIMEOUT seconds gets a spell cast by the autopilot, 0 disables it.
+    # After TURN_FORFEIT_TIMEOUTS timeouts in a row the player forfeits the match
+    TURN_TIMEOUT: float = 120
+    TURN_FORFEIT_TIMEOUTS: int = 2
+    # `dummy` casts the simple attack, `cheapest` the available spell of the lowest manacost
+    AUTOPILOT_SPELL: tp.Literal['dummy', 'cheapest'] = 'cheapest'
+    # resolution of the turn deadlines
+    TURN_TIMER_TICK: float = 1.0
+
+    # abandoned matches are evicted after the TTL or when idle
+    DIRECTORS_MAX_LIVE: int = 1000
+    DIRECTORS_TTL: float = 2 * 60 * 60
+    DIRECTORS_IDLE_TIMEOUT: float = 15 * 60
+    DIRECTORS_SWEEP_INTERVAL: float = 60
+    # shard of this worker in a sharded deployment, it is encoded in the ids of the directors
+    SHARD_ID: int | None = None
+
+    # match state is checkpointed after every stage transition, so any worker can resume the match.
+    # `file` keeps a JSON file per match in the SNAPSHOT_PATH directory, `sqlite` a database at SNAPSHOT_PATH
+    SNAPSHOT_STORE: tp.Literal['none', 'memory', 'file', 'sqlite', 'postgres'] = 'none'
+    SNAPSHOT_PATH: Path = Path('snapshots')
+    SNAPSHOT_DSN: str = 'postgresql://contest@postgres/contest'
+
+    # events of a match kept for the subscribers who resume, and buffered for every subscriber
+    EVENTS_HISTORY_SIZE: int = 1024
+    EVENTS_BUFFER_SIZE: int = 256
+    # messages buffered for a connection of the multiplexed feed, which follows many matches
+    FEED_BUFFER_SIZE: int = 4096
+    # conditional requests of `/match_state` wait for the state to change no longer than this
+    MATCH_STATE_TIMEOUT: float = 30
+
+    # append-only journal of the matches for the replay, records are synced every JOURNAL_FSYNC_INTERVAL seconds
+    JOURNAL_PATH: Path | None = None
+    JOURNAL_FSYNC_INTERVAL: float = 1.0
+
+    # keep the match history in a session of the llm service instead of sending it with every request
+    LLM_SESSIONS: bool = False
+
+    # send only the last turns verbatim and summarize the older ones
+    TRANSCRIPT_COMPACTION: bool = False
+    TRANSCRIPT_KEEP_TURNS: int = 2
+    TRANSCRIPT_TOKEN_BUDGET: int = 1500
+    TRANSCRIPT_SUMMARY_TOKENS: int = 300
 
 
 settings = Settings()
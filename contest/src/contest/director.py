@@ -1,23 +1,171 @@
 import asyncio
+import contextvars
+import logging
+import time
 import typing as tp
-from dataclasses import dataclass
+from collections.abc import AsyncIterator
+from enum import StrEnum
 
 from commonlib.models import ActionMetadata, ContestAction, ContestResult, Wizard
+from pydantic import BaseModel
 
-from .battlefield import Battlefield, DUMMY_SPELL
-from .config import settings
+from .battlefield import DUMMY_SPELL, Battlefield, BattlefieldState
+from .config import Settings, settings
+from .events import EventLog, EventType, MatchEvent
+from .journal import MATCH_SETTINGS, Journal, current_match, match_journal
+from .metrics import SECONDS_BUCKETS, registry
+from .snapshots import SnapshotStore
+from .timers import Timer, TimerWheel, turn_timers
 
+turn_determination_seconds = registry.histogram(
+    'contest_turn_determination_seconds',
+    'Duration of the next turn determination, by mode',
+    SECONDS_BUCKETS,
+)
+turn_blocked_seconds = registry.histogram(
+    'contest_turn_blocked_seconds',
+    'Time the match waited for the next turn determination after the action was delivered, by mode',
+    SECONDS_BUCKETS,
+)
+turn_overlap_seconds = registry.counter(
+    'contest_turn_overlap_seconds_total',
+    'Time of speculative turn determination hidden behind the action delivery',
+)
+turn_cancelled = registry.counter(
+    'contest_turn_determinations_cancelled_total',
+    'Speculative turn determinations cancelled because the match ended',
+)
+checkpoint_seconds = registry.histogram(
+    'contest_checkpoint_seconds',
+    'Duration of saving the match state to the snapshot store',
+    SECONDS_BUCKETS,
+)
+checkpoint_errors = registry.counter('contest_checkpoint_errors_total', 'Failed saves of the match state')
+turn_timeouts = registry.counter('contest_turn_timeouts_total', 'Turns the caster did not cast in time, by outcome')
 
-@dataclass
-class MatchState:
-    """Represents the current state of a match"""
+
+class PlayerNotFoundError(KeyError):
+    pass
+
+
+class CastRejectedError(Exception):
+    pass
+
+
+class MatchClosedError(Exception):
+    pass
+
+
+class ActionStream:
+    """
+    Text of the action being generated.
+    Every subscriber receives all chunks from the beginning, no matter when it subscribed.
+    """
+
+    def __init__(self):
+        self._chunks: list[str] = []
+        self._closed = False
+        self._changed = asyncio.Event()
+
+    @property
+    def text(self) -> str:
+        return ''.join(self._chunks)
+
+    def push(self, chunk: str) -> None:
+        assert not self._closed
+        self._chunks.append(chunk)
+        self._notify()
+
+    def close(self) -> None:
+        self._closed = True
+        self._notify()
+
+    async def subscribe(self) -> AsyncIterator[str]:
+        index = 0
+        while True:
+            if index < len(self._chunks):
+                index += 1
+                yield self._chunks[index - 1]
+            elif self._closed:
+                return
+            else:
+                await self._changed.wait()
+
+    def _notify(self) -> None:
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+
+class ActionChunk(BaseModel):
+    """
+    Line of `/get_action_stream`. The first one carries the metadata, the rest carry the text.
+    """
+    metadata: ActionMetadata | None = None
+    chunk: str | None = None
+
+
+class Stage(StrEnum):
+    # waiting for the wizards of both players
+    WIZARDS = 'wizards'
+    # the caster of the turn is being determined
+    DETERMINING = 'determining'
+    # players request the turn order
+    TURN = 'turn'
+    # waiting for the caster's spell
+    SPELL = 'spell'
+    # the action is being generated
+    CASTING = 'casting'
+    # players request the action
+    ACTION = 'action'
+    # the result was delivered to every player
+    FINISHED = 'finished'
+
+
+class MatchState(BaseModel):
+    """Serializable state of a match, checkpointed after every change"""
+    stage: Stage = Stage.WIZARDS
+    step: int = 0
+    wizards: dict[int, Wizard] = {}
     user_to_make_turn: int | None = None
+    # caster of the next turn if it was determined speculatively
+    next_turn: int | None = None
+    spell_id: int | None = None
     action: str | None = None
     action_metadata: ActionMetadata | None = None
     result: ContestResult | None = None
+    turn_requests: int = 0
+    action_requests: int = 0
+    # players who receive the events instead of polling
+    subscribers: list[int] = []
+    # turns in a row every player did not cast in time
+    timeouts: dict[int, int] = {}
+    events_seq: int = 0
+    battlefield: BattlefieldState = BattlefieldState()
+
+
+class MatchView(BaseModel):
+    """
+    State of the match for one player, the response of `/match_state`
+    """
+    stage: Stage
+    step: int
+    # caster of the current turn once it is determined
+    user_to_make_turn: int | None = None
+    # spells of the player when it is their turn to cast
+    available_spell_ids: list[int] | None = None
+    # action of the current turn, or of the previous one until the next spell is cast
+    action: ContestAction | None = None
+    result: ContestResult | None = None
 
 
-Match = tp.AsyncGenerator[int, int]
+# stages in which every event is set, the rest of the stages clear it.
+# Late requests to a finished match, like the cast of a player who forfeited, are released
+EVENT_STAGES = {
+    '_stage_0': {Stage.TURN, Stage.SPELL, Stage.CASTING, Stage.FINISHED},
+    '_stage_1': {Stage.SPELL, Stage.CASTING, Stage.FINISHED},
+    '_cast_started': {Stage.CASTING, Stage.ACTION, Stage.FINISHED},
+    '_stage_2': {Stage.ACTION, Stage.FINISHED},
+}
 
 
 class Director:
@@ -27,48 +175,175 @@ class Director:
     and the turn order is determined.
     Stage 1. Users request turn orders
     Stage 2. The caster requests available spells and sends the cast information.
-    After that, the action is created.
+    After that, the action is created. Users may already stream it while it is being generated.
     Stage 3. Users request the action.
+
+    The match is a state machine over `Stage`. With a snapshot store its state is saved after every change,
+    so any worker can continue the match with `Director.restore`.
+
+    Players may subscribe to the events of the match instead of polling. The match does not wait for
+    the subscribers to request the turn and the action, they receive them with the events.
+    The requests are counted, not their senders, so a subscriber must not request the turn or the action as well.
+
+    The caster has TURN_TIMEOUT seconds to cast, otherwise the autopilot casts instead.
+    A player who keeps missing the deadline forfeits the match.
     """
 
-    def __init__(self, battlefield: Battlefield | None = None):
-        self._wizards: dict[int, Wizard] = {}
+    def __init__(
+        self,
+        battlefield: Battlefield | None = None,
+        director_id: int | None = None,
+        store: SnapshotStore | None = None,
+        timers: TimerWheel | None = None,
+        journal: Journal | None = None,
+        config: Settings | None = None,
+    ):
+        self._settings = settings if config is None else config
         if battlefield is None:
-            self._battlefield = Battlefield()
+            self._battlefield = Battlefield(self._settings)
         else:
             self._battlefield = battlefield
-        self._match: Match | None = None
-        self._state: MatchState = MatchState()
+        self._id = director_id
+        self._store = store
+        self._state = MatchState()
+        self._saving = asyncio.Lock()
+        self._timers = turn_timers if timers is None else timers
+        self._deadline: Timer | None = None
+        self._journal = match_journal if journal is None else journal
 
         self._stage_0 = asyncio.Event()
         self._stage_1 = asyncio.Event()
         self._stage_2 = asyncio.Event()
-        self._stage_3 = asyncio.Event()
+        self._cast_started = asyncio.Event()
+        # replaced with a new one on every stage transition
+        self._changed = asyncio.Event()
+        # set by `close`, the waiting requests are released with `MatchClosedError`
+        self._closed = False
+
+        self.events = EventLog(self._settings.EVENTS_HISTORY_SIZE, self._settings.EVENTS_BUFFER_SIZE)
+        self._action_stream = ActionStream()
+        # determination of the next caster started while players receive the action
+        self._next_turn_task: asyncio.Task[tuple[int, float]] | None = None
+        self._tasks: set[asyncio.Task] = set()
+        # subscribers who were served the state of the finished match
+        self._served_finished: set[int] = set()
+        self._record('match', settings={name: getattr(self._settings, name) for name in MATCH_SETTINGS})
+
+    @classmethod
+    def restore(cls, director_id: int, snapshot: str, store: SnapshotStore | None = None) -> 'Director':
+        """
+        Continues the match from the snapshot, including the work in progress when it was taken
+        """
+        director = cls(director_id=director_id, store=store)
+        state = director._state = MatchState.model_validate_json(snapshot)
+        for user_id, wizard in state.wizards.items():
+            director._battlefield.set_wizard(user_id, wizard)
+        director._battlefield.restore(state.battlefield)
+        director.events.seq = state.events_seq
+        if state.action is not None:
+            director._action_stream.push(state.action)
+            director._action_stream.close()
+        director._sync_events()
+        director._record('restore', stage=state.stage, step=state.step)
+        match state.stage:
+            case Stage.DETERMINING:
+                director._spawn(director._start_turn())
+            case Stage.TURN | Stage.SPELL:
+                if state.stage == Stage.SPELL:
+                    director._arm_deadline()
+                director._spawn(director._resume_turn())
+            case Stage.CASTING:
+                director._action_stream = ActionStream()
+                director._publish(EventType.CAST, metadata=state.action_metadata)
+                director._spawn(director._cast())
+            case Stage.ACTION:
+                director._announce_action()
+                director._spawn(director._advance())
+            case Stage.FINISHED:
+                director._announce_action()
+                director.events.close()
+        return director
+
+    @property
+    def _wizards(self) -> dict[int, Wizard]:
+        return self._state.wizards
+
+    @property
+    def stage(self) -> Stage:
+        return self._state.stage
 
-        # stage 1
-        self._turn_request_counter = 0
-        self._action_request_counter = 0
+    def is_player(self, user_id: int) -> bool:
+        return user_id in self._state.wizards
+
+    @property
+    def step(self) -> int:
+        return self._state.step
+
+    @property
+    def version(self) -> str:
+        """
+        Identifies the state of the match, every stage is passed once a step, even by a restored match
+        """
+        return f'{self._state.step}.{self._state.stage}'
 
     async def set_wizard(self, user_id: int, wizard: Wizard) -> None:
+        current_match.set(self._id)
+        self._record('wizard', user_id=user_id, wizard=wizard.model_dump(mode='json'))
         self._battlefield.set_wizard(user_id, wizard)
-        self._wizards[user_id] = wizard
-        if len(self._wizards) == 2:
-            await self._battlefield.start_contest()
-            self._match = self._create_match()
-            asyncio.create_task(anext(self._match))
+        self._state.wizards[user_id] = wizard
+        if len(self._state.wizards) < 2:
+            await self._checkpoint()
+            return
+        await self._battlefield.start_contest()
+        await self._transition(Stage.DETERMINING)
+        self._spawn(self._start_turn())
 
     async def get_user_to_make_turn(self) -> int:
-        await self._stage_0.wait()
-        self._turn_request_counter += 1
-        if self._turn_request_counter == 2:
-            self._stage_1.set()
-            self._turn_request_counter = 0
-        return self._state.user_to_make_turn
+        await self._wait(self._stage_0)
+        user_id = self._state.user_to_make_turn
+        self._state.turn_requests += 1
+        await self._advance()
+        return user_id
+
+    def check_cast(self, user_id: int) -> None:
+        """
+        Rejects a cast which can not be accepted, e.g. one which lost to the autopilot or to a forfeit.
+        A cast before the turn reaches the spell stage is waited for by `cast_spell`.
+        """
+        stage = self._state.stage
+        if stage in (Stage.CASTING, Stage.ACTION, Stage.FINISHED):
+            raise CastRejectedError('The spell is already cast' if stage != Stage.FINISHED else 'The match is finished')
+        if stage == Stage.SPELL and user_id != self._state.user_to_make_turn:
+            raise CastRejectedError("Not this player's turn")
 
     async def cast_spell(self, user_id: int, spell_id: int) -> None:
-        assert len(self._wizards) == 2
-        assert user_id == self._state.user_to_make_turn, "Not this player's turn"
-        await self._match.asend(spell_id)
+        """
+        Waits for the spell stage and accepts the cast, the action is generated in the background.
+        Raises `CastRejectedError` when the cast can not be accepted, e.g. after another cast won the turn.
+        """
+        current_match.set(self._id)
+        assert len(self._state.wizards) == 2
+        self.check_cast(user_id)
+        await self._wait(self._stage_1)
+        # checked again with no await before the transition, so only one of the concurrent casts is accepted
+        self.check_cast(user_id)
+        self._state.timeouts[user_id] = 0
+        self._record('cast', user_id=user_id, spell_id=spell_id, step=self._state.step)
+        await self._start_cast(user_id, spell_id)
+
+    async def _start_cast(self, user_id: int, spell_id: int) -> None:
+        self._cancel_deadline()
+        wizard = self._state.wizards[user_id]
+        if spell_id == -1:
+            casted_spell = DUMMY_SPELL
+        else:
+            casted_spell = next(spell for spell in wizard.spells if spell.id == spell_id)
+        self._state.spell_id = spell_id
+        self._state.action_metadata = ActionMetadata(caster_wizard=wizard, spell=casted_spell)
+        self._action_stream = ActionStream()
+        await self._transition(Stage.CASTING)
+        self._publish(EventType.CAST, metadata=self._state.action_metadata)
+        self._spawn(self._cast())
 
     @property
     def action(self) -> str:
@@ -84,54 +359,347 @@ class Director:
     def result(self) -> ContestResult | None:
         return self._state.result
 
+    @property
+    def finished(self) -> bool:
+        """
+        Whether the result was delivered to every player
+        """
+        return self._state.stage == Stage.FINISHED
+
     async def get_contest_action(self) -> ContestAction:
-        await self._stage_2.wait()
-        self._action_request_counter += 1
-        if self._action_request_counter == len(self._wizards):
-            self._stage_3.set()
-            self._action_request_counter = 0
-        return ContestAction(
+        await self._wait(self._stage_2)
+        action = ContestAction(
             action=self.action,
             metadata=self.action_metadata,
             result=self.result,
         )
+        self._state.action_requests += 1
+        await self._advance()
+        return action
+
+    async def subscribe(self, user_id: int | None = None, after: int = 0) -> AsyncIterator[MatchEvent]:
+        """
+        Events of the match after the sequence number `after`.
+        The player `user_id` is not waited for to request the turn and the action from now on.
+        """
+        if user_id is not None:
+            await self.add_subscriber(user_id)
+        events = self.events.subscribe(after)
+        async for event in events:
+            yield event
+
+    async def add_subscriber(self, user_id: int) -> None:
+        """
+        The player receives the events and is not waited for to request the turn and the action
+        """
+        if not self.is_player(user_id):
+            raise PlayerNotFoundError(user_id)
+        if user_id not in self._state.subscribers:
+            self._state.subscribers.append(user_id)
+            await self._advance()
+
+    async def get_match_view(self, user_id: int) -> MatchView:
+        state = self._state
+        view = MatchView(stage=state.stage, step=state.step, result=state.result)
+        if state.stage not in (Stage.WIZARDS, Stage.DETERMINING):
+            view.user_to_make_turn = state.user_to_make_turn
+        if state.stage == Stage.SPELL and user_id == state.user_to_make_turn:
+            view.available_spell_ids = await self._battlefield.get_available_spells(user_id)
+        if state.action is not None and state.stage != Stage.CASTING:
+            view.action = ContestAction(action=self.action, metadata=self.action_metadata, result=self.result)
+        return view
+
+    def serve_finished(self, user_id: int) -> bool:
+        """
+        Records that the finished match was served to the subscriber
+        :return: whether it was served to every subscriber
+        """
+        self._served_finished.add(user_id)
+        return self._served_finished >= set(self._state.subscribers)
+
+    async def wait_for_change(self, version: str) -> None:
+        """
+        Waits until the match leaves the state `version`
+        """
+        while self.version == version:
+            await self._wait(self._changed)
+
+    async def stream_contest_action(self) -> AsyncIterator[ActionChunk]:
+        """
+        Streams the action of the current turn while it is generated.
+        It does not replace `get_contest_action`, which is still required to finish the turn.
+        """
+        await self._cast_started.wait()
+        if self._closed:
+            return
+        yield ActionChunk(metadata=self.action_metadata)
+        async for chunk in self._action_stream.subscribe():
+            yield ActionChunk(chunk=chunk)
 
     async def get_available_spells(self, user_id: int) -> list[int]:
         return await self._battlefield.get_available_spells(user_id)
 
-    async def _create_match(self) -> Match:
-        for step in range(settings.TURNS_COUNT):
-            self._state.user_to_make_turn = await self._battlefield.get_user_to_make_turn()
+    def close(self) -> None:
+        """
+        Stops the background work of an unfinished match and releases the requests waiting for it
+        """
+        self._closed = True
+        for event in (self._stage_0, self._stage_1, self._stage_2, self._cast_started, self._changed):
+            event.set()
+        self._cancel_deadline()
+        self._cancel_next_turn()
+        for task in list(self._tasks):
+            task.cancel()
+        self._battlefield.close()
+        self.events.close()
+
+    async def release(self) -> None:
+        """
+        Stops the match and frees its resources outside the worker, the match cannot be resumed afterwards
+        """
+        self.close()
+        await self._battlefield.end_session()
+
+    async def _start_turn(self) -> None:
+        self._state.user_to_make_turn = await self._next_turn()
+        await self._transition(Stage.TURN)
+        await self._resume_turn()
+
+    async def _resume_turn(self) -> None:
+        await self._announce_turn()
+        await self._advance()
+
+    async def _advance(self) -> None:
+        """
+        Moves on when every polling player has requested the turn or the action
+        """
+        polling = self._polling
+        if self._state.stage == Stage.TURN and self._state.turn_requests >= polling:
+            self._state.turn_requests = 0
+            await self._transition(Stage.SPELL)
+        elif self._state.stage == Stage.ACTION and self._state.action_requests >= polling:
+            self._state.action_requests = 0
+            if self.result is not None:
+                await self._transition(Stage.FINISHED)
+                self.events.close()
+            else:
+                self._state.step += 1
+                await self._transition(Stage.DETERMINING)
+                self._spawn(self._start_turn())
+        else:
+            await self._checkpoint()
+
+    @property
+    def _polling(self) -> int:
+        """
+        Number of players who request the turn and the action instead of receiving the events
+        """
+        return len(self._state.wizards) - len(self._state.subscribers)
+
+    async def _announce_turn(self) -> None:
+        user_id = self._state.user_to_make_turn
+        self._publish(EventType.TURN, user_id=user_id)
+        spell_ids = await self._battlefield.get_available_spells(user_id)
+        self._publish(EventType.SPELLS, user_id=user_id, spell_ids=spell_ids)
+
+    def _announce_action(self) -> None:
+        self._record(
+            'action',
+            step=self._state.step,
+            action=self.action,
+            result=self.result.model_dump(mode='json') if self.result is not None else None,
+        )
+        self._publish(
+            EventType.ACTION,
+            action=ContestAction(action=self.action, metadata=self.action_metadata, result=self.result),
+        )
+        if self.result is not None:
+            self._publish(EventType.RESULT, result=self.result)
+
+    def _publish(self, type_: EventType, **fields) -> None:
+        self.events.publish(type_, **fields)
+        self._state.events_seq = self.events.seq
+
+    async def _cast(self) -> None:
+        user_id, spell_id = self._state.user_to_make_turn, self._state.spell_id
+        assert spell_id is not None
+        self._state.action = await self._do_cast_spell(user_id, spell_id)
+        if self._state.step == self._settings.TURNS_COUNT - 1:
+            self._state.result = await self._get_winner()
+            self._battlefield.close()
+        elif self._settings.SPECULATIVE_TURNS and self._polling:
+            # overlaps the requests of the action, without polling players the next turn starts right away
+            self._next_turn_task = asyncio.create_task(self._speculate_turn())
+        await self._transition(Stage.ACTION)
+        self._announce_action()
+        await self._advance()
 
-            self._stage_2 = asyncio.Event()
-            self._stage_3 = asyncio.Event()
+    async def _transition(self, stage: Stage) -> None:
+        self._state.stage = stage
+        self._record('stage', stage=stage, step=self._state.step)
+        self._sync_events()
+        self._changed.set()
+        self._changed = asyncio.Event()
+        if stage == Stage.SPELL:
+            self._arm_deadline()
+        await self._checkpoint()
 
-            self._stage_0.set()
-            await self._stage_1.wait()
+    def _arm_deadline(self) -> None:
+        if self._settings.TURN_TIMEOUT > 0:
+            step = self._state.step
+            self._deadline = self._timers.schedule(self._settings.TURN_TIMEOUT, lambda: self._spawn(self._miss_turn(step)))
 
-            spell_id = yield
+    def _cancel_deadline(self) -> None:
+        deadline, self._deadline = self._deadline, None
+        if deadline is not None:
+            deadline.cancel()
 
-            assert spell_id is not None
+    async def _miss_turn(self, step: int) -> None:
+        """
+        The caster did not cast in time. The autopilot casts instead, unless the caster missed too many turns.
+        """
+        user_id = self._state.user_to_make_turn
+        assert user_id is not None
+        spell_id = await self._autopilot_spell(user_id)
+        if self._state.stage != Stage.SPELL or self._state.step != step:
+            # the spell was cast meanwhile
+            return
+        self._deadline = None
+        self._record('timeout', user_id=user_id, step=step)
+        self._state.timeouts[user_id] = self._state.timeouts.get(user_id, 0) + 1
+        if self._state.timeouts[user_id] >= self._settings.TURN_FORFEIT_TIMEOUTS:
+            turn_timeouts.inc(outcome='forfeit')
+            await self._forfeit(user_id)
+        else:
+            turn_timeouts.inc(outcome='autopilot')
+            await self._start_cast(user_id, spell_id)
+
+    async def _autopilot_spell(self, user_id: int) -> int:
+        if self._settings.AUTOPILOT_SPELL == 'cheapest':
+            available = set(await self._battlefield.get_available_spells(user_id))
+            spells = [spell for spell in self._state.wizards[user_id].spells if spell.id in available]
+            if spells:
+                return min(spells, key=lambda spell: spell.manacost).id
+        return DUMMY_SPELL.id
+
+    async def _forfeit(self, user_id: int) -> None:
+        """
+        Ends the match with the win of the opponent. It is delivered as an action, so the waiting players get it.
+        """
+        wizard = self._state.wizards[user_id]
+        opponent = next(opponent for other_id, opponent in self._state.wizards.items() if other_id != user_id)
+        self._state.action_metadata = ActionMetadata(caster_wizard=wizard, spell=DUMMY_SPELL)
+        self._state.action = f'{wizard.name} hesitated for too long and fled the battlefield.'
+        self._state.result = ContestResult(winner=opponent)
+        self._battlefield.close()
+        self._action_stream = ActionStream()
+        self._action_stream.push(self._state.action)
+        self._action_stream.close()
+        self._publish(EventType.CAST, metadata=self._state.action_metadata)
+        self._publish(EventType.CHUNK, chunk=self._state.action)
+        await self._transition(Stage.ACTION)
+        self._announce_action()
+        await self._advance()
 
-            wizard = self._wizards[self._state.user_to_make_turn]
-            if spell_id == -1:
-                casted_spell = DUMMY_SPELL
+    async def _wait(self, event: asyncio.Event) -> None:
+        await event.wait()
+        if self._closed:
+            raise MatchClosedError(f'The match of director {self._id} is over')
+
+    def _sync_events(self) -> None:
+        if self._closed:
+            # the events stay set, so the requests made after the close do not wait
+            return
+        for name, stages in EVENT_STAGES.items():
+            event: asyncio.Event = getattr(self, name)
+            if self._state.stage in stages:
+                event.set()
             else:
-                casted_spell = next(spell for spell in wizard.spells if spell.id == spell_id)
-            self._state.action = await self._do_cast_spell(self._state.user_to_make_turn, spell_id)
-            self._state.action_metadata = ActionMetadata(caster_wizard=wizard, spell=casted_spell)
-            if step == settings.TURNS_COUNT - 1:
-                self._state.result = await self._get_winner()
+                event.clear()
+
+    async def _checkpoint(self) -> None:
+        if self._store is None:
+            return
+        start = time.monotonic()
+        # the lock keeps the saves in order, so the latest state is saved last
+        async with self._saving:
+            self._state.battlefield = self._battlefield.snapshot()
+            try:
+                await self._store.save(self._id, self._state.model_dump_json())
+            except Exception:
+                logging.exception('Checkpoint of director %s failed', self._id)
+                checkpoint_errors.inc()
+        checkpoint_seconds.observe(time.monotonic() - start)
 
-            self._stage_0 = asyncio.Event()
-            self._stage_1 = asyncio.Event()
+    def _record(self, kind: str, **fields) -> None:
+        if self._journal is not None:
+            self._journal.record(self._id, kind, **fields)
 
-            self._stage_2.set()
-            await self._stage_3.wait()
-        yield
+    def _spawn(self, coroutine: tp.Coroutine) -> None:
+        # the work of the match is attributed to it in the journal, even when spawned by another match's timer
+        context = contextvars.copy_context()
+        context.run(current_match.set, self._id)
+        task = asyncio.create_task(coroutine, context=context)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
 
     async def _do_cast_spell(self, user_id: int, spell_id: int) -> str:
-        return await self._battlefield.cast_spell(user_id, spell_id)
+        stream = self._action_stream
+        try:
+            if self._settings.STREAM_ACTIONS:
+                async for chunk in self._battlefield.cast_spell_stream(user_id, spell_id):
+                    stream.push(chunk)
+                    self._publish(EventType.CHUNK, chunk=chunk)
+            else:
+                stream.push(await self._battlefield.cast_spell(user_id, spell_id))
+                self._publish(EventType.CHUNK, chunk=stream.text)
+        finally:
+            stream.close()
+        return stream.text
+
+    async def _next_turn(self) -> int:
+        """
+        :return: user_id of the next caster, speculatively determined one if available
+        """
+        start = time.monotonic()
+        task, self._next_turn_task = self._next_turn_task, None
+        user_id, self._state.next_turn = self._state.next_turn, None
+        if task is None and user_id is not None:
+            # determined speculatively before the match was restored
+            return user_id
+        if task is None:
+            user_id, _ = await self._determine_turn('inline')
+            turn_blocked_seconds.observe(time.monotonic() - start, mode='inline')
+            return user_id
+        user_id, seconds = await task
+        blocked = time.monotonic() - start
+        turn_blocked_seconds.observe(blocked, mode='speculative')
+        turn_overlap_seconds.inc(max(seconds - blocked, 0))
+        return user_id
+
+    async def _speculate_turn(self) -> tuple[int, float]:
+        user_id, seconds = await self._determine_turn('speculative')
+        if self._next_turn_task is asyncio.current_task():
+            # saved while unconsumed, so that a restored match does not determine the turn again
+            self._state.next_turn = user_id
+            await self._checkpoint()
+        return user_id, seconds
+
+    async def _determine_turn(self, mode: str) -> tuple[int, float]:
+        """
+        :return: user_id of the next caster and the seconds it took to determine
+        """
+        start = time.monotonic()
+        user_id = await self._battlefield.get_user_to_make_turn()
+        seconds = time.monotonic() - start
+        turn_determination_seconds.observe(seconds, mode=mode)
+        return user_id, seconds
+
+    def _cancel_next_turn(self) -> None:
+        task, self._next_turn_task = self._next_turn_task, None
+        if task is not None and not task.done():
+            task.cancel()
+            turn_cancelled.inc()
 
     async def _get_winner(self) -> ContestResult:
         return await self._battlefield.get_winner()
@@ -0,0 +1,168 @@
+import asyncio
+import time
+import uuid
+from dataclasses import dataclass
+
+from .config import settings
+from .director import Director
+from .metrics import registry
+from .snapshots import SnapshotStore, snapshot_store
+
+live_directors = registry.gauge('contest_directors_live', 'Directors kept in memory')
+evicted_directors = registry.counter(
+    'contest_directors_evicted_total',
+    'Directors removed from memory, by reason (finished, ttl or idle)',
+)
+rejected_directors = registry.counter(
+    'contest_directors_rejected_total',
+    'Directors not created because the registry was full',
+)
+resumed_directors = registry.counter(
+    'contest_directors_resumed_total',
+    'Directors restored from the snapshot store, e.g. after a restart or by another worker',
+)
+
+# the lowest bits of a director id are the shard of the worker which runs the match,
+# the layout is copied from coordinator/sharding.py, which is the reference for it
+SHARD_BITS = 16
+
+
+def shard_of(director_id: int) -> int:
+    return director_id & ((1 << SHARD_BITS) - 1)
+
+
+class DirectorNotFoundError(KeyError):
+    pass
+
+
+class MisdirectedError(Exception):
+    pass
+
+
+class DrainingError(Exception):
+    pass
+
+
+class RegistryFullError(Exception):
+    pass
+
+
+@dataclass
+class Entry:
+    director: Director
+    created_at: float
+    accessed_at: float
+    # set while the director is being removed, it is not served or resumed meanwhile
+    removed: bool = False
+
+
+class DirectorRegistry:
+    """
+    Directors of the running matches.
+    A director is finalized as soon as its result is delivered to every player.
+    Abandoned ones are evicted `ttl` seconds after the creation or `idle_timeout` seconds after the last access.
+    No more than `max_size` directors are kept, new matches are rejected when the registry is full.
+    With a snapshot store, matches unknown to this worker are resumed from their snapshots.
+    With a `shard`, director ids carry it and directors of other shards are not served.
+    A draining registry serves its running matches, but does not create new ones.
+    """
+
+    def __init__(
+        self,
+        max_size: int,
+        ttl: float,
+        idle_timeout: float,
+        store: SnapshotStore | None = None,
+        shard: int | None = None,
+    ):
+        self._max_size = max_size
+        self._ttl = ttl
+        self._idle_timeout = idle_timeout
+        self._store = store
+        self._shard = shard
+        self._entries: dict[int, Entry] = {}
+        self.draining = False
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    async def create(self) -> int:
+        if self.draining:
+            raise DrainingError('The worker is draining')
+        if len(self._entries) >= self._max_size:
+            await self.evict_expired()
+        if len(self._entries) >= self._max_size:
+            rejected_directors.inc()
+            raise RegistryFullError(f'{len(self._entries)} matches are already running')
+        director_id = uuid.uuid4().int
+        if self._shard is not None:
+            director_id = director_id >> SHARD_BITS << SHARD_BITS | self._shard
+        now = time.monotonic()
+        self._entries[director_id] = Entry(Director(director_id=director_id, store=self._store), now, now)
+        live_directors.set(len(self._entries))
+        return director_id
+
+    async def get(self, director_id: int) -> Director:
+        if self._shard is not None and shard_of(director_id) != self._shard:
+            raise MisdirectedError(f'Director {director_id} belongs to shard {shard_of(director_id)}')
+        entry = self._entries.get(director_id)
+        if entry is not None and entry.removed:
+            raise DirectorNotFoundError(director_id)
+        if entry is None:
+            entry = await self._resume(director_id)
+        entry.accessed_at = time.monotonic()
+        return entry.director
+
+    async def finalize(self, director_id: int) -> None:
+        await self._remove(director_id, 'finished')
+
+    async def evict_expired(self) -> None:
+        now = time.monotonic()
+        for director_id, entry in list(self._entries.items()):
+            if now - entry.created_at >= self._ttl:
+                await self._remove(director_id, 'ttl')
+            elif now - entry.accessed_at >= self._idle_timeout:
+                await self._remove(director_id, 'idle')
+
+    async def sweep(self, interval: float) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            await self.evict_expired()
+
+    async def _resume(self, director_id: int) -> Entry:
+        snapshot = None if self._store is None else await self._store.load(director_id)
+        if snapshot is None:
+            raise DirectorNotFoundError(director_id)
+        # another request could have resumed the match while the snapshot was loaded
+        if director_id not in self._entries:
+            # the lifetime starts over, the creation time is not in the snapshot
+            now = time.monotonic()
+            director = Director.restore(director_id, snapshot, self._store)
+            self._entries[director_id] = Entry(director, now, now)
+            resumed_directors.inc()
+            live_directors.set(len(self._entries))
+        return self._entries[director_id]
+
+    async def _remove(self, director_id: int, reason: str) -> None:
+        entry = self._entries.get(director_id)
+        if entry is None or entry.removed:
+            return
+        # the key is kept until the snapshot is deleted, so the match is not resumed from it meanwhile
+        entry.removed = True
+        try:
+            await entry.director.release()
+            if self._store is not None:
+                await self._store.delete(director_id)
+        finally:
+            del self._entries[director_id]
+            evicted_directors.inc(reason=reason)
+            live_directors.set(len(self._entries))
+
+
+directors = DirectorRegistry(
+    max_size=settings.DIRECTORS_MAX_LIVE,
+    ttl=settings.DIRECTORS_TTL,
+    idle_timeout=settings.DIRECTORS_IDLE_TIMEOUT,
+    store=snapshot_store,
+    shard=settings.SHARD_ID,
+)
@@ -0,0 +1,115 @@
+import asyncio
+from collections import deque
+from collections.abc import AsyncIterator
+from enum import StrEnum
+
+from commonlib.models import ActionMetadata, ContestAction, ContestResult
+from pydantic import BaseModel
+
+from .metrics import registry
+
+event_subscribers = registry.gauge('contest_event_subscribers', 'Open subscriptions to match events')
+dropped_subscribers = registry.counter(
+    'contest_event_subscribers_dropped_total',
+    'Subscriptions closed because the subscriber did not keep up with the events',
+)
+
+
+class EventType(StrEnum):
+    # the caster of the turn is known
+    TURN = 'turn'
+    # spells the caster may cast this turn
+    SPELLS = 'spells'
+    # the spell is cast, the action is being generated
+    CAST = 'cast'
+    # text of the action being generated
+    CHUNK = 'chunk'
+    # the action is generated
+    ACTION = 'action'
+    # the match is over
+    RESULT = 'result'
+
+
+class MatchEvent(BaseModel):
+    """
+    Event of `/events`. Only the fields of its type are set.
+    """
+
+    seq: int
+    type: EventType
+    # caster of `turn` and `spells`
+    user_id: int | None = None
+    spell_ids: list[int] | None = None
+    metadata: ActionMetadata | None = None
+    chunk: str | None = None
+    action: ContestAction | None = None
+    result: ContestResult | None = None
+
+
+class EventLog:
+    """
+    Events of a match numbered from 1.
+    Every subscriber gets a buffer of `buffer_size` events. A subscriber which does not keep up is disconnected,
+    it resumes from the last received sequence number, which is possible for the last `history_size` events.
+    Older events are lost, but the log of a match is short and the latest events describe its state anyway.
+    """
+
+    def __init__(self, history_size: int, buffer_size: int, seq: int = 0):
+        self.seq = seq
+        self._history: deque[MatchEvent] = deque(maxlen=history_size)
+        self._buffer_size = buffer_size
+        # the spare place of every queue is for None, which ends the subscription
+        self._subscribers: set[asyncio.Queue[MatchEvent | None]] = set()
+        self._closed = False
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    def publish(self, type_: EventType, **fields) -> MatchEvent | None:
+        if self._closed:
+            # the match was abandoned while the event was being prepared
+            return None
+        self.seq += 1
+        event = MatchEvent(seq=self.seq, type=type_, **fields)
+        self._history.append(event)
+        for queue in list(self._subscribers):
+            if queue.qsize() < self._buffer_size:
+                queue.put_nowait(event)
+            else:
+                self._unsubscribe(queue)
+                dropped_subscribers.inc()
+        return event
+
+    def close(self) -> None:
+        """
+        Ends the subscriptions once they receive the published events
+        """
+        self._closed = True
+        for queue in list(self._subscribers):
+            self._unsubscribe(queue)
+
+    async def subscribe(self, after: int = 0) -> AsyncIterator[MatchEvent]:
+        """
+        :param after: sequence number of the last received event
+        """
+        backlog = [event for event in self._history if event.seq > after]
+        queue: asyncio.Queue[MatchEvent | None] = asyncio.Queue(self._buffer_size + 1)
+        if not self._closed:
+            self._subscribers.add(queue)
+            event_subscribers.inc()
+        try:
+            for event in backlog:
+                yield event
+            if queue not in self._subscribers and queue.empty():
+                return
+            while (event := await queue.get()) is not None:
+                yield event
+        finally:
+            self._unsubscribe(queue)
+
+    def _unsubscribe(self, queue: asyncio.Queue[MatchEvent | None]) -> None:
+        if queue in self._subscribers:
+            self._subscribers.discard(queue)
+            queue.put_nowait(None)
+            event_subscribers.dec()
@@ -0,0 +1,105 @@
+import asyncio
+import typing as tp
+from collections.abc import AsyncIterator
+
+from pydantic import BaseModel
+
+from .director import Director, PlayerNotFoundError
+from .directors import DirectorNotFoundError, DirectorRegistry, MisdirectedError
+from .events import MatchEvent
+from .metrics import registry
+
+feed_connections = registry.gauge('contest_feed_connections', 'Open connections of the multiplexed event feed')
+feed_subscriptions = registry.gauge('contest_feed_subscriptions', 'Matches followed over the multiplexed event feed')
+
+
+class FeedRequest(BaseModel):
+    """
+    Message of a client of `/ws/events`
+    """
+
+    action: tp.Literal['subscribe', 'unsubscribe']
+    director_id: int
+    # the player who receives the events instead of polling, see `Director.add_subscriber`
+    user_id: int | None = None
+    after: int = 0
+
+
+class FeedMessage(BaseModel):
+    """
+    Message of `/ws/events` to the client, an event of the match or the reason the match is not followed
+    """
+
+    director_id: int
+    event: MatchEvent | None = None
+    error: str | None = None
+
+
+class Feed:
+    """
+    Events of many matches for one connection.
+    The events of all matches go to one queue of `buffer_size` messages. When the connection is slow,
+    the event logs drop the subscriptions, which are resumed from the last forwarded events.
+    """
+
+    def __init__(self, directors: DirectorRegistry, buffer_size: int):
+        self._directors = directors
+        self._messages: asyncio.Queue[FeedMessage] = asyncio.Queue(buffer_size)
+        self._subscriptions: dict[int, asyncio.Task] = {}
+        feed_connections.inc()
+
+    async def handle(self, request: FeedRequest) -> None:
+        match request.action:
+            case 'subscribe':
+                await self.subscribe(request.director_id, request.user_id, request.after)
+            case 'unsubscribe':
+                self.unsubscribe(request.director_id)
+
+    async def subscribe(self, director_id: int, user_id: int | None = None, after: int = 0) -> None:
+        try:
+            director = await self._directors.get(director_id)
+        except (DirectorNotFoundError, MisdirectedError) as e:
+            await self._messages.put(FeedMessage(director_id=director_id, error=f'{type(e).__name__}: {e}'))
+            return
+        if user_id is not None:
+            try:
+                await director.add_subscriber(user_id)
+            except PlayerNotFoundError:
+                await self._messages.put(
+                    FeedMessage(director_id=director_id, error=f'No player {user_id} in the match')
+                )
+                return
+        # every player of the match may be served by the same connection, the events are sent once
+        if director_id not in self._subscriptions:
+            self._subscriptions[director_id] = asyncio.create_task(self._forward(director_id, director, after))
+            feed_subscriptions.inc()
+
+    def unsubscribe(self, director_id: int) -> None:
+        task = self._subscriptions.pop(director_id, None)
+        if task is not None:
+            task.cancel()
+            feed_subscriptions.dec()
+
+    async def messages(self) -> AsyncIterator[FeedMessage]:
+        while True:
+            yield await self._messages.get()
+
+    def close(self) -> None:
+        for director_id in list(self._subscriptions):
+            self.unsubscribe(director_id)
+        feed_connections.dec()
+
+    async def _forward(self, director_id: int, director: Director, after: int) -> None:
+        while True:
+            async for event in director.subscribe(after=after):
+                after = event.seq
+                await self._messages.put(FeedMessage(director_id=director_id, event=event))
+            if director.events.closed:
+                break
+        if director.finished:
+            await self._directors.finalize(director_id)
+        else:
+            await self._messages.put(FeedMessage(director_id=director_id, error='The match was abandoned'))
+        if self._subscriptions.get(director_id) is asyncio.current_task():
+            del self._subscriptions[director_id]
+            feed_subscriptions.dec()
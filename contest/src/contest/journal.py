@@ -0,0 +1,215 @@
+import asyncio
+import contextvars
+import hashlib
+import json
+import os
+import time
+import typing as tp
+from collections import defaultdict
+from collections.abc import AsyncIterator, Callable
+from pathlib import Path
+
+import httpx
+
+from .config import settings
+from .metrics import SECONDS_BUCKETS, registry
+
+journal_records = registry.counter('contest_journal_records_total', 'Records appended to the match journal')
+journal_flush_seconds = registry.histogram(
+    'contest_journal_flush_seconds',
+    'Duration of writing and syncing a batch of the match journal',
+    SECONDS_BUCKETS,
+)
+
+# director whose work is running, the LLM requests are recorded for this match
+current_match: contextvars.ContextVar[int | None] = contextvars.ContextVar('current_match', default=None)
+
+Record = dict[str, tp.Any]
+
+# settings which change the course of a match, they are recorded with every match to replay it the same way
+MATCH_SETTINGS = (
+    'TURNS_COUNT',
+    'STREAM_ACTIONS',
+    'FUSED_TURNS',
+    'SPECULATIVE_TURNS',
+    'TURN_SCHEDULER',
+    'TURN_AMBIGUITY_MARGIN',
+    'TURN_FORFEIT_TIMEOUTS',
+    'AUTOPILOT_SPELL',
+    'LLM_SESSIONS',
+    'TRANSCRIPT_COMPACTION',
+    'TRANSCRIPT_KEEP_TURNS',
+    'TRANSCRIPT_TOKEN_BUDGET',
+    'TRANSCRIPT_SUMMARY_TOKENS',
+)
+
+
+class Journal:
+    """
+    Append-only log of the matches, a JSON object per line tagged with the director id.
+    Records are buffered and written with one fsync every `fsync_interval` seconds,
+    so a crash loses the records of the last interval at most.
+    """
+
+    def __init__(self, path: Path, fsync_interval: float):
+        self._path = path
+        self._fsync_interval = fsync_interval
+        self._buffer: list[str] = []
+        self._flushing = asyncio.Lock()
+        self._task: asyncio.Task | None = None
+
+    def record(self, director_id: int | None, kind: str, **fields) -> None:
+        """
+        :param fields: JSON-serializable values
+        """
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+        record = {'match': director_id, 'kind': kind, 'time': round(time.time(), 6), **fields}
+        self._buffer.append(json.dumps(record, separators=(',', ':')))
+        journal_records.inc()
+
+    async def flush(self) -> None:
+        async with self._flushing:
+            if not self._buffer:
+                return
+            lines, self._buffer = self._buffer, []
+            start = time.monotonic()
+            await asyncio.to_thread(self._write, ''.join(line + '\n' for line in lines))
+            journal_flush_seconds.observe(time.monotonic() - start)
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+        await self.flush()
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self._fsync_interval)
+            await self.flush()
+
+    def _write(self, data: str) -> None:
+        self._path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self._path, 'a', encoding='utf-8') as file:
+            file.write(data)
+            file.flush()
+            os.fsync(file.fileno())
+
+
+def read_journal(path: Path) -> dict[int, list[Record]]:
+    """
+    :return: records of every match in the order they were appended
+    """
+    matches: dict[int, list[Record]] = defaultdict(list)
+    with open(path, encoding='utf-8') as file:
+        for line in file:
+            # the last line may be cut by a crash
+            if line.endswith('\n'):
+                record = json.loads(line)
+                matches[record['match']].append(record)
+    return dict(matches)
+
+
+def request_digest(body: bytes) -> str:
+    """
+    Requests are recorded by the digest of the body, as the bodies repeat the whole transcript of the match
+    """
+    return hashlib.sha256(body).hexdigest()[:16]
+
+
+class RecordingStream(httpx.AsyncByteStream):
+    """
+    Passes the response through while it is streamed and hands its body over when it is closed
+    """
+
+    def __init__(self, stream: httpx.AsyncByteStream, on_close: Callable[[bytes], None]):
+        self._stream = stream
+        self._on_close = on_close
+        self._chunks: list[bytes] = []
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        async for chunk in self._stream:
+            self._chunks.append(chunk)
+            yield chunk
+
+    async def aclose(self) -> None:
+        await self._stream.aclose()
+        self._on_close(b''.join(self._chunks))
+
+
+class JournalTransport(httpx.AsyncBaseTransport):
+    """
+    Records the requests made for a match, `current_match`, and their responses to the journal
+    """
+
+    def __init__(self, journal: Journal, transport: httpx.AsyncBaseTransport | None = None):
+        self._journal = journal
+        self._transport = transport or httpx.AsyncHTTPTransport()
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        director_id = current_match.get()
+        if director_id is None:
+            return await self._transport.handle_async_request(request)
+        # the body is recorded as it is sent
+        request.headers['Accept-Encoding'] = 'identity'
+        start = time.monotonic()
+        response = await self._transport.handle_async_request(request)
+
+        def record(body: bytes) -> None:
+            self._journal.record(
+                director_id,
+                'llm',
+                method=request.method,
+                path=request.url.path,
+                query=request.url.query.decode(),
+                request=request_digest(request.content),
+                status=response.status_code,
+                response=body.decode(),
+                seconds=round(time.monotonic() - start, 6),
+            )
+
+        assert isinstance(response.stream, httpx.AsyncByteStream)
+        return httpx.Response(
+            status_code=response.status_code,
+            headers=response.headers,
+            stream=RecordingStream(response.stream, record),
+            extensions=response.extensions,
+        )
+
+    async def aclose(self) -> None:
+        await self._transport.aclose()
+
+
+class ReplayError(Exception):
+    pass
+
+
+class ReplayTransport(httpx.AsyncBaseTransport):
+    """
+    Answers the requests of the replayed matches with the responses recorded in the journal.
+    A request is matched with a recorded one of the same path and body digest, or of the same path if there is none,
+    as the concurrent requests of a match are not ordered.
+    """
+
+    def __init__(self, exchanges: dict[int, list[Record]], latency: bool = False):
+        """
+        :param latency: whether to answer after the recorded time
+        """
+        self._exchanges = exchanges
+        self._latency = latency
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        path, digest = request.url.path, request_digest(await request.aread())
+        exchanges = self._exchanges.get(current_match.get(), [])
+        exchange = next(
+            (exchange for exchange in exchanges if (exchange['path'], exchange['request']) == (path, digest)),
+            next((exchange for exchange in exchanges if exchange['path'] == path), None),
+        )
+        if exchange is None:
+            raise ReplayError(f'No recorded response to {request.method} {path} of director {current_match.get()}')
+        exchanges.remove(exchange)
+        if self._latency:
+            await asyncio.sleep(exchange['seconds'])
+        return httpx.Response(exchange['status'], content=exchange['response'].encode())
+
+
+match_journal = Journal(settings.JOURNAL_PATH, settings.JOURNAL_FSYNC_INTERVAL) if settings.JOURNAL_PATH else None
@@ -0,0 +1,103 @@
+from collections.abc import AsyncIterator
+
+import httpx
+from commonlib.models import GenerateActionResponse, Message, Pair, Wizard
+from commonlib.services.llm import LLMClient as BaseLLMClient
+from pydantic import BaseModel
+
+
+class GenerateActionChunk(BaseModel):
+    chunk: str | None = None
+    response: GenerateActionResponse | None = None
+
+
+class GenerateTurnResponse(GenerateActionResponse):
+    next_wizard: int
+
+
+class LLMClient(BaseLLMClient):
+    """
+    Extends the commonlib client with the endpoints which are not shared with other services yet.
+    """
+
+    def __init__(self, base_url: str, transport: httpx.AsyncBaseTransport | None = None):
+        super().__init__(base_url)
+        if transport is not None:
+            # the base constructor takes no transport, its client is replaced before it opens a connection
+            self.client = httpx.AsyncClient(base_url=base_url, transport=transport)
+
+    async def generate_action_stream(self, **kwargs) -> AsyncIterator[GenerateActionChunk]:
+        async with self.client.stream('POST', '/contest/generate_action_stream', json=kwargs, timeout=None) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                if line:
+                    yield GenerateActionChunk.model_validate_json(line)
+
+    async def generate_turn(self, **kwargs) -> GenerateTurnResponse:
+        """
+        Generates the action together with the index of the wizard who acts next
+        """
+        response = await self.client.post('/contest/generate_turn', json=kwargs, timeout=None)
+        response.raise_for_status()
+        return GenerateTurnResponse.model_validate(response.json())
+
+    async def create_session(self, wizards: Pair[Wizard]) -> str:
+        response = await self.client.post('/session/create', json=wizards.model_dump())
+        response.raise_for_status()
+        return response.json()
+
+    async def session_generate_action(self, session_id: str, **kwargs) -> GenerateActionResponse:
+        response = await self.client.post(
+            '/session/generate_action',
+            params={'session_id': session_id},
+            json=kwargs,
+            timeout=None,
+        )
+        response.raise_for_status()
+        return GenerateActionResponse.model_validate(response.json())
+
+    async def session_generate_action_stream(self, session_id: str, **kwargs) -> AsyncIterator[GenerateActionChunk]:
+        async with self.client.stream(
+            'POST',
+            '/session/generate_action_stream',
+            params={'session_id': session_id},
+            json=kwargs,
+            timeout=None,
+        ) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                if line:
+                    yield GenerateActionChunk.model_validate_json(line)
+
+    async def session_generate_turn(self, session_id: str, **kwargs) -> GenerateTurnResponse:
+        response = await self.client.post(
+            '/session/generate_turn',
+            params={'session_id': session_id},
+            json=kwargs,
+            timeout=None,
+        )
+        response.raise_for_status()
+        return GenerateTurnResponse.model_validate(response.json())
+
+    async def session_delete(self, session_id: str) -> None:
+        response = await self.client.post('/session/delete', params={'session_id': session_id})
+        response.raise_for_status()
+
+    async def session_determine_turn(self, session_id: str) -> int:
+        response = await self.client.post('/session/determine_turn', params={'session_id': session_id}, timeout=None)
+        response.raise_for_status()
+        return response.json()
+
+    async def session_pick_winner(self, session_id: str) -> str | None:
+        response = await self.client.post('/session/pick_winner', params={'session_id': session_id}, timeout=None)
+        response.raise_for_status()
+        return response.json()
+
+    async def summarize_actions(self, summary: str, actions: list[Message], max_tokens: int) -> str:
+        response = await self.client.post(
+            '/contest/summarize_actions',
+            json={'summary': summary, 'actions': actions, 'max_tokens': max_tokens},
+            timeout=None,
+        )
+        response.raise_for_status()
+        return response.json()
@@ -1,6 +1,27 @@
+import asyncio
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 
+from .config import settings
+from .directors import directors
+from .journal import match_journal
 from .server import router
+from .snapshots import snapshot_store
+from .timers import turn_timers
+
+
+@asynccontextmanager
+async def lifespan(_: FastAPI):
+    sweeper = asyncio.create_task(directors.sweep(settings.DIRECTORS_SWEEP_INTERVAL))
+    yield
+    sweeper.cancel()
+    turn_timers.close()
+    if snapshot_store is not None:
+        await snapshot_store.close()
+    if match_journal is not None:
+        await match_journal.close()
+
 
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 app.include_router(router)
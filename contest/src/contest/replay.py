@@ -0,0 +1,117 @@
+import asyncio
+import time
+from dataclasses import dataclass, field
+
+from commonlib.models import ContestResult, Wizard
+
+from .battlefield import Battlefield
+from .config import settings
+from .director import Director, Stage
+from .events import EventType
+from .journal import Record, ReplayError, ReplayTransport, current_match
+from .llm import LLMClient
+
+STAGES = list(Stage)
+
+
+@dataclass
+class Replay:
+    director_id: int
+    turns: int
+    # time of the replay, the director and battlefield overhead when the LLM answers without latency
+    seconds: float
+    # time of the recorded match, players included
+    recorded_seconds: float
+    mismatches: list[str] = field(default_factory=list)
+
+
+def is_replayable(records: list[Record]) -> bool:
+    """
+    Matches resumed from a snapshot began on another worker, so their beginning is not in the journal
+    """
+    return bool(records) and records[0]['kind'] == 'match' and all(record['kind'] != 'restore' for record in records)
+
+
+async def replay_match(director_id: int, records: list[Record], latency: bool = False, timeout: float = 60) -> Replay:
+    """
+    Plays the match again with the moves of the players from the journal and the LLM answers served from it.
+    The match is played with its recorded settings and its own LLM client, the service settings are left intact.
+    :param latency: whether the LLM answers after the recorded time
+    :param timeout: seconds to wait for the match to reach a recorded stage before the replay is considered diverged
+    """
+    if not is_replayable(records):
+        raise ReplayError(f'Director {director_id} was not recorded from the beginning')
+    # the recorded timeouts are replayed instead of the deadlines
+    config = settings.model_copy(update={**records[0]['settings'], 'TURN_TIMEOUT': 0})
+    exchanges = {director_id: [record for record in records if record['kind'] == 'llm']}
+    client = LLMClient(config.LLM_SERVICE_URL, transport=ReplayTransport(exchanges, latency))
+    current_match.set(director_id)
+    director = Director(Battlefield(config, client), director_id=director_id, config=config)
+    try:
+        start = time.monotonic()
+        actions = asyncio.create_task(_collect_actions(director))
+        for record in records:
+            match record['kind']:
+                case 'wizard':
+                    await director.set_wizard(record['user_id'], Wizard.model_validate(record['wizard']))
+                    # players receive the events, so the replay does not request the turns and the actions for them
+                    await director.add_subscriber(record['user_id'])
+                case 'cast':
+                    await _reach(director, record['step'], Stage.SPELL, timeout)
+                    await director.cast_spell(record['user_id'], record['spell_id'])
+                case 'timeout':
+                    await _reach(director, record['step'], Stage.SPELL, timeout)
+                    await director._miss_turn(record['step'])
+        stages = [record for record in records if record['kind'] == 'stage']
+        if stages:
+            await _reach(director, stages[-1]['step'], Stage(stages[-1]['stage']), timeout)
+        seconds = time.monotonic() - start
+    finally:
+        director.close()
+        await client.client.aclose()
+
+    recorded = [record for record in records if record['kind'] == 'action']
+    replayed = await actions
+    expected = [
+        (record['action'], ContestResult.model_validate(record['result']) if record['result'] else None)
+        for record in recorded
+    ]
+    mismatches = [
+        f'Turn {turn}: {action!r} was replayed as {replayed_action!r}'
+        for turn, (action, replayed_action) in enumerate(zip(expected, replayed))
+        if action != replayed_action
+    ]
+    if len(replayed) != len(recorded):
+        mismatches.append(f'{len(recorded)} actions were recorded, {len(replayed)} replayed')
+    return Replay(
+        director_id=director_id,
+        turns=len(recorded),
+        seconds=seconds,
+        recorded_seconds=records[-1]['time'] - records[0]['time'],
+        mismatches=mismatches,
+    )
+
+
+async def _reach(director: Director, step: int, stage: Stage, timeout: float) -> None:
+    """
+    Waits until the match reaches the stage of the step or goes past it
+    """
+
+    async def wait() -> None:
+        while (director.step, STAGES.index(director.stage)) < (step, STAGES.index(stage)):
+            await director.wait_for_change(director.version)
+
+    try:
+        await asyncio.wait_for(wait(), timeout)
+    except TimeoutError:
+        raise ReplayError(
+            f'The replay diverged: the match is at {director.version} instead of {step}.{stage}'
+        ) from None
+
+
+async def _collect_actions(director: Director) -> list[tuple[str, ContestResult | None]]:
+    return [
+        (event.action.action, event.action.result)
+        async for event in director.subscribe()
+        if event.type == EventType.ACTION
+    ]
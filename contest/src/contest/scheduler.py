@@ -0,0 +1,156 @@
+import abc
+import time
+from collections.abc import Awaitable, Callable
+
+from commonlib.models import Wizard
+
+from .metrics import SECONDS_BUCKETS, registry
+
+scheduler_seconds = registry.histogram(
+    'contest_turn_scheduler_seconds',
+    'Time to decide who acts next, by strategy',
+    SECONDS_BUCKETS,
+)
+scheduler_decisions = registry.counter(
+    'contest_turn_scheduler_decisions_total',
+    'Turn decisions, by strategy and by the source of the decision',
+)
+
+AskLLM = Callable[[], Awaitable[int]]
+
+
+class TurnScheduler(abc.ABC):
+    """
+    Decides which player acts next
+    """
+
+    name: str
+
+    async def next_turn(self) -> int:
+        """
+        :return: user_id of the player who acts next
+        """
+        start = time.monotonic()
+        try:
+            return await self._decide()
+        finally:
+            scheduler_seconds.observe(time.monotonic() - start, strategy=self.name)
+
+    def snapshot(self) -> dict:
+        """
+        :return: JSON-serializable state of the schedule, see `restore`
+        """
+        return {}
+
+    def restore(self, state: dict) -> None:
+        pass
+
+    @abc.abstractmethod
+    async def _decide(self) -> int:
+        pass
+
+
+class LLMScheduler(TurnScheduler):
+    """
+    Asks the LLM every turn
+    """
+
+    name = 'llm'
+
+    def __init__(self, ask_llm: AskLLM):
+        self._ask_llm = ask_llm
+
+    async def _decide(self) -> int:
+        scheduler_decisions.inc(strategy=self.name, source='llm')
+        return await self._ask_llm()
+
+
+class InitiativeScheduler(TurnScheduler):
+    """
+    Every turn each wizard gains tempo equal to their speed. The wizard with the most tempo acts
+    and spends the tempo gained by everyone, so wizards act in proportion to their speed.
+    Ties are broken in favour of the wizard who acted less, then of the one who joined first.
+    """
+
+    name = 'initiative'
+
+    def __init__(self, wizards: dict[int, Wizard], ambiguity_margin: float = 0):
+        """
+        :param wizards: wizards by user_id, read on every turn
+        :param ambiguity_margin: tempo difference, in shares of the total speed, which is considered a tie
+        """
+        self._wizards = wizards
+        self._ambiguity_margin = ambiguity_margin
+        self._tempo: dict[int, float] = {}
+        self._turns: dict[int, int] = {}
+
+    async def _decide(self) -> int:
+        candidates = self._accumulate()
+        scheduler_decisions.inc(strategy=self.name, source='rule')
+        return self._act(candidates[0])
+
+    def snapshot(self) -> dict:
+        # pairs instead of objects, which would turn user_ids into strings
+        return {'tempo': list(self._tempo.items()), 'turns': list(self._turns.items())}
+
+    def restore(self, state: dict) -> None:
+        self._tempo = {user_id: tempo for user_id, tempo in state.get('tempo', [])}
+        self._turns = {user_id: turns for user_id, turns in state.get('turns', [])}
+
+    def _accumulate(self) -> list[int]:
+        """
+        :return: user_ids of the wizards who may act now, the rule engine's choice first
+        """
+        for user_id, wizard in self._wizards.items():
+            self._tempo[user_id] = self._tempo.get(user_id, 0) + wizard.speed
+        order = sorted(
+            self._wizards,
+            key=lambda user_id: (-self._tempo[user_id], self._turns.get(user_id, 0)),
+        )
+        margin = self._ambiguity_margin * self._total_speed()
+        return [user_id for user_id in order if self._tempo[order[0]] - self._tempo[user_id] <= margin]
+
+    def _act(self, user_id: int) -> int:
+        self._tempo[user_id] -= self._total_speed()
+        self._turns[user_id] = self._turns.get(user_id, 0) + 1
+        return user_id
+
+    def _total_speed(self) -> int:
+        return sum(wizard.speed for wizard in self._wizards.values())
+
+
+class HybridScheduler(InitiativeScheduler):
+    """
+    Same as `InitiativeScheduler`, but asks the LLM when several wizards may act
+    """
+
+    name = 'hybrid'
+
+    def __init__(self, wizards: dict[int, Wizard], ask_llm: AskLLM, ambiguity_margin: float = 0):
+        super().__init__(wizards, ambiguity_margin)
+        self._ask_llm = ask_llm
+
+    async def _decide(self) -> int:
+        candidates = self._accumulate()
+        if len(candidates) == 1:
+            scheduler_decisions.inc(strategy=self.name, source='rule')
+            return self._act(candidates[0])
+        user_id = await self._ask_llm()
+        scheduler_decisions.inc(strategy=self.name, source='llm')
+        return self._act(user_id)
+
+
+def create_scheduler(
+    strategy: str,
+    wizards: dict[int, Wizard],
+    ask_llm: AskLLM,
+    ambiguity_margin: float,
+) -> TurnScheduler:
+    match strategy:
+        case 'llm':
+            return LLMScheduler(ask_llm)
+        case 'initiative':
+            return InitiativeScheduler(wizards, ambiguity_margin)
+        case 'hybrid':
+            return HybridScheduler(wizards, ask_llm, ambiguity_margin)
+    raise ValueError(f'Unknown turn scheduler {strategy}')
@@ -1,45 +1,212 @@
 import asyncio
-import uuid
+import typing as tp
+from collections.abc import AsyncIterator
 
 from commonlib.models import ContestAction, Wizard
-from fastapi import APIRouter
+from fastapi import APIRouter, Header, HTTPException, Response, WebSocket, WebSocketDisconnect, status
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from pydantic import ValidationError
 
-from .director import Director
+from .config import settings
+from .director import CastRejectedError, Director, MatchClosedError, MatchView, PlayerNotFoundError
+from .directors import DirectorNotFoundError, DrainingError, MisdirectedError, RegistryFullError, directors
+from .feed import Feed, FeedRequest
+from .metrics import registry
 
 router = APIRouter()
 
-directors: dict[int, Director] = {}
+
+async def get_director(director_id: int) -> Director:
+    try:
+        return await directors.get(director_id)
+    except DirectorNotFoundError:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f'No director {director_id}') from None
+    except MisdirectedError as e:
+        raise HTTPException(status_code=status.HTTP_421_MISDIRECTED_REQUEST, detail=str(e)) from None
+
+
+def match_closed(e: MatchClosedError) -> HTTPException:
+    """
+    The director was evicted or finalized while the request waited for it
+    """
+    return HTTPException(status_code=status.HTTP_410_GONE, detail=str(e))
+
+
+async def add_subscriber(director: Director, user_id: int) -> None:
+    try:
+        await director.add_subscriber(user_id)
+    except PlayerNotFoundError:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f'No player {user_id} in the match') from None
 
 
 @router.post('/create_director')
 async def create_director() -> int:
-    director_id = uuid.uuid4().int
-    directors[director_id] = Director()
-    return director_id
+    try:
+        return await directors.create()
+    except (RegistryFullError, DrainingError) as e:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=str(e),
+            headers={'Retry-After': '5'},
+        ) from None
+
+
+@router.post('/drain')
+async def drain() -> int:
+    """
+    Stops accepting new matches, the worker can be removed when no matches are left
+    :return: number of the running matches
+    """
+    directors.draining = True
+    return len(directors)
 
 
 @router.post('/set_wizard')
 async def set_wizard(director_id: int, user_id: int, wizard: Wizard) -> None:
-    director = directors[director_id]
+    director = await get_director(director_id)
     await director.set_wizard(user_id, wizard)
     # here response is returned only when everyone have set their wizard
 
 
 @router.post('/get_user_to_make_turn')
 async def get_user_to_make_turn(director_id: int) -> int:
-    return await directors[director_id].get_user_to_make_turn()
+    director = await get_director(director_id)
+    try:
+        return await director.get_user_to_make_turn()
+    except MatchClosedError as e:
+        raise match_closed(e) from None
 
 
 @router.post('/get_available_spells')
 async def get_available_spells(director_id: int, user_id: int) -> list[int]:
-    return await directors[director_id].get_available_spells(user_id)
+    director = await get_director(director_id)
+    return await director.get_available_spells(user_id)
 
 
 @router.post('/cast_spell')
 async def cast_spell(director_id: int, user_id: int, spell_id: int) -> None:
-    asyncio.create_task(directors[director_id].cast_spell(user_id, spell_id))
+    """
+    Responds once the cast is accepted, the action is received with `get_action` or the events
+    """
+    director = await get_director(director_id)
+    try:
+        await director.cast_spell(user_id, spell_id)
+    except CastRejectedError as e:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e)) from None
+    except MatchClosedError as e:
+        raise match_closed(e) from None
 
 
 @router.post('/get_action')
 async def get_action(director_id: int) -> ContestAction:
-    return await directors[director_id].get_contest_action()
+    director = await get_director(director_id)
+    try:
+        action = await director.get_contest_action()
+    except MatchClosedError as e:
+        raise match_closed(e) from None
+    if director.finished:
+        await directors.finalize(director_id)
+    return action
+
+
+@router.post('/get_action_stream')
+async def get_action_stream(director_id: int) -> StreamingResponse:
+    """
+    Streams newline-delimited `ActionChunk`s of the current action to every player who asks
+    """
+    director = await get_director(director_id)
+
+    async def lines() -> AsyncIterator[str]:
+        async for chunk in director.stream_contest_action():
+            yield chunk.model_dump_json() + '\n'
+
+    return StreamingResponse(lines(), media_type='application/x-ndjson')
+
+
+@router.get('/match_state')
+async def match_state(
+    director_id: int,
+    user_id: int,
+    response: Response,
+    if_none_match: tp.Annotated[str | None, Header()] = None,
+    timeout: float = settings.MATCH_STATE_TIMEOUT,
+) -> MatchView:
+    """
+    State of the match for the player, who follows it with this request instead of requesting
+    the turn, the spells and the action.
+    With the ETag of the last response in If-None-Match, the request waits up to `timeout` seconds
+    for the state to change and responds with 304 Not Modified if it does not.
+    The match is finalized once its finished state is served to every subscriber.
+    """
+    director = await get_director(director_id)
+    await add_subscriber(director, user_id)
+    if if_none_match is not None:
+        try:
+            await asyncio.wait_for(director.wait_for_change(if_none_match.removeprefix('W/').strip('"')), timeout)
+        except TimeoutError:
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={'ETag': f'"{director.version}"'})
+        except MatchClosedError as e:
+            raise match_closed(e) from None
+    response.headers['ETag'] = f'"{director.version}"'
+    view = await director.get_match_view(user_id)
+    if director.finished and director.serve_finished(user_id):
+        await directors.finalize(director_id)
+    return view
+
+
+@router.get('/events')
+async def events(
+    director_id: int,
+    user_id: int | None = None,
+    after: int = 0,
+    last_event_id: tp.Annotated[int | None, Header()] = None,
+) -> StreamingResponse:
+    """
+    Server-sent `MatchEvent`s of the match after the sequence number `after` or the Last-Event-ID header.
+    The player `user_id` receives the turn and the action with the events and no longer has to request them.
+    The match is finalized once every subscriber has read its events to the end.
+    """
+    director = await get_director(director_id)
+    if user_id is not None:
+        await add_subscriber(director, user_id)
+    if last_event_id is not None:
+        after = max(after, last_event_id)
+
+    async def lines() -> AsyncIterator[str]:
+        async for event in director.subscribe(after=after):
+            yield f'id: {event.seq}\nevent: {event.type}\ndata: {event.model_dump_json()}\n\n'
+        if director.finished and user_id is not None and director.serve_finished(user_id):
+            await directors.finalize(director_id)
+
+    return StreamingResponse(lines(), media_type='text/event-stream')
+
+
+@router.websocket('/ws/events')
+async def events_feed(websocket: WebSocket) -> None:
+    """
+    Events of many matches over one connection.
+    The client sends `FeedRequest`s to subscribe and unsubscribe, the server sends `FeedMessage`s.
+    """
+    await websocket.accept()
+    feed = Feed(directors, settings.FEED_BUFFER_SIZE)
+
+    async def send() -> None:
+        async for message in feed.messages():
+            await websocket.send_text(message.model_dump_json())
+
+    sender = asyncio.create_task(send())
+    try:
+        while True:
+            await feed.handle(FeedRequest.model_validate_json(await websocket.receive_text()))
+    except WebSocketDisconnect:
+        pass
+    except ValidationError:
+        await websocket.close(code=status.WS_1003_UNSUPPORTED_DATA)
+    finally:
+        sender.cancel()
+        feed.close()
+
+
+@router.get('/metrics', response_class=PlainTextResponse)
+async def metrics() -> str:
+    return registry.render()
@@ -0,0 +1,213 @@
+import abc
+import asyncio
+import sqlite3
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from .config import settings
+
+try:
+    import asyncpg
+except ImportError:  # the postgres store is optional
+    asyncpg = None
+
+
+class SnapshotStore(abc.ABC):
+    """
+    Latest serialized state of every running match, by director id
+    """
+
+    @abc.abstractmethod
+    async def save(self, director_id: int, snapshot: str) -> None:
+        pass
+
+    @abc.abstractmethod
+    async def load(self, director_id: int) -> str | None:
+        pass
+
+    @abc.abstractmethod
+    async def delete(self, director_id: int) -> None:
+        pass
+
+    async def close(self) -> None:
+        pass
+
+
+class MemoryStore(SnapshotStore):
+    """
+    Keeps snapshots in the process, so matches survive only the loss of the director
+    """
+
+    def __init__(self):
+        self._snapshots: dict[int, str] = {}
+
+    async def save(self, director_id: int, snapshot: str) -> None:
+        self._snapshots[director_id] = snapshot
+
+    async def load(self, director_id: int) -> str | None:
+        return self._snapshots.get(director_id)
+
+    async def delete(self, director_id: int) -> None:
+        self._snapshots.pop(director_id, None)
+
+
+class FileStore(SnapshotStore):
+    """
+    One JSON file per match in `path`, replaced atomically on every save.
+    The files are accessed in threads, so the matches do not wait for the disk.
+    """
+
+    def __init__(self, path: Path):
+        self._path = path
+
+    async def save(self, director_id: int, snapshot: str) -> None:
+        await asyncio.to_thread(self._save, director_id, snapshot)
+
+    async def load(self, director_id: int) -> str | None:
+        return await asyncio.to_thread(self._load, director_id)
+
+    async def delete(self, director_id: int) -> None:
+        await asyncio.to_thread(self._file(director_id).unlink, missing_ok=True)
+
+    def _save(self, director_id: int, snapshot: str) -> None:
+        self._path.mkdir(parents=True, exist_ok=True)
+        file = self._file(director_id)
+        temporary = file.with_suffix('.tmp')
+        temporary.write_text(snapshot, encoding='utf-8')
+        temporary.replace(file)
+
+    def _load(self, director_id: int) -> str | None:
+        try:
+            return self._file(director_id).read_text(encoding='utf-8')
+        except FileNotFoundError:
+            return None
+
+    def _file(self, director_id: int) -> Path:
+        return self._path / f'{director_id}.json'
+
+
+class SQLiteStore(SnapshotStore):
+    """
+    Snapshots in a SQLite table, shared by the workers of one host.
+    The connection is used by a dedicated thread, so the matches do not wait for the database.
+    """
+
+    def __init__(self, path: Path):
+        self._path = path
+        self._db: sqlite3.Connection | None = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='snapshots')
+
+    async def save(self, director_id: int, snapshot: str) -> None:
+        await self._run(self._save, director_id, snapshot)
+
+    async def load(self, director_id: int) -> str | None:
+        return await self._run(self._load, director_id)
+
+    async def delete(self, director_id: int) -> None:
+        await self._run(self._delete, director_id)
+
+    async def close(self) -> None:
+        await self._run(self._close)
+
+    async def _run(self, function: Callable, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, function, *args)
+
+    def _save(self, director_id: int, snapshot: str) -> None:
+        with self._connect() as db:
+            db.execute(
+                'INSERT OR REPLACE INTO director_snapshot (director_id, snapshot) VALUES (?, ?)',
+                (str(director_id), snapshot),
+            )
+
+    def _load(self, director_id: int) -> str | None:
+        row = (
+            self._connect()
+            .execute('SELECT snapshot FROM director_snapshot WHERE director_id = ?', (str(director_id),))
+            .fetchone()
+        )
+        return None if row is None else row[0]
+
+    def _delete(self, director_id: int) -> None:
+        with self._connect() as db:
+            db.execute('DELETE FROM director_snapshot WHERE director_id = ?', (str(director_id),))
+
+    def _close(self) -> None:
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._db is None:
+            self._db = sqlite3.connect(self._path)
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute('PRAGMA synchronous=NORMAL')
+            # director ids are 128-bit, which does not fit INTEGER
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS director_snapshot (director_id TEXT PRIMARY KEY, snapshot TEXT NOT NULL)'
+            )
+        return self._db
+
+
+class PostgresStore(SnapshotStore):
+    """
+    Snapshots in a Postgres table, shared by the workers of every host. Requires `asyncpg`.
+    """
+
+    def __init__(self, dsn: str):
+        assert asyncpg is not None, 'Install asyncpg to keep snapshots in Postgres'
+        self._dsn = dsn
+        self._pool: asyncpg.Pool | None = None
+        self._connecting = asyncio.Lock()
+
+    async def save(self, director_id: int, snapshot: str) -> None:
+        pool = await self._connect()
+        await pool.execute(
+            'INSERT INTO director_snapshot (director_id, snapshot) VALUES ($1, $2) '
+            'ON CONFLICT (director_id) DO UPDATE SET snapshot = EXCLUDED.snapshot, updated_at = now()',
+            str(director_id),
+            snapshot,
+        )
+
+    async def load(self, director_id: int) -> str | None:
+        pool = await self._connect()
+        return await pool.fetchval('SELECT snapshot FROM director_snapshot WHERE director_id = $1', str(director_id))
+
+    async def delete(self, director_id: int) -> None:
+        pool = await self._connect()
+        await pool.execute('DELETE FROM director_snapshot WHERE director_id = $1', str(director_id))
+
+    async def close(self) -> None:
+        if self._pool is not None:
+            await self._pool.close()
+            self._pool = None
+
+    async def _connect(self) -> 'asyncpg.Pool':
+        async with self._connecting:
+            if self._pool is None:
+                pool = await asyncpg.create_pool(self._dsn)
+                await pool.execute(
+                    'CREATE TABLE IF NOT EXISTS director_snapshot ('
+                    'director_id TEXT PRIMARY KEY, snapshot TEXT NOT NULL, '
+                    'updated_at TIMESTAMPTZ NOT NULL DEFAULT now())'
+                )
+                self._pool = pool
+        return self._pool
+
+
+def create_store(kind: str, path: Path, dsn: str) -> SnapshotStore | None:
+    match kind:
+        case 'none':
+            return None
+        case 'memory':
+            return MemoryStore()
+        case 'file':
+            return FileStore(path)
+        case 'sqlite':
+            return SQLiteStore(path)
+        case 'postgres':
+            return PostgresStore(dsn)
+    raise ValueError(f'Unknown snapshot store {kind}')
+
+
+snapshot_store = create_store(settings.SNAPSHOT_STORE, settings.SNAPSHOT_PATH, settings.SNAPSHOT_DSN)
@@ -0,0 +1,72 @@
+import asyncio
+import logging
+import math
+from collections.abc import Callable
+
+from .config import settings
+from .metrics import registry
+
+pending_timers = registry.gauge('contest_timers_pending', 'Timers scheduled on the timer wheel')
+
+
+class Timer:
+    def __init__(self, deadline: int, callback: Callable[[], None]):
+        # tick of the wheel when the timer fires
+        self.deadline = deadline
+        self.callback = callback
+        self._slot: set[Timer] | None = None
+
+    def cancel(self) -> None:
+        if self._slot is not None:
+            self._slot.discard(self)
+            self._slot = None
+            pending_timers.dec()
+
+
+class TimerWheel:
+    """
+    Hashed timing wheel. One task advances the wheel every `tick` seconds and fires the timers of the slot,
+    so the timers of all matches cost a set entry each instead of a task each.
+    Timers fire up to a tick late, which is fine for deadlines of players.
+    """
+
+    def __init__(self, tick: float, slots: int = 512):
+        self._tick = tick
+        self._slots: list[set[Timer]] = [set() for _ in range(slots)]
+        # ticks passed since the start
+        self._now = 0
+        self._task: asyncio.Task | None = None
+
+    def schedule(self, delay: float, callback: Callable[[], None]) -> Timer:
+        """
+        :param callback: called in the task of the wheel, so it must not block
+        """
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+        timer = Timer(self._now + max(math.ceil(delay / self._tick), 1), callback)
+        timer._slot = self._slots[timer.deadline % len(self._slots)]
+        timer._slot.add(timer)
+        pending_timers.inc()
+        return timer
+
+    def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        start = loop.time() - self._now * self._tick
+        while True:
+            await asyncio.sleep(max(start + (self._now + 1) * self._tick - loop.time(), 0))
+            self._now += 1
+            slot = self._slots[self._now % len(self._slots)]
+            # the rest of the timers of the slot are due in the next rounds of the wheel
+            for timer in [timer for timer in slot if timer.deadline <= self._now]:
+                timer.cancel()
+                try:
+                    timer.callback()
+                except Exception:
+                    logging.exception('Timer callback failed')
+
+
+turn_timers = TimerWheel(settings.TURN_TIMER_TICK)
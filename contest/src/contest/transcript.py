@@ -0,0 +1,110 @@
+import asyncio
+import logging
+
+from commonlib.models import Message
+
+from .metrics import TOKEN_BUCKETS, registry
+
+transcript_tokens = registry.histogram(
+    'contest_transcript_tokens',
+    'Estimated prompt tokens of the transcript sent to the LLM with a request',
+    TOKEN_BUCKETS,
+)
+summaries = registry.counter('contest_transcript_summaries_total', 'Finished transcript summarizations, by status')
+
+
+def estimate_tokens(messages: list[Message]) -> int:
+    # roughly four characters per token for english text
+    return sum(len(message['content']) for message in messages) // 4
+
+
+class Transcript:
+    """
+    Actions of the match in the form they are sent to the LLM.
+    With compaction enabled only the last `keep_turns` turns are sent verbatim.
+    Older actions are folded into a summary, which is updated in the background,
+    so the prompt size does not grow with the match length.
+    """
+
+    def __init__(self, summarize, compact: bool, keep_turns: int, token_budget: int, summary_tokens: int):
+        """
+        :param summarize: coroutine function (summary, actions, max_tokens) -> new summary
+        """
+        self._summarize = summarize
+        self._compact = compact
+        self._keep_messages = 2 * keep_turns
+        self._token_budget = token_budget
+        self._summary_tokens = summary_tokens
+
+        self._actions: list[Message] = []
+        self._summary = ''
+        # number of the first actions which are covered by the summary
+        self._summarized = 0
+        self._summarizing: asyncio.Task | None = None
+
+    @property
+    def actions(self) -> list[Message]:
+        return self._actions
+
+    @property
+    def turns(self) -> int:
+        return len(self._actions) // 2
+
+    def append(self, actions: list[Message]) -> None:
+        self._actions += actions
+        if self._compact:
+            self._maybe_summarize()
+
+    def messages(self) -> list[Message]:
+        """
+        :return: messages to send instead of the full list of actions
+        """
+        messages = list(self._actions[self._summarized :])
+        if self._summary:
+            messages.insert(0, {'role': 'user', 'content': f'Summary of the previous actions:\n{self._summary}'})
+        return messages
+
+    def snapshot(self) -> tuple[list[Message], str, int]:
+        """
+        :return: actions, summary and the number of summarized actions, see `restore`
+        """
+        return self._actions, self._summary, self._summarized
+
+    def restore(self, actions: list[Message], summary: str, summarized: int) -> None:
+        self._actions = list(actions)
+        self._summary = summary
+        self._summarized = summarized
+        if self._compact:
+            self._maybe_summarize()
+
+    def close(self) -> None:
+        if self._summarizing is not None:
+            self._summarizing.cancel()
+
+    def _maybe_summarize(self) -> None:
+        if self._summarizing is not None:
+            return
+        end = max(len(self._actions) - self._keep_messages, self._summarized)
+        # keep the last action verbatim even if it alone exceeds the budget
+        while end < len(self._actions) - 1 and estimate_tokens(self._actions[end:]) > self._token_budget:
+            end += 1
+        if end > self._summarized:
+            self._summarizing = asyncio.create_task(self._fold(end))
+
+    async def _fold(self, end: int) -> None:
+        try:
+            self._summary = await self._summarize(
+                self._summary,
+                self._actions[self._summarized : end],
+                self._summary_tokens,
+            )
+            self._summarized = end
+            summaries.inc(status='ok')
+        except Exception:
+            logging.exception('Transcript summarization failed')
+            summaries.inc(status='error')
+            return
+        finally:
+            self._summarizing = None
+        # actions could have been appended while the summary was generated
+        self._maybe_summarize()
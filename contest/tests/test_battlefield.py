@@ -1,7 +1,10 @@
+import json
+
 import pytest
 from commonlib.models import Message
 
 from contest.battlefield import Battlefield
+from contest.transcript import transcript_tokens
 
 
 @pytest.fixture
@@ -39,8 +42,11 @@ async def test_start_contest(httpx_mock, battlefield):
 async def test_get_turn(httpx_mock, battlefield):
     httpx_mock.add_response(text="0")
 
+    count = transcript_tokens.count()
+
     turn_user_id = await battlefield.get_user_to_make_turn()
     assert turn_user_id == 3
+    assert transcript_tokens.count() == count + 1
 
 
 @pytest.mark.asyncio
@@ -67,3 +73,72 @@ async def test_get_winner_tie(httpx_mock, battlefield):
 
     result = await battlefield.get_winner()
     assert result.tie is True
+
+
+async def test_cast_spell_stream(httpx_mock, battlefield):
+    new_actions = [
+        {"role": "user", "content": "Merlin uses Fireball"},
+        {"role": "assistant", "content": "Merlin casts a fireball!"},
+    ]
+    lines = [
+        {"chunk": "Merlin casts "},
+        {"chunk": "a fireball!"},
+        {"response": {"new_actions": new_actions, "description": "Merlin casts a fireball!"}},
+    ]
+    httpx_mock.add_response(content=''.join(json.dumps(line) + '\n' for line in lines).encode())
+
+    chunks = [chunk async for chunk in battlefield.cast_spell_stream(3, 1)]
+
+    assert chunks == ["Merlin casts ", "a fireball!"]
+    assert battlefield._transcript.actions == new_actions
+    assert 1 in battlefield._used_spells
+    assert httpx_mock.get_requests()[0].url.path == "/contest/generate_action_stream"
+
+
+async def test_cast_spell_fused(httpx_mock, mocker, battlefield):
+    mocker.patch('contest.battlefield.settings.FUSED_TURNS', True)
+    new_actions = [
+        {"role": "user", "content": "Merlin uses Fireball"},
+        {"role": "assistant", "content": "Merlin casts a fireball!"},
+    ]
+    httpx_mock.add_response(
+        url="http://llm:8000/contest/generate_turn",
+        json={"new_actions": new_actions, "description": "Merlin casts a fireball!", "next_wizard": 1},
+    )
+
+    action = await battlefield.cast_spell(3, 1)
+    assert action == "Merlin casts a fireball!"
+    assert battlefield._transcript.actions == new_actions
+    request = json.loads(httpx_mock.get_requests()[0].content)
+    assert len(request["wizards"]) == 2
+
+    # the next caster is known without asking the LLM again
+    assert await battlefield.get_user_to_make_turn() == 4
+    assert len(httpx_mock.get_requests()) == 1
+
+
+async def test_session(httpx_mock, mocker, battlefield):
+    mocker.patch('contest.battlefield.settings.LLM_SESSIONS', True)
+    mocker.patch('contest.battlefield.settings.FUSED_TURNS', False)
+    new_actions = [
+        {"role": "user", "content": "Merlin uses Fireball"},
+        {"role": "assistant", "content": "Merlin casts a fireball!"},
+    ]
+    httpx_mock.add_response(url="http://llm:8000/contest/start_contest", json=[])
+    httpx_mock.add_response(url="http://llm:8000/session/create", json="abc")
+    httpx_mock.add_response(
+        url="http://llm:8000/session/generate_action?session_id=abc",
+        json={"new_actions": new_actions, "description": "Merlin casts a fireball!"},
+    )
+    httpx_mock.add_response(url="http://llm:8000/session/determine_turn?session_id=abc", json=1)
+
+    await battlefield.start_contest()
+    assert await battlefield.cast_spell(3, 1) == "Merlin casts a fireball!"
+    assert await battlefield.get_user_to_make_turn() == 4
+
+    # only the current turn is sent, the history stays in the session
+    request = json.loads(httpx_mock.get_requests()[2].content)
+    assert request == {"wizard_index": 0, "spell": {
+        "type_": "ACTIVE", "name": "Fireball", "description": "Launches a fireball", "manacost": 4,
+    }}
+    assert httpx_mock.get_requests()[3].content == b""
@@ -1,8 +1,24 @@
+import asyncio
+
 import pytest
 from commonlib.models import ActionMetadata, ContestResult
+from fastapi import HTTPException, Response
 
+from contest import server
+from contest.battlefield import Battlefield
 from contest.config import settings
-from contest.director import Director
+from contest.director import (
+    ActionStream,
+    CastRejectedError,
+    Director,
+    PlayerNotFoundError,
+    Stage,
+    turn_determination_seconds,
+    turn_timeouts,
+)
+from contest.events import EventType
+from contest.snapshots import FileStore
+from contest.timers import TimerWheel
 
 
 @pytest.fixture
@@ -20,12 +36,12 @@ async def test_set_wizard(httpx_mock, director, test_wizard_1, test_wizard_2):
     # First wizard setup shouldn't start match
     await director.set_wizard(3, test_wizard_1)
     assert len(director._wizards) == 1
-    assert director._match is None
+    assert director.stage == Stage.WIZARDS
 
     # Second wizard setup should start match
     await director.set_wizard(4, test_wizard_2)
     assert len(director._wizards) == 2
-    assert director._match is not None
+    assert director.stage == Stage.DETERMINING
 
 
 @pytest.mark.asyncio
@@ -117,3 +133,406 @@ async def test_tie_result(httpx_mock, director, test_wizard_1, test_wizard_2):
         await director.cast_spell(user_id, -1)
 
     assert director.result.tie is True
+
+
+async def test_action_stream_fan_out():
+    stream = ActionStream()
+    early = asyncio.create_task(anext(stream.subscribe()))
+    await asyncio.sleep(0)
+
+    stream.push("Merlin ")
+    assert await early == "Merlin "
+
+    subscriber = stream.subscribe()
+    stream.push("casts!")
+    stream.close()
+
+    assert [chunk async for chunk in subscriber] == ["Merlin ", "casts!"]
+    assert [chunk async for chunk in stream.subscribe()] == ["Merlin ", "casts!"]
+    assert stream.text == "Merlin casts!"
+
+
+async def test_stream_contest_action(mocker, director, test_wizard_1, test_wizard_2):
+    async def cast_spell_stream(user_id, spell_id):
+        yield "Merlin "
+        await asyncio.sleep(0)
+        yield "casts!"
+
+    mocker.patch.object(director._battlefield, 'start_contest')
+    mocker.patch.object(director._battlefield, 'get_user_to_make_turn', return_value=3)
+    mocker.patch.object(director._battlefield, 'cast_spell_stream', cast_spell_stream)
+
+    await director.set_wizard(3, test_wizard_1)
+    await director.set_wizard(4, test_wizard_2)
+    await asyncio.gather(director.get_user_to_make_turn(), director.get_user_to_make_turn())
+
+    streams = [
+        asyncio.create_task(_collect(director.stream_contest_action())) for _ in range(2)
+    ]
+    await asyncio.sleep(0)
+    cast = asyncio.create_task(director.cast_spell(3, 1))
+
+    for chunks in await asyncio.gather(*streams):
+        assert chunks[0].metadata.spell.id == 1
+        assert [chunk.chunk for chunk in chunks[1:]] == ["Merlin ", "casts!"]
+    actions = await asyncio.gather(director.get_contest_action(), director.get_contest_action())
+    assert all(action.action == "Merlin casts!" for action in actions)
+    cast.cancel()
+
+
+async def _collect(iterator):
+    return [item async for item in iterator]
+
+
+async def test_speculative_turn(mocker, director, test_wizard_1, test_wizard_2):
+    mocker.patch.object(director._battlefield, 'start_contest')
+    get_user_to_make_turn = mocker.patch.object(
+        director._battlefield, 'get_user_to_make_turn', side_effect=[3, 4]
+    )
+    mocker.patch.object(director._battlefield, 'cast_spell', return_value="Merlin casts!")
+    mocker.patch('contest.director.settings.STREAM_ACTIONS', False)
+
+    await director.set_wizard(3, test_wizard_1)
+    await director.set_wizard(4, test_wizard_2)
+    await asyncio.gather(director.get_user_to_make_turn(), director.get_user_to_make_turn())
+    cast = asyncio.create_task(director.cast_spell(3, 1))
+    await director._stage_2.wait()
+
+    # the next caster is determined before the players fetched the action
+    await asyncio.sleep(0)
+    assert get_user_to_make_turn.call_count == 2
+    assert director._next_turn_task is not None
+
+    await asyncio.gather(director.get_contest_action(), director.get_contest_action())
+    users = await asyncio.gather(director.get_user_to_make_turn(), director.get_user_to_make_turn())
+    assert users == [4, 4]
+    assert director._next_turn_task is None
+    cast.cancel()
+
+
+async def test_speculative_turn_consumed(mocker, director, test_wizard_1, test_wizard_2):
+    determined = asyncio.Event()
+
+    async def get_user_to_make_turn():
+        if director._state.user_to_make_turn is None:
+            return 3
+        await determined.wait()
+        return 4
+
+    mocker.patch.object(director._battlefield, 'start_contest')
+    mocker.patch.object(director._battlefield, 'get_user_to_make_turn', get_user_to_make_turn)
+    mocker.patch.object(director._battlefield, 'cast_spell', return_value="Merlin casts!")
+    mocker.patch('contest.director.settings.STREAM_ACTIONS', False)
+
+    await director.set_wizard(3, test_wizard_1)
+    await director.set_wizard(4, test_wizard_2)
+    await asyncio.gather(director.get_user_to_make_turn(), director.get_user_to_make_turn())
+    cast = asyncio.create_task(director.cast_spell(3, 1))
+    await asyncio.gather(director.get_contest_action(), director.get_contest_action())
+    # the next turn waits for the speculation, which finishes afterwards
+    users = asyncio.gather(director.get_user_to_make_turn(), director.get_user_to_make_turn())
+    await asyncio.sleep(0)
+    determined.set()
+
+    assert await users == [4, 4]
+    # a restored match determines the turn after this one again
+    assert director._state.next_turn is None
+    cast.cancel()
+
+
+async def test_speculative_turn_with_subscribers(mocker, director, test_wizard_1, test_wizard_2):
+    mocker.patch.object(director._battlefield, 'start_contest')
+    mocker.patch.object(director._battlefield, 'get_user_to_make_turn', return_value=3)
+    mocker.patch.object(director._battlefield, 'cast_spell', return_value="Merlin casts!")
+    mocker.patch('contest.director.settings.STREAM_ACTIONS', False)
+    speculated = turn_determination_seconds.count(mode='speculative')
+
+    await director.set_wizard(3, test_wizard_1)
+    await director.set_wizard(4, test_wizard_2)
+    events = director.subscribe(3)
+    await director.add_subscriber(4)
+    async for event in events:
+        if event.type == EventType.SPELLS:
+            await director.cast_spell(event.user_id, event.spell_ids[0])
+        elif event.type == EventType.TURN and director.step == 1:
+            break
+
+    # nothing to overlap, the next turn starts as soon as the action is published
+    assert turn_determination_seconds.count(mode='speculative') == speculated
+    director.close()
+
+
+async def test_speculative_turn_cancelled(mocker, director, test_wizard_1, test_wizard_2):
+    determined = asyncio.Event()
+
+    async def get_user_to_make_turn():
+        if director._state.user_to_make_turn is None:
+            return 3
+        await determined.wait()
+
+    mocker.patch.object(director._battlefield, 'start_contest')
+    mocker.patch.object(director._battlefield, 'get_user_to_make_turn', get_user_to_make_turn)
+    mocker.patch.object(director._battlefield, 'cast_spell', return_value="Merlin casts!")
+    mocker.patch('contest.director.settings.STREAM_ACTIONS', False)
+
+    await director.set_wizard(3, test_wizard_1)
+    await director.set_wizard(4, test_wizard_2)
+    await asyncio.gather(director.get_user_to_make_turn(), director.get_user_to_make_turn())
+    cast = asyncio.create_task(director.cast_spell(3, 1))
+    await director._stage_2.wait()
+    task = director._next_turn_task
+
+    director.close()
+    await asyncio.sleep(0)
+    assert task.cancelled()
+    cast.cancel()
+
+
+async def test_close_releases_requests(mocker, director, test_wizard_1, test_wizard_2):
+    mocker.patch.object(director._battlefield, 'start_contest')
+    mocker.patch.object(director._battlefield, 'get_user_to_make_turn', return_value=3)
+    mocker.patch('contest.server.directors.get', return_value=director)
+
+    await director.set_wizard(3, test_wizard_1)
+    await director.set_wizard(4, test_wizard_2)
+    action = asyncio.create_task(server.get_action(1))
+    await asyncio.sleep(0)
+
+    # the director is evicted while the player waits for the action
+    director.close()
+    with pytest.raises(HTTPException) as e:
+        await action
+    assert e.value.status_code == 410
+    with pytest.raises(HTTPException) as e:
+        await server.get_user_to_make_turn(1)
+    assert e.value.status_code == 410
+
+
+async def test_restore(mocker, tmp_path, test_wizard_1, test_wizard_2):
+    mocker.patch('contest.director.settings.STREAM_ACTIONS', False)
+    mocker.patch('contest.director.settings.SPECULATIVE_TURNS', False)
+    mocker.patch.object(Battlefield, 'start_contest')
+    mocker.patch.object(Battlefield, 'get_user_to_make_turn', side_effect=[3, 4])
+    cast_spell = mocker.patch.object(Battlefield, 'cast_spell', return_value="Merlin casts!")
+    store = FileStore(tmp_path)
+    director = Director(director_id=1, store=store)
+
+    await director.set_wizard(3, test_wizard_1)
+    await director.set_wizard(4, test_wizard_2)
+    await asyncio.gather(director.get_user_to_make_turn(), director.get_user_to_make_turn())
+    cast = asyncio.create_task(director.cast_spell(3, 1))
+    await director._stage_2.wait()
+    await director.get_contest_action()
+    # the worker dies after one of the players received the action
+    director.close()
+    cast.cancel()
+
+    restored = Director.restore(1, await store.load(1), store)
+    assert restored.stage == Stage.ACTION
+    action = await restored.get_contest_action()
+    assert action.action == "Merlin casts!"
+    users = await asyncio.gather(restored.get_user_to_make_turn(), restored.get_user_to_make_turn())
+    assert users == [4, 4]
+    cast_spell.assert_called_once()
+
+
+async def test_restore_casting(mocker, tmp_path, test_wizard_1, test_wizard_2):
+    calls = []
+
+    async def cast_spell(user_id, spell_id):
+        calls.append(spell_id)
+        if len(calls) == 1:
+            await asyncio.Event().wait()
+        return "Merlin casts!"
+
+    mocker.patch('contest.director.settings.STREAM_ACTIONS', False)
+    mocker.patch.object(Battlefield, 'start_contest')
+    mocker.patch.object(Battlefield, 'get_user_to_make_turn', return_value=3)
+    mocker.patch.object(Battlefield, 'cast_spell', side_effect=cast_spell)
+    store = FileStore(tmp_path)
+    director = Director(director_id=1, store=store)
+
+    await director.set_wizard(3, test_wizard_1)
+    await director.set_wizard(4, test_wizard_2)
+    await asyncio.gather(director.get_user_to_make_turn(), director.get_user_to_make_turn())
+    cast = asyncio.create_task(director.cast_spell(3, 1))
+    # the snapshots are saved in a thread
+    while '"stage":"casting"' not in await store.load(1):
+        await asyncio.sleep(0.01)
+    # the worker dies while the action is generated
+    assert director.stage == Stage.CASTING
+    director.close()
+    cast.cancel()
+
+    restored = Director.restore(1, await store.load(1), store)
+    actions = await asyncio.gather(restored.get_contest_action(), restored.get_contest_action())
+    assert all(action.action == "Merlin casts!" for action in actions)
+    assert actions[0].metadata.spell.id == 1
+    assert calls == [1, 1]
+    restored.close()
+
+
+async def test_subscribe(mocker, director, test_wizard_1, test_wizard_2):
+    async def cast_spell_stream(user_id, spell_id):
+        yield "Merlin "
+        yield "casts!"
+
+    mocker.patch('contest.director.settings.TURNS_COUNT', 1)
+    mocker.patch.object(director._battlefield, 'start_contest')
+    mocker.patch.object(director._battlefield, 'get_user_to_make_turn', return_value=3)
+    mocker.patch.object(director._battlefield, 'cast_spell_stream', cast_spell_stream)
+    mocker.patch.object(director._battlefield, 'get_winner', return_value=ContestResult(winner=test_wizard_1))
+
+    await director.set_wizard(3, test_wizard_1)
+    await director.set_wizard(4, test_wizard_2)
+    # players who subscribed do not request the turn and the action
+    players = [director.subscribe(user_id) for user_id in (3, 4)]
+    assert [(await anext(events)).type for events in players] == [EventType.TURN, EventType.TURN]
+    spells = await anext(players[0])
+    assert (spells.user_id, spells.spell_ids) == (3, [1, 2])
+
+    await director.cast_spell(3, 1)
+    events = [event async for event in players[0]]
+    assert [event.type for event in events] == [
+        EventType.CAST, EventType.CHUNK, EventType.CHUNK, EventType.ACTION, EventType.RESULT
+    ]
+    assert events[3].action.action == "Merlin casts!"
+    assert events[4].result.winner == test_wizard_1
+    assert director.finished
+
+    # a reconnected player resumes after the last received event
+    resumed = [event.seq async for event in director.subscribe(4, after=events[2].seq)]
+    assert resumed == [events[3].seq, events[4].seq]
+
+
+async def test_subscribe_non_player(mocker, director, test_wizard_1, test_wizard_2):
+    mocker.patch.object(director._battlefield, 'start_contest')
+    mocker.patch.object(director._battlefield, 'get_user_to_make_turn', return_value=3)
+    await director.set_wizard(3, test_wizard_1)
+    await director.set_wizard(4, test_wizard_2)
+
+    with pytest.raises(PlayerNotFoundError):
+        await director.add_subscriber(999)
+    # the match still waits for both polling players
+    assert await director.get_user_to_make_turn() == 3
+    assert director.stage == Stage.TURN
+    with pytest.raises(HTTPException) as error:
+        await server.add_subscriber(director, 999)
+    assert error.value.status_code == 404
+
+
+async def test_match_state(mocker, director, test_wizard_1, test_wizard_2):
+    mocker.patch('contest.director.settings.TURNS_COUNT', 1)
+    mocker.patch.object(director._battlefield, 'start_contest')
+    mocker.patch.object(director._battlefield, 'get_user_to_make_turn', return_value=3)
+    mocker.patch.object(director._battlefield, 'cast_spell', return_value="Merlin casts!")
+    mocker.patch.object(director._battlefield, 'get_winner', return_value=ContestResult(winner=test_wizard_1))
+    mocker.patch('contest.director.settings.STREAM_ACTIONS', False)
+    mocker.patch('contest.server.directors.get', return_value=director)
+    finalize = mocker.patch('contest.server.directors.finalize')
+
+    await director.set_wizard(3, test_wizard_1)
+    await director.set_wizard(4, test_wizard_2)
+    await asyncio.sleep(0)
+    # players who follow the state are not waited for to request the turn
+    response = Response()
+    view = await server.match_state(1, 3, response)
+    assert (view.stage, view.user_to_make_turn, view.available_spell_ids) == (Stage.TURN, 3, None)
+    view = await server.match_state(1, 4, response)
+    assert (view.stage, view.user_to_make_turn, view.available_spell_ids) == (Stage.SPELL, 3, None)
+    etag = response.headers['ETag']
+    assert (await server.match_state(1, 3, Response())).available_spell_ids == [1, 2]
+
+    # the unchanged state is not sent again
+    not_modified = await server.match_state(1, 4, Response(), if_none_match=etag, timeout=0.01)
+    assert not_modified.status_code == 304
+    response = Response()
+    waiting = asyncio.create_task(server.match_state(1, 4, response, if_none_match=etag))
+    await director.cast_spell(3, 1)
+    view = await waiting
+    # the cast is accepted before its action is generated
+    while view.stage != Stage.FINISHED:
+        etag, response = response.headers['ETag'], Response()
+        view = await server.match_state(1, 4, response, if_none_match=etag)
+    assert view.action.action == "Merlin casts!"
+    assert view.result.winner == test_wizard_1
+    # the match is finalized once every player is served its end
+    finalize.assert_not_called()
+    await server.match_state(1, 3, Response())
+    finalize.assert_called_once_with(1)
+
+
+async def test_events_finalize(mocker, director, test_wizard_1, test_wizard_2):
+    mocker.patch('contest.director.settings.TURNS_COUNT', 1)
+    mocker.patch.object(director._battlefield, 'start_contest')
+    mocker.patch.object(director._battlefield, 'get_user_to_make_turn', return_value=3)
+    mocker.patch.object(director._battlefield, 'cast_spell', return_value="Merlin casts!")
+    mocker.patch.object(director._battlefield, 'get_winner', return_value=ContestResult(winner=test_wizard_1))
+    mocker.patch('contest.director.settings.STREAM_ACTIONS', False)
+    mocker.patch('contest.server.directors.get', return_value=director)
+    finalize = mocker.patch('contest.server.directors.finalize')
+
+    await director.set_wizard(3, test_wizard_1)
+    await director.set_wizard(4, test_wizard_2)
+    streams = [(await server.events(1, user_id)).body_iterator for user_id in (3, 4)]
+    await director.cast_spell(3, 1)
+    lines = [line async for line in streams[0]]
+    assert 'event: result' in lines[-1]
+    # the match is finalized once every subscriber has read its events
+    finalize.assert_not_called()
+    assert [line async for line in streams[1]] == lines
+    finalize.assert_called_once_with(1)
+
+
+async def test_turn_timeout(mocker, test_wizard_1, test_wizard_2):
+    director = Director(timers=TimerWheel(tick=0.01))
+    mocker.patch('contest.director.settings.TURN_TIMEOUT', 0.02)
+    mocker.patch('contest.director.settings.STREAM_ACTIONS', False)
+    mocker.patch.object(director._battlefield, 'start_contest')
+    mocker.patch.object(director._battlefield, 'get_user_to_make_turn', return_value=3)
+    cast_spell = mocker.patch.object(director._battlefield, 'cast_spell', return_value="Merlin casts!")
+    autopilot = turn_timeouts.value(outcome='autopilot')
+
+    await director.set_wizard(3, test_wizard_1)
+    await director.set_wizard(4, test_wizard_2)
+    events = director.subscribe(4)
+    await director.add_subscriber(3)
+    # the cheapest spell is cast for the caster who missed the deadline
+    assert [(await anext(events)).type for _ in range(5)] == [
+        EventType.TURN, EventType.SPELLS, EventType.CAST, EventType.CHUNK, EventType.ACTION
+    ]
+    cast_spell.assert_called_once_with(3, 2)
+    assert turn_timeouts.value(outcome='autopilot') == autopilot + 1
+
+    # the caster forfeits after missing the deadline again
+    result = [event async for event in events][-1]
+    assert result.type == EventType.RESULT
+    assert result.result.winner == test_wizard_2
+    assert director.finished
+    # a late cast is rejected instead of waiting for the next turn forever
+    with pytest.raises(CastRejectedError):
+        await director.cast_spell(3, 1)
+    mocker.patch('contest.server.directors.get', return_value=director)
+    with pytest.raises(HTTPException) as e:
+        await server.cast_spell(1, 3, 1)
+    assert e.value.status_code == 409
+
+
+async def test_concurrent_casts(mocker, director, test_wizard_1, test_wizard_2):
+    mocker.patch.object(director._battlefield, 'start_contest')
+    mocker.patch.object(director._battlefield, 'get_user_to_make_turn', return_value=3)
+    cast_spell = mocker.patch.object(director._battlefield, 'cast_spell', return_value="Merlin casts!")
+    mocker.patch('contest.director.settings.STREAM_ACTIONS', False)
+    mocker.patch('contest.server.directors.get', return_value=director)
+
+    await director.set_wizard(3, test_wizard_1)
+    await director.set_wizard(4, test_wizard_2)
+    # both casts wait for the spell stage, only one of them is accepted
+    casts = asyncio.gather(server.cast_spell(1, 3, 1), server.cast_spell(1, 3, 2), return_exceptions=True)
+    await asyncio.gather(director.get_user_to_make_turn(), director.get_user_to_make_turn())
+    accepted, rejected = await casts
+    assert accepted is None
+    assert rejected.status_code == 409
+    await director._stage_2.wait()
+    cast_spell.assert_called_once_with(3, 1)
+    director.close()
@@ -0,0 +1,149 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+from contest import server
+from contest.directors import (
+    DirectorNotFoundError,
+    DirectorRegistry,
+    DrainingError,
+    MisdirectedError,
+    RegistryFullError,
+    evicted_directors,
+    resumed_directors,
+    shard_of,
+)
+from contest.snapshots import MemoryStore
+
+
+async def test_eviction(mocker):
+    monotonic = mocker.patch('contest.directors.time.monotonic', return_value=0)
+    directors = DirectorRegistry(max_size=8, ttl=100, idle_timeout=10)
+    idle = await directors.create()
+    active = await directors.create()
+    close = mocker.patch.object(await directors.get(idle), 'close')
+    idle_evictions = evicted_directors.value(reason='idle')
+
+    monotonic.return_value = 9
+    await directors.get(active)
+    monotonic.return_value = 15
+    await directors.evict_expired()
+
+    with pytest.raises(DirectorNotFoundError):
+        await directors.get(idle)
+    close.assert_called_once()
+    assert evicted_directors.value(reason='idle') == idle_evictions + 1
+
+    # the lifetime is limited even for the active matches
+    for moment in range(18, 101, 8):
+        monotonic.return_value = moment
+        await directors.get(active)
+    monotonic.return_value = 100
+    await directors.evict_expired()
+    assert len(directors) == 0
+
+
+async def test_max_size(mocker):
+    monotonic = mocker.patch('contest.directors.time.monotonic', return_value=0)
+    directors = DirectorRegistry(max_size=1, ttl=100, idle_timeout=10)
+    await directors.create()
+
+    with pytest.raises(RegistryFullError):
+        await directors.create()
+
+    # expired directors are evicted to make room
+    monotonic.return_value = 10
+    await directors.create()
+    assert len(directors) == 1
+
+
+async def test_finalize():
+    directors = DirectorRegistry(max_size=1, ttl=100, idle_timeout=10)
+    director_id = await directors.create()
+
+    await directors.finalize(director_id)
+    await directors.finalize(director_id)
+
+    assert len(directors) == 0
+    assert await directors.create()
+
+
+async def test_create_director_backpressure(mocker):
+    mocker.patch('contest.server.directors', DirectorRegistry(max_size=0, ttl=100, idle_timeout=10))
+
+    with pytest.raises(HTTPException) as error:
+        await server.create_director()
+    assert error.value.status_code == 503
+    with pytest.raises(HTTPException) as error:
+        await server.get_user_to_make_turn(1)
+    assert error.value.status_code == 404
+
+
+async def test_resume(test_wizard_1):
+    store = MemoryStore()
+    directors = DirectorRegistry(max_size=1, ttl=100, idle_timeout=10, store=store)
+    director_id = await directors.create()
+    await (await directors.get(director_id)).set_wizard(3, test_wizard_1)
+    resumed = resumed_directors.value()
+
+    # another worker knows the match only from the snapshot
+    worker = DirectorRegistry(max_size=1, ttl=100, idle_timeout=10, store=store)
+    director = await worker.get(director_id)
+    assert director._wizards == {3: test_wizard_1}
+    assert resumed_directors.value() == resumed + 1
+
+    await worker.finalize(director_id)
+    assert await store.load(director_id) is None
+    with pytest.raises(DirectorNotFoundError):
+        await worker.get(director_id)
+
+
+async def test_finalize_is_not_resumed(mocker, test_wizard_1):
+    store = MemoryStore()
+    directors = DirectorRegistry(max_size=1, ttl=100, idle_timeout=10, store=store)
+    director_id = await directors.create()
+    director = await directors.get(director_id)
+    await director.set_wizard(3, test_wizard_1)
+    released = asyncio.Event()
+
+    async def release():
+        await released.wait()
+
+    mocker.patch.object(director, 'release', release)
+    finalize = asyncio.create_task(directors.finalize(director_id))
+    await asyncio.sleep(0)
+
+    # the match is not served, nor resumed from its snapshot, while it is released
+    with pytest.raises(DirectorNotFoundError):
+        await directors.get(director_id)
+    released.set()
+    await finalize
+    assert await store.load(director_id) is None
+    with pytest.raises(DirectorNotFoundError):
+        await directors.get(director_id)
+
+
+async def test_shard():
+    directors = DirectorRegistry(max_size=8, ttl=100, idle_timeout=10, shard=3)
+    director_id = await directors.create()
+    assert shard_of(director_id) == 3
+    await directors.get(director_id)
+
+    with pytest.raises(MisdirectedError):
+        await directors.get(director_id - 1)
+
+    directors.draining = True
+    with pytest.raises(DrainingError):
+        await directors.create()
+    await directors.get(director_id)
+
+
+async def test_finalize_deletes_session(httpx_mock):
+    httpx_mock.add_response(url='http://llm:8000/session/delete?session_id=abc')
+    directors = DirectorRegistry(max_size=1, ttl=100, idle_timeout=10)
+    director_id = await directors.create()
+    (await directors.get(director_id))._battlefield._session_id = 'abc'
+
+    await directors.finalize(director_id)
+    assert httpx_mock.get_request().url.path == '/session/delete'
@@ -0,0 +1,36 @@
+import asyncio
+
+from contest.events import EventLog, EventType, dropped_subscribers
+
+
+async def _collect(iterator):
+    return [event.seq async for event in iterator]
+
+
+async def test_resume():
+    log = EventLog(history_size=3, buffer_size=8)
+    for _ in range(4):
+        log.publish(EventType.CHUNK, chunk='Merlin ')
+    subscriber = asyncio.create_task(_collect(log.subscribe(after=2)))
+    await asyncio.sleep(0)
+    log.publish(EventType.CHUNK, chunk='casts!')
+    log.close()
+
+    assert await subscriber == [3, 4, 5]
+    # events older than the history are lost
+    assert await _collect(log.subscribe()) == [3, 4, 5]
+    assert log.publish(EventType.CHUNK, chunk='late') is None
+
+
+async def test_slow_subscriber():
+    log = EventLog(history_size=16, buffer_size=2)
+    dropped = dropped_subscribers.value()
+    subscription = log.subscribe()
+    log.publish(EventType.TURN, user_id=3)
+    assert (await anext(subscription)).seq == 1
+
+    for _ in range(3):
+        log.publish(EventType.CHUNK, chunk='Merlin ')
+    # the buffered events are delivered before the subscription ends
+    assert [event.seq async for event in subscription] == [2, 3]
+    assert dropped_subscribers.value() == dropped + 1
@@ -0,0 +1,62 @@
+import asyncio
+
+import pytest
+from commonlib.models import ContestResult
+
+from contest.directors import DirectorNotFoundError, DirectorRegistry
+from contest.events import EventType
+from contest.feed import Feed, FeedRequest, feed_subscriptions
+
+
+async def test_feed(mocker, test_wizard_1, test_wizard_2):
+    async def cast_spell_stream(user_id, spell_id):
+        yield 'Merlin casts!'
+
+    mocker.patch('contest.director.settings.TURNS_COUNT', 1)
+    directors = DirectorRegistry(max_size=8, ttl=100, idle_timeout=100)
+    director_ids = [await directors.create() for _ in range(2)]
+    for director_id in director_ids:
+        director = await directors.get(director_id)
+        mocker.patch.object(director._battlefield, 'start_contest')
+        mocker.patch.object(director._battlefield, 'get_user_to_make_turn', return_value=3)
+        mocker.patch.object(director._battlefield, 'cast_spell_stream', cast_spell_stream)
+        mocker.patch.object(director._battlefield, 'get_winner', return_value=ContestResult(winner=test_wizard_1))
+        await director.set_wizard(3, test_wizard_1)
+        await director.set_wizard(4, test_wizard_2)
+
+    feed = Feed(directors, buffer_size=64)
+    subscriptions = feed_subscriptions.value()
+    messages = feed.messages()
+    # both players of both matches share the connection
+    for director_id in director_ids:
+        for user_id in (3, 4):
+            await feed.handle(FeedRequest(action='subscribe', director_id=director_id, user_id=user_id))
+    assert feed_subscriptions.value() == subscriptions + 2
+    await feed.handle(FeedRequest(action='subscribe', director_id=1))
+
+    received = [await anext(messages) for _ in range(5)]
+    assert received[0].director_id == 1 and received[0].error.startswith('DirectorNotFoundError')
+    assert sorted((message.director_id, message.event.type) for message in received[1:]) == sorted(
+        (director_id, type_) for director_id in director_ids for type_ in (EventType.TURN, EventType.SPELLS)
+    )
+
+    # the unsubscribed match is played further, but its events are not sent
+    feed.unsubscribe(director_ids[1])
+    await (await directors.get(director_ids[1])).cast_spell(3, 1)
+    await (await directors.get(director_ids[0])).cast_spell(3, 1)
+    received = [await anext(messages) for _ in range(4)]
+    assert {message.director_id for message in received} == {director_ids[0]}
+    assert [message.event.type for message in received] == [
+        EventType.CAST,
+        EventType.CHUNK,
+        EventType.ACTION,
+        EventType.RESULT,
+    ]
+    assert received[3].event.result.winner == test_wizard_1
+
+    # the finished match is finalized once its events are forwarded
+    await asyncio.sleep(0)
+    with pytest.raises(DirectorNotFoundError):
+        await directors.get(director_ids[0])
+    assert feed_subscriptions.value() == subscriptions
+    feed.close()
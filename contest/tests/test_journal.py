@@ -0,0 +1,66 @@
+import httpx
+from commonlib.models import ContestResult
+
+from contest import battlefield
+from contest.director import Director
+from contest.events import EventType
+from contest.journal import Journal, JournalTransport, read_journal
+from contest.replay import replay_match
+
+
+def _action_stream(text: str) -> bytes:
+    return (
+        f'{{"chunk": "{text}"}}\n'
+        f'{{"response": {{"new_actions": [{{"role": "assistant", "content": "{text}"}}], "description": "{text}"}}}}\n'
+    ).encode()
+
+
+async def test_record_and_replay(httpx_mock, mocker, tmp_path, test_wizard_1, test_wizard_2):
+    mocker.patch('contest.director.settings.TURNS_COUNT', 2)
+    journal = Journal(tmp_path / 'journal.jsonl', fsync_interval=60)
+    mocker.patch.object(
+        battlefield.llm_client,
+        'client',
+        httpx.AsyncClient(base_url='http://llm', transport=JournalTransport(journal)),
+    )
+    httpx_mock.add_response(url='http://llm/contest/start_contest', json=[])
+    httpx_mock.add_response(url='http://llm/contest/determine_turn', json=0)
+    httpx_mock.add_response(url='http://llm/contest/determine_turn', json=1)
+    httpx_mock.add_response(url='http://llm/contest/generate_action_stream', content=_action_stream('Merlin casts!'))
+    httpx_mock.add_response(url='http://llm/contest/generate_action_stream', content=_action_stream('Gandalf casts!'))
+    httpx_mock.add_response(url='http://llm/contest/pick_winner', json='Gandalf')
+
+    director = Director(director_id=7, journal=journal)
+    await director.set_wizard(3, test_wizard_1)
+    await director.set_wizard(4, test_wizard_2)
+    events = director.subscribe(3)
+    await director.add_subscriber(4)
+    async for event in events:
+        if event.type == EventType.SPELLS:
+            await director.cast_spell(event.user_id, event.spell_ids[0])
+    assert director.result == ContestResult(winner=test_wizard_2)
+    await journal.close()
+
+    records = read_journal(tmp_path / 'journal.jsonl')[7]
+    kinds = [record['kind'] for record in records]
+    assert kinds[0] == 'match'
+    assert kinds.count('llm') == 6
+    assert kinds.count('cast') == kinds.count('action') == 2
+    # the requests are recorded by digest, the transcripts they carry are not repeated
+    assert all(len(record['request']) == 16 for record in records if record['kind'] == 'llm')
+
+    # the LLM answers come from the journal, the mock has no responses left
+    # and the match is played with its recorded settings, the ones of the service are left intact
+    mocker.patch('contest.director.settings.TURNS_COUNT', 5)
+    client = battlefield.llm_client.client
+    replay = await replay_match(7, records, timeout=5)
+    assert replay.turns == 2
+    assert replay.mismatches == []
+    assert battlefield.llm_client.client is client
+
+    # a different answer of the LLM is reported
+    records = read_journal(tmp_path / 'journal.jsonl')[7]
+    stream = next(record for record in records if record.get('path') == '/contest/generate_action_stream')
+    stream['response'] = _action_stream('Merlin slips!').decode()
+    replay = await replay_match(7, records, timeout=5)
+    assert replay.mismatches == ["Turn 0: ('Merlin casts!', None) was replayed as ('Merlin slips!', None)"]
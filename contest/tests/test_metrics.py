@@ -0,0 +1,27 @@
+from contest.metrics import Registry
+
+
+def test_render():
+    registry = Registry()
+    requests = registry.counter('requests_total', 'Requests')
+    latency = registry.histogram('latency_seconds', 'Latency', (0.1, 1))
+
+    requests.inc(endpoint='a')
+    requests.inc(2, endpoint='a')
+    latency.observe(0.5)
+    latency.observe(5)
+
+    assert requests.value(endpoint='a') == 3
+    assert latency.count() == 2
+    assert registry.render().splitlines() == [
+        '# HELP requests_total Requests',
+        '# TYPE requests_total counter',
+        'requests_total{endpoint="a"} 3',
+        '# HELP latency_seconds Latency',
+        '# TYPE latency_seconds histogram',
+        'latency_seconds_bucket{le="0.1"} 0',
+        'latency_seconds_bucket{le="1"} 1',
+        'latency_seconds_bucket{le="+Inf"} 2',
+        'latency_seconds_sum 5.5',
+        'latency_seconds_count 2',
+    ]
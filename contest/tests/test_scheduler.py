@@ -0,0 +1,46 @@
+from contest.scheduler import HybridScheduler, InitiativeScheduler, LLMScheduler, scheduler_seconds
+
+
+async def test_initiative_follows_speed(test_wizard_1, test_wizard_2):
+    # Merlin has speed 1 and Gandalf has speed 3
+    scheduler = InitiativeScheduler({3: test_wizard_1, 4: test_wizard_2})
+
+    turns = [await scheduler.next_turn() for _ in range(8)]
+
+    assert turns.count(4) == 6
+    assert turns.count(3) == 2
+    assert turns == [4, 3, 4, 4, 4, 3, 4, 4]
+
+
+async def test_initiative_tie_alternates(test_wizard_1, test_wizard_2):
+    test_wizard_2 = test_wizard_2.model_copy(update={'speed': test_wizard_1.speed})
+    scheduler = InitiativeScheduler({3: test_wizard_1, 4: test_wizard_2})
+
+    assert [await scheduler.next_turn() for _ in range(4)] == [3, 4, 3, 4]
+
+
+async def test_hybrid_asks_llm_on_tie(mocker, test_wizard_1, test_wizard_2):
+    test_wizard_2 = test_wizard_2.model_copy(update={'speed': test_wizard_1.speed})
+    ask_llm = mocker.AsyncMock(return_value=4)
+    scheduler = HybridScheduler({3: test_wizard_1, 4: test_wizard_2}, ask_llm)
+
+    # the tie is resolved by the LLM, the next turn follows from the tempo
+    assert await scheduler.next_turn() == 4
+    assert await scheduler.next_turn() == 3
+    assert ask_llm.call_count == 1
+
+
+async def test_hybrid_without_tie(mocker, test_wizard_1, test_wizard_2):
+    ask_llm = mocker.AsyncMock()
+    scheduler = HybridScheduler({3: test_wizard_1, 4: test_wizard_2}, ask_llm)
+
+    assert await scheduler.next_turn() == 4
+    ask_llm.assert_not_called()
+
+
+async def test_llm_scheduler_metrics(mocker):
+    scheduler = LLMScheduler(mocker.AsyncMock(return_value=3))
+    count = scheduler_seconds.count(strategy='llm')
+
+    assert await scheduler.next_turn() == 3
+    assert scheduler_seconds.count(strategy='llm') == count + 1
@@ -0,0 +1,29 @@
+import pytest
+
+from contest.snapshots import FileStore, MemoryStore, SQLiteStore
+
+
+@pytest.fixture(params=['memory', 'file', 'sqlite'])
+def store(request, tmp_path):
+    match request.param:
+        case 'memory':
+            return MemoryStore()
+        case 'file':
+            return FileStore(tmp_path / 'snapshots')
+        case 'sqlite':
+            return SQLiteStore(tmp_path / 'snapshots.db')
+
+
+async def test_store(store):
+    # director ids are 128-bit
+    director_id = 2**100
+
+    assert await store.load(director_id) is None
+    await store.save(director_id, '{"stage": "turn"}')
+    await store.save(director_id, '{"stage": "spell"}')
+    assert await store.load(director_id) == '{"stage": "spell"}'
+
+    await store.delete(director_id)
+    await store.delete(director_id)
+    assert await store.load(director_id) is None
+    await store.close()
@@ -0,0 +1,22 @@
+import asyncio
+
+from contest.timers import TimerWheel, pending_timers
+
+
+async def test_timer_wheel():
+    wheel = TimerWheel(tick=0.01, slots=4)
+    pending = pending_timers.value()
+    fired = []
+    wheel.schedule(0.01, lambda: fired.append('first'))
+    # the deadline is several rounds of the wheel ahead
+    wheel.schedule(0.1, lambda: fired.append('late'))
+    cancelled = wheel.schedule(0.02, lambda: fired.append('cancelled'))
+    cancelled.cancel()
+    assert pending_timers.value() == pending + 2
+
+    await asyncio.sleep(0.05)
+    assert fired == ['first']
+    await asyncio.sleep(0.1)
+    assert fired == ['first', 'late']
+    assert pending_timers.value() == pending
+    wheel.close()
@@ -0,0 +1,83 @@
+import asyncio
+
+import pytest
+
+from contest.transcript import Transcript
+
+
+def turn(n: int) -> list[dict]:
+    return [
+        {'role': 'user', 'content': f'Merlin uses spell {n}'},
+        {'role': 'assistant', 'content': f'Action {n} ' + 'x' * 40},
+    ]
+
+
+@pytest.fixture
+def summarize(mocker):
+    async def _summarize(summary, actions, max_tokens):
+        await asyncio.sleep(0)
+        return summary + ''.join(action['content'][-1] for action in actions) + '|'
+
+    return mocker.AsyncMock(side_effect=_summarize)
+
+
+def make_transcript(summarize, **kwargs) -> Transcript:
+    params = {'compact': True, 'keep_turns': 1, 'token_budget': 1000, 'summary_tokens': 100}
+    params.update(kwargs)
+    return Transcript(summarize, **params)
+
+
+async def test_without_compaction_sends_everything(summarize):
+    transcript = make_transcript(summarize, compact=False)
+    for n in range(3):
+        transcript.append(turn(n))
+
+    assert transcript.messages() == turn(0) + turn(1) + turn(2)
+    summarize.assert_not_called()
+
+
+async def test_old_turns_are_summarized(summarize):
+    transcript = make_transcript(summarize)
+    transcript.append(turn(0))
+    transcript.append(turn(1))
+
+    # summarization does not block the next request
+    assert transcript.messages() == turn(0) + turn(1)
+
+    await asyncio.sleep(0.01)
+    messages = transcript.messages()
+    assert messages[0]['content'].startswith('Summary of the previous actions:')
+    assert messages[1:] == turn(1)
+    assert transcript.actions == turn(0) + turn(1)
+
+
+async def test_turns_appended_during_summarization(summarize):
+    transcript = make_transcript(summarize)
+    for n in range(4):
+        transcript.append(turn(n))
+
+    await asyncio.sleep(0.01)
+
+    assert transcript.messages()[1:] == turn(3)
+    assert summarize.call_count == 2
+
+
+async def test_token_budget(summarize):
+    transcript = make_transcript(summarize, keep_turns=5, token_budget=15)
+    transcript.append(turn(0))
+    transcript.append(turn(1))
+
+    await asyncio.sleep(0.01)
+
+    assert transcript.messages()[1:] == turn(1)[1:]
+
+
+async def test_failed_summarization_keeps_raw_actions(summarize):
+    summarize.side_effect = RuntimeError
+    transcript = make_transcript(summarize)
+    transcript.append(turn(0))
+    transcript.append(turn(1))
+
+    await asyncio.sleep(0.01)
+
+    assert transcript.messages() == turn(0) + turn(1)
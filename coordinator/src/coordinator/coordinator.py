@@ -2,6 +2,7 @@ from __future__ import annotations
 
 import asyncio
 import logging
+import os
 
 import httpx
 from commonlib.models import LobbyStatus, Pair
@@ -9,8 +10,12 @@ from fastapi import APIRouter, Response, status
 from pydantic import BaseModel
 
 from .objects import Lobby, Player
+from .sharding import Shards, parse_shards
 
 CONTEST_URL = 'http://contest:8000'
+# sharded deployment, `0=http://contest-0:8000,1=http://contest-1:8000`, see `Shards`
+CONTEST_WORKERS = parse_shards(os.environ.get('CONTEST_WORKERS', ''))
+CONTEST_DRAINING = {int(shard) for shard in os.environ.get('CONTEST_DRAINING', '').split(',') if shard.strip()}
 
 router = APIRouter()
 
@@ -65,8 +70,9 @@ async def delete_user_from_queue(user_id: int) -> None:
 
 
 class LobbyManager:
-    def __init__(self) -> None:
+    def __init__(self, shards: Shards | None = None) -> None:
         self.lobbies: dict[int, Lobby] = {}
+        self.shards = shards
 
     def create_lobby(self, players: Pair[Player]) -> None:
         lobby = Lobby({player.user_id: player for player in players})
@@ -93,19 +99,37 @@ class LobbyManager:
     async def _handle_ready_lobby(self, lobby: Lobby) -> None:
         logging.log(logging.INFO, 'LobbyManager::_handle_ready_lobby')
         lobby.created = True
-        lobby.director_id = await self._create_director()
+        lobby.director_id = await self._create_director(lobby)
         for player in lobby.players.values():
             player.match_created_event.set()
             del self.lobbies[player.user_id]
 
-    @staticmethod
-    async def _create_director() -> int:
-        async with httpx.AsyncClient() as client:
-            response = await client.post(CONTEST_URL + '/create_director')
-            return int(response.text)
-
+    async def _create_director(self, lobby: Lobby) -> int:
+        if self.shards is None:
+            async with httpx.AsyncClient() as client:
+                response = await client.post(CONTEST_URL + '/create_director')
+                return int(response.text)
 
-lobby_manager = LobbyManager()
+        # the match goes to the next worker of the ring when its owner is full, draining or unreachable
+        key = ','.join(str(user_id) for user_id in sorted(lobby.players))
+        async with httpx.AsyncClient() as client:
+            for shard, url in self.shards.place(key):
+                try:
+                    response = await client.post(url + '/create_director')
+                except httpx.TransportError as e:
+                    logging.log(logging.WARNING, f'Contest shard {shard} is unreachable: {e!r}')
+                    continue
+                if response.status_code == status.HTTP_503_SERVICE_UNAVAILABLE:
+                    logging.log(logging.WARNING, f'Contest shard {shard} does not accept matches')
+                    continue
+                response.raise_for_status()
+                director_id = int(response.text)
+                assert self.shards.url_of(director_id) == url, f'Shard {shard} created director of another shard'
+                return director_id
+        raise RuntimeError('No contest shard accepts matches')
+
+
+lobby_manager = LobbyManager(Shards(CONTEST_WORKERS, CONTEST_DRAINING) if CONTEST_WORKERS else None)
 
 
 @router.put('/lobby/accept/{user_id}', status_code=status.HTTP_200_OK)
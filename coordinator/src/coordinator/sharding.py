@@ -0,0 +1,80 @@
+import bisect
+import hashlib
+from collections.abc import Iterable, Iterator
+
+# the lowest bits of a director id are the shard of the contest worker which runs the match.
+# The contest and the bot keep copies of the id layout, as the services share nothing but commonlib.
+SHARD_BITS = 16
+
+
+def shard_of(director_id: int) -> int:
+    return director_id & ((1 << SHARD_BITS) - 1)
+
+
+def parse_shards(workers: str) -> dict[int, str]:
+    """
+    :param workers: comma-separated `shard=url` pairs, e.g. `0=http://contest-0:8000,1=http://contest-1:8000`
+    :return: worker urls by shard
+    """
+    shards = {}
+    for worker in workers.split(','):
+        if worker.strip():
+            shard, url = worker.split('=', 1)
+            shards[int(shard)] = url.strip()
+    return shards
+
+
+class HashRing:
+    """
+    Consistent hashing of keys over shards. Every shard owns `replicas` points of the ring,
+    so adding or removing a shard moves only its share of the keys.
+    """
+
+    def __init__(self, shards: Iterable[int], replicas: int = 100):
+        self._ring = sorted(
+            (self._hash(f'{shard}:{replica}'), shard) for shard in shards for replica in range(replicas)
+        )
+        self._points = [point for point, _ in self._ring]
+
+    def get(self, key: str) -> int:
+        return next(self.walk(key))
+
+    def walk(self, key: str) -> Iterator[int]:
+        """
+        :return: distinct shards in the ring order starting from the owner of the key
+        """
+        assert self._ring, 'No shards in the ring'
+        start = bisect.bisect(self._points, self._hash(key))
+        seen = set()
+        for index in range(start, start + len(self._ring)):
+            shard = self._ring[index % len(self._ring)][1]
+            if shard not in seen:
+                seen.add(shard)
+                yield shard
+
+    @staticmethod
+    def _hash(key: str) -> int:
+        return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), 'big')
+
+
+class Shards:
+    """
+    Contest workers of a sharded deployment.
+    Draining workers keep serving their running matches, but new matches are not placed on them,
+    so a worker is removed by draining it first and dropping it from the list when it has no matches left.
+    """
+
+    def __init__(self, urls: dict[int, str], draining: Iterable[int] = ()):
+        self.urls = urls
+        self.draining = set(draining)
+        self._ring = HashRing(shard for shard in urls if shard not in self.draining)
+
+    def place(self, key: str) -> Iterator[tuple[int, str]]:
+        """
+        :return: shards and urls of the workers for a new match, the preferred one first
+        """
+        for shard in self._ring.walk(key):
+            yield shard, self.urls[shard]
+
+    def url_of(self, director_id: int) -> str:
+        return self.urls[shard_of(director_id)]
@@ -0,0 +1,53 @@
+import httpx
+
+from coordinator.coordinator import LobbyManager
+from coordinator.objects import Lobby, Player
+from coordinator.sharding import HashRing, Shards, parse_shards, shard_of
+
+KEYS = [f'{user_id},{user_id + 1}' for user_id in range(2000)]
+
+
+def test_ring_balance():
+    ring = HashRing(range(4))
+    owners = [ring.get(key) for key in KEYS]
+    for shard in range(4):
+        assert abs(owners.count(shard) - len(KEYS) / 4) < len(KEYS) / 8
+
+
+def test_ring_stability():
+    before = HashRing(range(4))
+    after = HashRing(range(5))
+    moved = [key for key in KEYS if before.get(key) != after.get(key)]
+    # only the keys taken over by the new shard move
+    assert all(after.get(key) == 4 for key in moved)
+    assert len(moved) < len(KEYS) / 3
+
+
+def test_draining():
+    shards = Shards(parse_shards('0=http://contest-0:8000, 1=http://contest-1:8000,'), draining=[1])
+    assert all(next(shards.place(key))[0] == 0 for key in KEYS[:100])
+    assert list(shards.place('1,2')) == [(0, 'http://contest-0:8000')]
+    # running matches of the draining shard are still routed to it
+    assert shards.url_of(123 << 16 | 1) == 'http://contest-1:8000'
+    assert shard_of(123 << 16 | 1) == 1
+
+
+async def test_create_director(httpx_mock):
+    shards = Shards({0: 'http://contest-0:8000', 1: 'http://contest-1:8000'})
+    lobby = Lobby({1: Player(user_id=1, rating=1500), 2: Player(user_id=2, rating=1600)})
+    (_, full), (shard, url) = shards.place('1,2')
+    httpx_mock.add_response(url=full + '/create_director', status_code=503)
+    httpx_mock.add_response(url=url + '/create_director', text=str(42 << 16 | shard))
+
+    # the match goes to the next shard of the ring when the owner does not accept it
+    assert await LobbyManager(shards)._create_director(lobby) == 42 << 16 | shard
+
+
+async def test_create_director_unreachable(httpx_mock):
+    shards = Shards({0: 'http://contest-0:8000', 1: 'http://contest-1:8000'})
+    lobby = Lobby({1: Player(user_id=1, rating=1500), 2: Player(user_id=2, rating=1600)})
+    (_, down), (shard, url) = shards.place('1,2')
+    httpx_mock.add_exception(httpx.ConnectError('Connection refused'), url=down + '/create_director')
+    httpx_mock.add_response(url=url + '/create_director', text=str(42 << 16 | shard))
+
+    assert await LobbyManager(shards)._create_director(lobby) == 42 << 16 | shard
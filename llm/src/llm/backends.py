@@ -0,0 +1,234 @@
+import abc
+import asyncio
+import hashlib
+import json
+import random
+import re
+from collections.abc import AsyncIterator
+from dataclasses import dataclass
+
+from commonlib.models import Message
+from groq import APIConnectionError, APIStatusError, APITimeoutError, AsyncGroq
+
+
+class UpstreamError(Exception):
+    """
+    Error status returned by the LLM provider
+    """
+
+    def __init__(self, status_code: int, message: str = ''):
+        super().__init__(f'{status_code} {message}'.strip())
+        self.status_code = status_code
+
+
+@dataclass
+class Usage:
+    prompt_tokens: int
+    completion_tokens: int
+
+    @property
+    def total_tokens(self) -> int:
+        return self.prompt_tokens + self.completion_tokens
+
+
+@dataclass
+class Completion:
+    text: str | None
+    usage: Usage | None = None
+
+
+class Backend(abc.ABC):
+    model: str
+
+    @abc.abstractmethod
+    async def complete(self, messages: list[Message], endpoint: str, **kwargs) -> Completion:
+        pass
+
+    @abc.abstractmethod
+    def stream(self, messages: list[Message], endpoint: str, **kwargs) -> AsyncIterator[Completion]:
+        """
+        Yields text deltas; the usage is reported by the last one
+        """
+
+
+class GroqBackend(Backend):
+    def __init__(self, api_key: str, model: str):
+        self.client = AsyncGroq(api_key=api_key)
+        self.model = model
+
+    async def complete(self, messages: list[Message], endpoint: str, **kwargs) -> Completion:
+        try:
+            response = await self.client.chat.completions.create(
+                messages=messages,
+                model=self.model,
+                **kwargs,
+            )
+        except (APIStatusError, APIConnectionError) as e:
+            raise _upstream_error(e) from e
+        usage = None
+        if response.usage is not None:
+            usage = Usage(response.usage.prompt_tokens, response.usage.completion_tokens)
+        return Completion(response.choices[0].message.content, usage)
+
+    async def stream(self, messages: list[Message], endpoint: str, **kwargs) -> AsyncIterator[Completion]:
+        try:
+            stream = await self.client.chat.completions.create(
+                messages=messages,
+                model=self.model,
+                stream=True,
+                **kwargs,
+            )
+            async for chunk in stream:
+                usage = None
+                # groq reports the usage in the last chunk
+                x_groq = getattr(chunk, 'x_groq', None)
+                if x_groq is not None and x_groq.usage is not None:
+                    usage = Usage(x_groq.usage.prompt_tokens, x_groq.usage.completion_tokens)
+                yield Completion(chunk.choices[0].delta.content, usage)
+        except (APIStatusError, APIConnectionError) as e:
+            raise _upstream_error(e) from e
+
+
+def _upstream_error(error: APIStatusError | APIConnectionError) -> UpstreamError:
+    """
+    The provider was not reached, so there is no status. Timeouts are reported as 504 and other
+    connection failures as 503, which are retried like the overloaded provider.
+    """
+    if isinstance(error, APITimeoutError):
+        return UpstreamError(504, error.message)
+    if isinstance(error, APIConnectionError):
+        return UpstreamError(503, error.message)
+    return UpstreamError(error.status_code, error.message)
+
+
+WIZARD_NAME_RE = re.compile(r"Wizard's name is (.+)")
+CASTER_NAME_RE = re.compile(r"^(.+?) uses .+?\. It's description", re.DOTALL)
+
+# the fake completions are made of its words
+TEXT = (
+    'the arcane storm flares as sparks of raw mana crash against a shimmering ward, '
+    'ancient runes ignite and the ground trembles beneath both wizards while echoes of the spell '
+    'ripple through the arena leaving smoke ash and a lingering scent of ozone'
+)
+WORDS = TEXT.split()
+
+
+class LocalBackend(Backend):
+    """
+    Deterministic offline backend for load tests.
+    Answers depend only on the seed, the model, the endpoint and the messages, and are valid for every engine endpoint.
+    Simulated errors are drawn from a separate sequence, so a retried request may succeed.
+    """
+
+    def __init__(
+        self,
+        seed: int,
+        latency_median: float,
+        latency_sigma: float,
+        tokens_per_second: float,
+        completion_tokens: int,
+        error_rate: float,
+        model: str = 'local',
+    ):
+        self.model = model
+        self._seed = seed
+        self._latency_median = latency_median
+        self._latency_sigma = latency_sigma
+        self._tokens_per_second = tokens_per_second
+        self._completion_tokens = completion_tokens
+        self._error_rate = error_rate
+        self._failures = random.Random(seed)
+
+    async def complete(self, messages: list[Message], endpoint: str, **kwargs) -> Completion:
+        rng = self._random(messages, endpoint)
+        text = self._answer(rng, messages, endpoint)
+        await asyncio.sleep(self._latency(rng) + self._tokens(text) / self._tokens_per_second)
+        self._maybe_fail()
+        return Completion(text, self._usage(messages, text))
+
+    async def stream(self, messages: list[Message], endpoint: str, **kwargs) -> AsyncIterator[Completion]:
+        rng = self._random(messages, endpoint)
+        text = self._answer(rng, messages, endpoint)
+        await asyncio.sleep(self._latency(rng))
+        self._maybe_fail()
+        words = text.split(' ')
+        for index, word in enumerate(words):
+            delta = word if index == 0 else ' ' + word
+            await asyncio.sleep(self._tokens(delta) / self._tokens_per_second)
+            yield Completion(delta)
+        yield Completion(None, self._usage(messages, text))
+
+    def _random(self, messages: list[Message], endpoint: str) -> random.Random:
+        payload = json.dumps([self._seed, self.model, endpoint, messages], sort_keys=True)
+        return random.Random(hashlib.sha256(payload.encode()).digest())
+
+    def _latency(self, rng: random.Random) -> float:
+        return rng.lognormvariate(0, self._latency_sigma) * self._latency_median
+
+    def _maybe_fail(self) -> None:
+        if self._failures.random() < self._error_rate:
+            raise UpstreamError(self._failures.choice([429, 500, 503]), 'Simulated error')
+
+    def _answer(self, rng: random.Random, messages: list[Message], endpoint: str) -> str:
+        match endpoint:
+            case 'calculate_manacost':
+                return str(rng.randint(1, 10))
+            case 'calculate_manacost_batch':
+                return json.dumps({'manacosts': [rng.randint(1, 10) for _ in self._json_list(messages)]})
+            case 'determine_turn':
+                names = self._wizard_names(messages)
+                return rng.choice(names) if names else ''
+            case 'generate_turn':
+                names = self._wizard_names(messages)
+                return json.dumps(
+                    {
+                        'description': self._narrative(rng),
+                        'next_wizard': rng.choice(names) if names else None,
+                    }
+                )
+            case 'pick_winner':
+                names = self._caster_names(messages)
+                if not names or rng.random() < 0.1:
+                    return json.dumps({'winner': None, 'is_tie': True})
+                return json.dumps({'winner': rng.choice(names), 'is_tie': False})
+            case _:
+                return self._narrative(rng)
+
+    def _narrative(self, rng: random.Random) -> str:
+        words = [rng.choice(WORDS) for _ in range(self._completion_tokens)]
+        return ' '.join(words).capitalize() + '.'
+
+    @staticmethod
+    def _json_list(messages: list[Message]) -> list:
+        for message in messages:
+            try:
+                content = json.loads(message['content'])
+            except ValueError:
+                continue
+            if isinstance(content, list):
+                return content
+        return []
+
+    @staticmethod
+    def _wizard_names(messages: list[Message]) -> list[str]:
+        names = []
+        for message in messages:
+            if match := WIZARD_NAME_RE.search(message['content']):
+                names.append(match.group(1).strip())
+        return names
+
+    @staticmethod
+    def _caster_names(messages: list[Message]) -> list[str]:
+        names = []
+        for message in messages:
+            match = CASTER_NAME_RE.match(message['content']) if message['role'] == 'user' else None
+            if match and match.group(1) not in names:
+                names.append(match.group(1))
+        return names
+
+    @staticmethod
+    def _tokens(text: str) -> int:
+        return max(len(text) // 4, 1)
+
+    def _usage(self, messages: list[Message], text: str) -> Usage:
+        return Usage(sum(self._tokens(message['content']) for message in messages), self._tokens(text))
@@ -0,0 +1,134 @@
+import asyncio
+import hashlib
+import json
+import sqlite3
+import time
+from collections import OrderedDict
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from commonlib.models import SpellType
+from pydantic import BaseModel
+
+from .config import settings
+
+
+class CacheStats(BaseModel):
+    memory_hits: int = 0
+    disk_hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    expirations: int = 0
+    size: int = 0
+
+
+class ManacostCache:
+    """
+    Two-tier cache of calculated manacosts.
+    In-process LRU with TTL in front of a SQLite table that survives restarts.
+    """
+
+    def __init__(self, path: Path | None, max_size: int, ttl: float):
+        self._path = path
+        self._max_size = max_size
+        self._ttl = ttl
+        self._memory: OrderedDict[str, tuple[int, float]] = OrderedDict()
+        self._db: sqlite3.Connection | None = None
+        # the table is used by a dedicated thread, so the requests do not wait for the disk
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='manacost-cache')
+        self._stats = CacheStats()
+
+    @staticmethod
+    def key(type_: SpellType, description: str, prompt_version: str, model: str) -> str:
+        normalized = ' '.join(description.split()).casefold()
+        payload = json.dumps([str(type_), normalized, prompt_version, model])
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    async def get(self, key: str) -> int | None:
+        now = time.time()
+        if key in self._memory:
+            manacost, created_at = self._memory[key]
+            if now - created_at < self._ttl:
+                self._memory.move_to_end(key)
+                self._stats.memory_hits += 1
+                return manacost
+            del self._memory[key]
+            self._stats.expirations += 1
+
+        if self._path is not None:
+            row = await self._run(self._load, key, now)
+            if row is not None:
+                manacost, created_at = row
+                if now - created_at < self._ttl:
+                    self._remember(key, manacost, created_at)
+                    self._stats.disk_hits += 1
+                    return manacost
+                self._stats.expirations += 1
+
+        self._stats.misses += 1
+        return None
+
+    async def set(self, key: str, manacost: int) -> None:
+        created_at = time.time()
+        self._remember(key, manacost, created_at)
+        if self._path is not None:
+            await self._run(self._save, key, manacost, created_at)
+
+    def stats(self) -> CacheStats:
+        return self._stats.model_copy(update={'size': len(self._memory)})
+
+    async def close(self) -> None:
+        await self._run(self._close)
+
+    async def _run(self, function: Callable, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, function, *args)
+
+    def _load(self, key: str, now: float) -> tuple[int, float] | None:
+        """
+        :return: manacost and creation time of the key, the expired row is deleted
+        """
+        db = self._connect()
+        row = db.execute('SELECT manacost, created_at FROM manacost WHERE key = ?', (key,)).fetchone()
+        if row is not None and now - row[1] >= self._ttl:
+            with db:
+                db.execute('DELETE FROM manacost WHERE key = ?', (key,))
+        return row
+
+    def _save(self, key: str, manacost: int, created_at: float) -> None:
+        with self._connect() as db:
+            db.execute(
+                'INSERT OR REPLACE INTO manacost (key, manacost, created_at) VALUES (?, ?, ?)',
+                (key, manacost, created_at),
+            )
+
+    def _close(self) -> None:
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+    def _remember(self, key: str, manacost: int, created_at: float) -> None:
+        self._memory[key] = (manacost, created_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self._max_size:
+            self._memory.popitem(last=False)
+            self._stats.evictions += 1
+
+    def _connect(self) -> sqlite3.Connection:
+        assert self._path is not None
+        if self._db is None:
+            self._db = sqlite3.connect(self._path)
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute('PRAGMA synchronous=NORMAL')
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS manacost ('
+                'key TEXT PRIMARY KEY, manacost INTEGER NOT NULL, created_at REAL NOT NULL)'
+            )
+        return self._db
+
+
+manacost_cache = ManacostCache(
+    path=settings.MANACOST_CACHE_PATH,
+    max_size=settings.MANACOST_CACHE_SIZE,
+    ttl=settings.MANACOST_CACHE_TTL,
+)
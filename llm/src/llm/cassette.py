@@ -0,0 +1,194 @@
+import asyncio
+import gzip
+import hashlib
+import json
+import time
+from collections import defaultdict
+from collections.abc import AsyncIterator
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+
+from commonlib.models import Message
+
+from .backends import Backend, Completion, UpstreamError, Usage
+
+
+class CassetteMissError(Exception):
+    pass
+
+
+@dataclass
+class Record:
+    key: str
+    # seconds until the response, or until the first chunk of a stream
+    latency: float
+    text: str | None
+    prompt_tokens: int | None = None
+    completion_tokens: int | None = None
+    # seconds since the first chunk and the text of every chunk of a stream
+    chunks: list[tuple[float, str]] | None = None
+    status_code: int | None = None
+
+    def dump(self) -> list:
+        return [
+            self.key,
+            round(self.latency, 4),
+            self.text,
+            self.prompt_tokens,
+            self.completion_tokens,
+            self.chunks,
+            self.status_code,
+        ]
+
+    @classmethod
+    def load(cls, row: list) -> 'Record':
+        key, latency, text, prompt_tokens, completion_tokens, chunks, status_code = row
+        return cls(key, latency, text, prompt_tokens, completion_tokens, chunks, status_code)
+
+    @property
+    def usage(self) -> Usage | None:
+        if self.prompt_tokens is None or self.completion_tokens is None:
+            return None
+        return Usage(self.prompt_tokens, self.completion_tokens)
+
+
+class Cassette:
+    """
+    Recorded LLM traffic in a gzipped file with one JSON array per response.
+    Responses are keyed by the canonical hash of the request. The model is not part of the key,
+    so a recording can be replayed regardless of the models it was made with.
+    """
+
+    def __init__(self, path: Path):
+        self._path = path
+        # the responses are appended by a dedicated thread in the order they are recorded
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='cassette')
+        self._records: dict[str, list[Record]] | None = None
+        self._positions: dict[str, int] = defaultdict(int)
+
+    @staticmethod
+    def key(messages: list[Message], endpoint: str, **kwargs) -> str:
+        payload = json.dumps([endpoint, messages, kwargs], sort_keys=True, separators=(',', ':'))
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    async def append(self, record: Record) -> None:
+        line = json.dumps(record.dump(), separators=(',', ':')) + '\n'
+        await asyncio.get_running_loop().run_in_executor(self._executor, self._write, line)
+
+    def next(self, key: str) -> Record:
+        """
+        :return: responses of the request in the recorded order, starting over when all are served
+        """
+        records = self._load().get(key)
+        if not records:
+            raise CassetteMissError(f'No recorded response for request {key}')
+        position = self._positions[key]
+        self._positions[key] = position + 1
+        return records[position % len(records)]
+
+    def _write(self, line: str) -> None:
+        self._path.parent.mkdir(parents=True, exist_ok=True)
+        with gzip.open(self._path, 'at', encoding='utf-8') as file:
+            file.write(line)
+
+    def _load(self) -> dict[str, list[Record]]:
+        if self._records is None:
+            self._records = defaultdict(list)
+            if self._path.exists():
+                with gzip.open(self._path, 'rt', encoding='utf-8') as file:
+                    for line in file:
+                        record = Record.load(json.loads(line))
+                        self._records[record.key].append(record)
+        return self._records
+
+
+class RecordingBackend(Backend):
+    """
+    Passes requests to the wrapped backend and records the responses with their latencies
+    """
+
+    def __init__(self, backend: Backend, cassette: Cassette):
+        self._backend = backend
+        self._cassette = cassette
+        self.model = backend.model
+
+    async def complete(self, messages: list[Message], endpoint: str, **kwargs) -> Completion:
+        key = self._cassette.key(messages, endpoint, **kwargs)
+        start = time.monotonic()
+        try:
+            completion = await self._backend.complete(messages, endpoint, **kwargs)
+        except UpstreamError as e:
+            await self._cassette.append(Record(key, time.monotonic() - start, None, status_code=e.status_code))
+            raise
+        usage = completion.usage
+        await self._cassette.append(
+            Record(
+                key,
+                time.monotonic() - start,
+                completion.text,
+                usage and usage.prompt_tokens,
+                usage and usage.completion_tokens,
+            )
+        )
+        return completion
+
+    async def stream(self, messages: list[Message], endpoint: str, **kwargs) -> AsyncIterator[Completion]:
+        key = self._cassette.key(messages, endpoint, stream=True, **kwargs)
+        start = time.monotonic()
+        first = None
+        chunks = []
+        usage = None
+        try:
+            async for chunk in self._backend.stream(messages, endpoint, **kwargs):
+                now = time.monotonic()
+                if first is None:
+                    first = now
+                if chunk.usage is not None:
+                    usage = chunk.usage
+                if chunk.text:
+                    chunks.append((round(now - first, 4), chunk.text))
+                yield chunk
+        except UpstreamError as e:
+            await self._cassette.append(Record(key, time.monotonic() - start, None, status_code=e.status_code))
+            raise
+        await self._cassette.append(
+            Record(
+                key,
+                (first or time.monotonic()) - start,
+                ''.join(text for _, text in chunks),
+                usage and usage.prompt_tokens,
+                usage and usage.completion_tokens,
+                chunks,
+            )
+        )
+
+
+class ReplayBackend(Backend):
+    """
+    Serves recorded responses with the recorded latencies multiplied by `latency_scale`
+    """
+
+    def __init__(self, cassette: Cassette, latency_scale: float, model: str = 'replay'):
+        self._cassette = cassette
+        self._latency_scale = latency_scale
+        self.model = model
+
+    async def complete(self, messages: list[Message], endpoint: str, **kwargs) -> Completion:
+        record = self._cassette.next(self._cassette.key(messages, endpoint, **kwargs))
+        await asyncio.sleep(record.latency * self._latency_scale)
+        if record.status_code is not None:
+            raise UpstreamError(record.status_code, 'Recorded error')
+        return Completion(record.text, record.usage)
+
+    async def stream(self, messages: list[Message], endpoint: str, **kwargs) -> AsyncIterator[Completion]:
+        record = self._cassette.next(self._cassette.key(messages, endpoint, stream=True, **kwargs))
+        await asyncio.sleep(record.latency * self._latency_scale)
+        if record.status_code is not None:
+            raise UpstreamError(record.status_code, 'Recorded error')
+        elapsed = 0
+        for offset, text in record.chunks or [(0, record.text)]:
+            await asyncio.sleep((offset - elapsed) * self._latency_scale)
+            elapsed = offset
+            yield Completion(text)
+        yield Completion(None, record.usage)
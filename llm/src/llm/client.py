@@ -1,24 +1,310 @@
+import asyncio
+import json
+import random
+import time
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
+
 from commonlib.models import Message
-from groq import AsyncGroq
 
-from .config import settings
+from .backends import Backend, GroqBackend, LocalBackend, UpstreamError, Usage
+from .cassette import Cassette, CassetteMissError, RecordingBackend, ReplayBackend
+from .config import Route, settings
+from .limiter import LimiterError, Reservation, limiter
+from .metrics import SECONDS_BUCKETS, registry
+from .singleflight import singleflight
+
+requests = registry.counter('llm_requests_total', 'Completions requested by the engine, by endpoint')
+queue_wait_seconds = registry.histogram(
+    'llm_queue_wait_seconds',
+    'Time spent waiting for the rate limiter, by endpoint',
+    SECONDS_BUCKETS,
+)
+upstream_seconds = registry.histogram(
+    'llm_upstream_seconds',
+    'Time spent waiting for the LLM provider, by endpoint',
+    SECONDS_BUCKETS,
+)
+prompt_tokens = registry.counter('llm_prompt_tokens_total', 'Prompt tokens reported by the provider, by endpoint')
+completion_tokens = registry.counter(
+    'llm_completion_tokens_total',
+    'Completion tokens reported by the provider, by endpoint',
+)
+errors = registry.counter('llm_errors_total', 'Failed completions, by endpoint and type')
+queued = registry.gauge('llm_queued', 'Completions waiting for the rate limiter, by endpoint')
+in_flight = registry.gauge('llm_in_flight', 'Completions sent to the provider and not finished yet, by endpoint')
+retries = registry.counter('llm_retries_total', 'Completions retried after an upstream error, by endpoint and status')
+hedges = registry.counter('llm_hedges_total', 'Hedged completions sent, by endpoint')
+hedge_wins = registry.counter('llm_hedge_wins_total', 'Hedged completions which finished first, by endpoint')
+fallbacks = registry.counter('llm_fallbacks_total', 'Completions sent to a fallback model, by endpoint and model')
+shadows = registry.counter(
+    'llm_shadow_total',
+    'Completions repeated with the candidate model, by endpoint, model and result (agree, disagree or error)',
+)
+
+cassette = Cassette(settings.LLM_CASSETTE_PATH)
+
+
+def create_backend(model: str | None = None) -> Backend:
+    match settings.LLM_BACKEND:
+        case 'groq':
+            backend_ = GroqBackend(api_key=settings.GROQ_API_KEY, model=model or settings.LLM_MODEL)
+        case 'local':
+            backend_ = LocalBackend(
+                seed=settings.LOCAL_SEED,
+                latency_median=settings.LOCAL_LATENCY_MEDIAN,
+                latency_sigma=settings.LOCAL_LATENCY_SIGMA,
+                tokens_per_second=settings.LOCAL_TOKENS_PER_SECOND,
+                completion_tokens=settings.LOCAL_COMPLETION_TOKENS,
+                error_rate=settings.LOCAL_ERROR_RATE,
+                model=model or 'local',
+            )
+        case 'replay':
+            return ReplayBackend(cassette, settings.LLM_REPLAY_LATENCY_SCALE, model=model or 'replay')
+    if settings.LLM_RECORD:
+        return RecordingBackend(backend_, cassette)
+    return backend_
+
+
+backend = create_backend()
+fallback_backends = [create_backend(model) for model in settings.LLM_FALLBACK_MODELS]
+routed_backends: dict[str, Backend] = {}
+shadow_tasks: set[asyncio.Task] = set()
+
+
+def get_backend(model: str | None) -> Backend:
+    """
+    :return: backend of the model, the primary one if the model is not set
+    """
+    if model is None or model in (settings.LLM_MODEL, backend.model):
+        return backend
+    if model not in routed_backends:
+        routed_backends[model] = create_backend(model)
+    return routed_backends[model]
+
+
+def get_route(endpoint: str) -> Route:
+    return settings.LLM_ROUTES.get(endpoint) or Route()
+
+
+async def generate_response(messages: list[Message], endpoint: str = '', **kwargs) -> str:
+    """
+    Identical concurrent requests of the same endpoint share one completion.
+    Parameters of the endpoint route are used unless they are given explicitly.
+    """
+    requests.inc(endpoint=endpoint)
+    route = get_route(endpoint)
+    kwargs = {**route.params, **_max_tokens(route), **kwargs}
+    key = singleflight.key(endpoint, messages, kwargs)
+    return await singleflight.do(key, lambda: _generate_response(messages, endpoint, **kwargs))
+
+
+async def _generate_response(messages: list[Message], endpoint: str, **kwargs) -> str:
+    """
+    Retries upstream errors and falls back to other models until the deadline of the endpoint
+    """
+    timeout = settings.LLM_ENDPOINT_TIMEOUTS.get(endpoint, settings.LLM_TIMEOUT)
+    try:
+        async with asyncio.timeout(timeout):
+            text = await _complete_with_retries(messages, endpoint, **kwargs)
+    except TimeoutError:
+        errors.inc(endpoint=endpoint, type='timeout')
+        raise DeadlineExceededError(f'No completion in {timeout} seconds') from None
+    route = get_route(endpoint)
+    if route.shadow_model is not None and random.random() < route.shadow_rate:
+        task = asyncio.create_task(_shadow(route.shadow_model, text, messages, endpoint, **kwargs))
+        shadow_tasks.add(task)
+        task.add_done_callback(shadow_tasks.discard)
+    return text
+
+
+async def _complete_with_retries(messages: list[Message], endpoint: str, **kwargs) -> str:
+    attempt = 0
+    while True:
+        try:
+            return await _complete_with_fallback(messages, endpoint, **kwargs)
+        except UpstreamError as e:
+            if not _is_retryable(e) or attempt >= settings.LLM_RETRIES:
+                raise
+            retries.inc(endpoint=endpoint, status=e.status_code)
+            backoff = min(settings.LLM_RETRY_BACKOFF * 2**attempt, settings.LLM_RETRY_BACKOFF_MAX)
+            # jitter keeps the retries of concurrent requests apart
+            await asyncio.sleep(backoff * random.uniform(0.5, 1))
+            attempt += 1
+
+
+async def _complete_with_fallback(messages: list[Message], endpoint: str, **kwargs) -> str:
+    primary = get_backend(get_route(endpoint).model)
+    backends = [primary, *(backend_ for backend_ in fallback_backends if backend_ is not primary)]
+    for index, backend_ in enumerate(backends):
+        try:
+            return await _complete_hedged(backend_, messages, endpoint, **kwargs)
+        except UpstreamError as e:
+            if not _is_overloaded(e) or index == len(backends) - 1:
+                raise
+            fallbacks.inc(endpoint=endpoint, model=backends[index + 1].model)
+    assert False, 'Not reachable'
+
+
+async def _complete_hedged(backend_: Backend, messages: list[Message], endpoint: str, **kwargs) -> str:
+    """
+    Sends a second request when the first one is slower than usual. The first successful one wins.
+    """
+    delay = _hedge_delay(endpoint)
+    if delay is None:
+        return await _complete(backend_, messages, endpoint, **kwargs)
+
+    first = asyncio.create_task(_complete(backend_, messages, endpoint, **kwargs))
+    pending = {first}
+    try:
+        done, pending = await asyncio.wait(pending, timeout=delay)
+        if done:
+            return first.result()
+        hedges.inc(endpoint=endpoint)
+        pending.add(asyncio.create_task(_complete(backend_, messages, endpoint, **kwargs)))
+        error = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    if task is not first:
+                        hedge_wins.inc(endpoint=endpoint)
+                    return task.result()
+                error = task.exception()
+        raise error
+    finally:
+        for task in pending:
+            task.cancel()
 
-client = AsyncGroq(api_key=settings.GROQ_API_KEY)
 
-model = 'llama-3.3-70b-versatile'
+def _hedge_delay(endpoint: str) -> float | None:
+    """
+    :return: seconds to wait before hedging or None if the request should not be hedged
+    """
+    if not settings.LLM_HEDGING or upstream_seconds.count(endpoint=endpoint) < settings.LLM_HEDGE_MIN_SAMPLES:
+        return None
+    return max(upstream_seconds.quantile(settings.LLM_HEDGE_QUANTILE, endpoint=endpoint), settings.LLM_HEDGE_MIN_DELAY)
 
 
-async def generate_response(messages: list[Message], **kwargs) -> str:
-    response = await client.chat.completions.create(
-        messages=messages,
-        model=model,
-        **kwargs,
-    )
-    response_text = response.choices[0].message.content
-    if response_text is None:
+def _is_retryable(error: UpstreamError) -> bool:
+    return error.status_code == 429 or error.status_code >= 500
+
+
+def _is_overloaded(error: UpstreamError) -> bool:
+    return error.status_code in (429, 503)
+
+
+async def _shadow(model: str, expected: str, messages: list[Message], endpoint: str, **kwargs) -> None:
+    """
+    Repeats the completion with the candidate model and records whether the answers agree
+    """
+    try:
+        text = await _complete(get_backend(model), messages, endpoint, shadow=True, **kwargs)
+    except (UpstreamError, LLMError, LimiterError, CassetteMissError):
+        shadows.inc(endpoint=endpoint, model=model, result='error')
+        return
+    result = 'agree' if _normalize(text) == _normalize(expected) else 'disagree'
+    shadows.inc(endpoint=endpoint, model=model, result=result)
+
+
+def _normalize(text: str):
+    try:
+        return json.loads(text)
+    except ValueError:
+        return ' '.join(text.split()).casefold()
+
+
+def _max_tokens(route: Route) -> dict:
+    return {} if route.max_tokens is None else {'max_tokens': route.max_tokens}
+
+
+async def _complete(backend_: Backend, messages: list[Message], endpoint: str, shadow: bool = False, **kwargs) -> str:
+    """
+    :param shadow: the completion is a shadow evaluation, it is accounted separately with the background priority
+    """
+    label = f'{endpoint}_shadow' if shadow else endpoint
+    async with _upstream(messages, endpoint, shadow, **kwargs) as reservation:
+        completion = await backend_.complete(messages, endpoint, **kwargs)
+        if completion.usage is not None:
+            _record_usage(reservation, completion.usage, label)
+    if completion.text is None:
+        errors.inc(endpoint=label, type='llm_error')
+        raise LLMError
+    return completion.text
+
+
+async def stream_response(messages: list[Message], endpoint: str = '', **kwargs) -> AsyncIterator[str]:
+    requests.inc(endpoint=endpoint)
+    route = get_route(endpoint)
+    kwargs = {**route.params, **_max_tokens(route), **kwargs}
+    async with _upstream(messages, endpoint, **kwargs) as reservation:
+        empty = True
+        async for chunk in get_backend(route.model).stream(messages, endpoint, **kwargs):
+            if chunk.usage is not None:
+                _record_usage(reservation, chunk.usage, endpoint)
+            if chunk.text:
+                empty = False
+                yield chunk.text
+    if empty:
+        errors.inc(endpoint=endpoint, type='llm_error')
         raise LLMError
-    return response_text
+
+
+@asynccontextmanager
+async def _upstream(
+    messages: list[Message],
+    endpoint: str,
+    shadow: bool = False,
+    **kwargs,
+) -> AsyncIterator[Reservation]:
+    """
+    Admits the completion through the rate limiter and accounts the time spent in the queue and upstream
+    """
+    if shadow:
+        priority = 'background'
+        endpoint = f'{endpoint}_shadow'
+    else:
+        priority = settings.LLM_PRIORITIES.get(endpoint, 'interactive')
+    start = time.monotonic()
+    queued.inc(endpoint=endpoint)
+    # the request may leave the queue by a cancellation as well
+    waiting = True
+    try:
+        async with limiter.acquire(_estimate_tokens(messages, **kwargs), priority) as reservation:
+            queued.dec(endpoint=endpoint)
+            waiting = False
+            admitted = time.monotonic()
+            queue_wait_seconds.observe(admitted - start, endpoint=endpoint)
+            in_flight.inc(endpoint=endpoint)
+            try:
+                yield reservation
+            except UpstreamError as e:
+                errors.inc(endpoint=endpoint, type='rate_limited' if e.status_code == 429 else 'upstream')
+                raise
+            finally:
+                in_flight.dec(endpoint=endpoint)
+                upstream_seconds.observe(time.monotonic() - admitted, endpoint=endpoint)
+    except LimiterError:
+        errors.inc(endpoint=endpoint, type='limiter')
+        raise
+    finally:
+        if waiting:
+            queued.dec(endpoint=endpoint)
+
+
+def _record_usage(reservation: Reservation, usage: Usage, endpoint: str) -> None:
+    reservation.used_tokens = usage.total_tokens
+    prompt_tokens.inc(usage.prompt_tokens, endpoint=endpoint)
+    completion_tokens.inc(usage.completion_tokens, endpoint=endpoint)
+
+
+def _estimate_tokens(messages: list[Message], max_tokens: int | None = None, **_) -> int:
+    return limiter.estimate_tokens(messages, max_tokens or settings.LLM_COMPLETION_TOKENS_ESTIMATE)
 
 
 class LLMError(Exception):
     pass
+
+
+class DeadlineExceededError(LLMError):
+    pass
@@ -1,6 +1,8 @@
 # mypy: ignore-errors
+import typing as tp
 from pathlib import Path
 
+from pydantic import BaseModel
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 file = Path(__file__)
@@ -9,8 +11,91 @@ env_file = file.parent.parent.parent / '.env'
 print(env_file)
 
 
+class Route(BaseModel):
+    """
+    How the completions of an engine endpoint are generated
+    """
+
+    # LLM_MODEL if not set
+    model: str | None = None
+    params: dict[str, tp.Any] = {}
+    max_tokens: int | None = None
+    # share of the completions repeated with the candidate model to measure the agreement
+    shadow_model: str | None = None
+    shadow_rate: float = 0.0
+
+
 class Settings(BaseSettings):
-    GROQ_API_KEY: str
+    LLM_BACKEND: tp.Literal['groq', 'local', 'replay'] = 'groq'
+    GROQ_API_KEY: str = ''
+    LLM_MODEL: str = 'llama-3.3-70b-versatile'
+    # tried in order when the previous model is overloaded (429 or 503)
+    LLM_FALLBACK_MODELS: list[str] = []
+    LLM_ROUTES: dict[str, Route] = {
+        'determine_turn': Route(params={'temperature': 0}, max_tokens=16),
+        'calculate_manacost': Route(params={'temperature': 0}, max_tokens=4),
+    }
+
+    # `local` backend, deterministic for the given seed
+    LOCAL_SEED: int = 0
+    LOCAL_LATENCY_MEDIAN: float = 0.5
+    LOCAL_LATENCY_SIGMA: float = 0.5
+    LOCAL_TOKENS_PER_SECOND: float = 250
+    LOCAL_COMPLETION_TOKENS: int = 60
+    LOCAL_ERROR_RATE: float = 0.0
+
+    # `replay` backend serves the responses recorded with LLM_RECORD
+    LLM_CASSETTE_PATH: Path = file.parent.parent.parent / 'cassette.jsonl.gz'
+    LLM_RECORD: bool = False
+    LLM_REPLAY_LATENCY_SCALE: float = 1.0
+
+    PROMPTS_HOT_RELOAD: bool = False
+    PROMPTS_RELOAD_INTERVAL: float = 1.0
+
+    MANACOST_CACHE_PATH: Path | None = file.parent.parent.parent / 'manacost_cache.sqlite3'
+    MANACOST_CACHE_SIZE: int = 4096
+    MANACOST_CACHE_TTL: float = 7 * 24 * 60 * 60
+    MANACOST_BATCH_MAX_SIZE: int = 32
+
+    # matches kept on the llm side, see `llm.sessions`
+    SESSIONS_MAX_SIZE: int = 1024
+    SESSIONS_TTL: float = 60 * 60
+
+    LLM_MAX_IN_FLIGHT: int = 16
+    # quota of the provider tier, the limits are off unless set
+    LLM_REQUESTS_PER_MINUTE: int | None = None
+    LLM_TOKENS_PER_MINUTE: int | None = None
+    LLM_MAX_QUEUE: int = 256
+    LLM_QUEUE_TIMEOUT: float | None = None
+    # reserved for the completion until the actual usage is known
+    LLM_COMPLETION_TOKENS_ESTIMATE: int = 256
+    # priority class of every endpoint, the unlisted ones are interactive
+    LLM_PRIORITIES: dict[str, str] = {
+        'pick_winner': 'match_final',
+        'summarize_actions': 'background',
+        'calculate_manacost': 'background',
+        'calculate_manacost_batch': 'background',
+    }
+    LLM_PRIORITY_WEIGHTS: dict[str, int] = {'interactive': 8, 'match_final': 4, 'background': 1}
+    # requests waiting longer are admitted first regardless of their priority
+    LLM_STARVATION_TIMEOUT: float = 10
+
+    # deadline of a completion including queueing, retries and fallbacks
+    LLM_TIMEOUT: float = 60
+    LLM_ENDPOINT_TIMEOUTS: dict[str, float] = {
+        'determine_turn': 15,
+        'generate_turn': 30,
+        'calculate_manacost': 15,
+    }
+    # retries of 429 and 5xx with exponential backoff
+    LLM_RETRIES: int = 2
+    LLM_RETRY_BACKOFF: float = 0.5
+    LLM_RETRY_BACKOFF_MAX: float = 8
+    # a second request is sent when the first one is slower than the latency quantile of the endpoint
+    LLM_HEDGING: bool = False
+    LLM_HEDGE_QUANTILE: float = 0.95
+    LLM_HEDGE_MIN_DELAY: float = 0.5
+    LLM_HEDGE_MIN_SAMPLES: int = 20
 
     model_config = SettingsConfigDict(env_file=env_file)
 
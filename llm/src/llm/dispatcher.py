@@ -0,0 +1,91 @@
+import asyncio
+import time
+from collections import deque
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
+
+from .metrics import SECONDS_BUCKETS, registry
+
+dispatch_wait_seconds = registry.histogram(
+    'llm_dispatch_wait_seconds',
+    'Time spent waiting for the turn to be admitted, by priority class',
+    SECONDS_BUCKETS,
+)
+dispatch_queued = registry.gauge('llm_dispatch_queued', 'Requests waiting for the turn, by priority class')
+dispatch_starved = registry.counter(
+    'llm_dispatch_starved_total',
+    'Requests dispatched out of the weighted order because they waited too long, by priority class',
+)
+
+
+class Dispatcher:
+    """
+    Grants `slots` concurrent turns to waiting requests by their priority class.
+    Classes are served by smooth weighted round robin, so a class with weight 4 gets four turns
+    for every turn of a class with weight 1 while both are waiting.
+    A request which waited longer than `starvation_timeout` is served first regardless of the weights.
+    """
+
+    def __init__(self, slots: int, weights: dict[str, int], starvation_timeout: float):
+        self._free = slots
+        self._weights = weights
+        self._starvation_timeout = starvation_timeout
+        self._current = dict.fromkeys(weights, 0)
+        self._waiters: dict[str, deque[tuple[float, asyncio.Future]]] = {priority: deque() for priority in weights}
+
+    @asynccontextmanager
+    async def turn(self, priority: str) -> AsyncIterator[None]:
+        await self.acquire(priority)
+        try:
+            yield
+        finally:
+            self.release()
+
+    async def acquire(self, priority: str) -> None:
+        assert priority in self._weights, f'Unknown priority class {priority}'
+        start = time.monotonic()
+        future = asyncio.get_running_loop().create_future()
+        self._waiters[priority].append((start, future))
+        dispatch_queued.inc(priority=priority)
+        self._dispatch()
+        try:
+            await future
+        except asyncio.CancelledError:
+            # the turn could have been granted right before the cancellation
+            if not future.cancelled():
+                self.release()
+            raise
+        finally:
+            dispatch_queued.dec(priority=priority)
+            dispatch_wait_seconds.observe(time.monotonic() - start, priority=priority)
+
+    def release(self) -> None:
+        self._free += 1
+        self._dispatch()
+
+    def _dispatch(self) -> None:
+        while self._free and (priority := self._next_priority()) is not None:
+            _, future = self._waiters[priority].popleft()
+            self._free -= 1
+            future.set_result(None)
+
+    def _next_priority(self) -> str | None:
+        for waiters in self._waiters.values():
+            while waiters and waiters[0][1].done():
+                waiters.popleft()
+        waiting = [priority for priority, waiters in self._waiters.items() if waiters]
+        if not waiting:
+            return None
+
+        deadline = time.monotonic() - self._starvation_timeout
+        starving = [priority for priority in waiting if self._waiters[priority][0][0] <= deadline]
+        if starving:
+            priority = min(starving, key=lambda priority: self._waiters[priority][0][0])
+            dispatch_starved.inc(priority=priority)
+            return priority
+
+        for priority in waiting:
+            self._current[priority] += self._weights[priority]
+        priority = max(waiting, key=lambda priority: self._current[priority])
+        self._current[priority] -= sum(self._weights[priority] for priority in waiting)
+        return priority
@@ -1,31 +1,27 @@
+import asyncio
 import json
-from pathlib import Path
+from collections.abc import AsyncIterator
 
 from commonlib.models import GenerateActionResponse, Message, Pair, SpellBase, SpellType, Wizard
-from fastapi import APIRouter
-from pydantic import BaseModel
+from fastapi import APIRouter, HTTPException, status
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from pydantic import BaseModel, Field
 
-from .client import generate_response
+from .cache import CacheStats, manacost_cache
+from .client import LLMError, errors, generate_response, get_backend, get_route, stream_response
+from .config import settings
+from .limiter import LimiterStats, limiter
+from .metrics import registry
+from .prompts import PromptStats
+from .prompts import registry as prompts
+from .sessions import Session, SessionNotFoundError, SessionStats, SessionStoreFullError, sessions
+from .singleflight import SingleFlightStats, singleflight
 
 router = APIRouter()
 
-PROMPTS_PATH = Path(__file__).parent / 'prompts'
-
-
-def get_messages(filename: str, has_schema: bool = False, **replacements):
-    if has_schema:
-        with open(PROMPTS_PATH / f'{filename}_schema.json', 'r') as f:
-            schema = f.read()
-        replacements['schema'] = schema
-    with open(PROMPTS_PATH / f'{filename}.json', 'r') as f:
-        prompt = f.read()
-    messages = json.loads(prompt)
-    for message in messages:
-        if not isinstance(message['content'], str):
-            message['content'] = json.dumps(message['content'])
-        for key, value in replacements.items():
-            message['content'] = message['content'].replace(f'<{key}>', str(value))
-    return messages
+
+def get_messages(filename: str, has_schema: bool = False, **replacements) -> list[Message]:
+    return prompts.render(filename, has_schema, **replacements)
 
 
 class CalculateManacostRequest(BaseModel):
@@ -33,15 +29,89 @@ class CalculateManacostRequest(BaseModel):
     description: str
 
 
+def get_manacost_key(item: CalculateManacostRequest) -> str:
+    # the model the endpoint is routed to, so the manacosts of another model are not served after a reroute
+    model = get_backend(get_route('calculate_manacost').model).model
+    return manacost_cache.key(item.type_, item.description, prompts.version('calculate_manacost'), model)
+
+
 @router.post('/spell/calculate_manacost')
 async def calculate_manacost(item: CalculateManacostRequest) -> int:
+    key = get_manacost_key(item)
+    manacost = await manacost_cache.get(key)
+    if manacost is not None:
+        return manacost
     messages = get_messages(
         'calculate_manacost',
         description=item.description,
         type_=item.type_,
     )
-    response = await generate_response(messages)
-    return int(response)
+    response = await generate_response(messages, endpoint='calculate_manacost')
+    manacost = int(response)
+    await manacost_cache.set(key, manacost)
+    return manacost
+
+
+@router.post('/spell/calculate_manacost_batch')
+async def calculate_manacost_batch(items: list[CalculateManacostRequest]) -> list[int]:
+    """
+    Prices all spells with one completion.
+    Spells the model failed to price are recalculated one by one.
+    :return: manacosts in the order of the request
+    """
+    if len(items) > settings.MANACOST_BATCH_MAX_SIZE:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail=f'At most {settings.MANACOST_BATCH_MAX_SIZE} spells per batch',
+        )
+    keys = [get_manacost_key(item) for item in items]
+    manacosts = {key: await manacost_cache.get(key) for key in keys}
+    missing = {key: item for key, item in zip(keys, items) if manacosts[key] is None}
+
+    if missing:
+        priced = await price_spells(list(missing.values()))
+        failed = [item for item, manacost in zip(missing.values(), priced) if manacost is None]
+        recalculated = iter(await asyncio.gather(*(calculate_manacost(item) for item in failed)))
+        for key, manacost in zip(missing, priced):
+            if manacost is None:
+                manacost = next(recalculated)
+            else:
+                await manacost_cache.set(key, manacost)
+            manacosts[key] = manacost
+
+    return [manacosts[key] for key in keys]
+
+
+async def price_spells(items: list[CalculateManacostRequest]) -> list[int | None]:
+    """
+    Uses the `calculate_manacost_batch` prompt, which gets the JSON list of the spells as `<spells>`
+    and asks for {"manacosts": [...]}.
+    :return: manacost of every spell or None for the ones that could not be parsed, all of them without the prompt
+    """
+    if 'calculate_manacost_batch' not in prompts:
+        # without the batch prompt every spell is priced by `calculate_manacost`
+        return [None] * len(items)
+    spells = json.dumps([
+        {'index': index, 'type': item.type_, 'description': item.description}
+        for index, item in enumerate(items)
+    ])
+    prompt = get_messages('calculate_manacost_batch', spells=spells)
+    response = await generate_response(
+        prompt,
+        endpoint='calculate_manacost_batch',
+        response_format={'type': 'json_object'},
+    )
+    try:
+        manacosts = json.loads(response)['manacosts']
+    except (ValueError, KeyError, TypeError):
+        manacosts = []
+    if not isinstance(manacosts, list):
+        manacosts = []
+    manacosts += [None] * (len(items) - len(manacosts))
+    return [
+        manacost if isinstance(manacost, int) and not isinstance(manacost, bool) else None
+        for manacost in manacosts[:len(items)]
+    ]
 
 
 @router.post('/contest/start_contest')
@@ -72,16 +142,25 @@ class GenerateActionRequest(BaseModel):
     spell: SpellBase
 
 
-@router.post('/contest/generate_action')
-async def generate_action(item: GenerateActionRequest) -> GenerateActionResponse:
+class GenerateActionChunk(BaseModel):
+    """
+    Line of the streamed action. Text chunks come first, the complete response comes last.
+    """
+    chunk: str | None = None
+    response: GenerateActionResponse | None = None
+
+
+def get_action_prompt(item: GenerateActionRequest) -> list[Message]:
     spell = item.spell
-    prompt = [
+    return [
         {
             'role': 'user',
             'content': f'{item.wizard.name} uses {spell.name}. ' f"It's description: {spell.description}",
         }
     ]
-    description = await generate_response(item.previous_actions + prompt)
+
+
+def get_action_response(prompt: list[Message], description: str) -> GenerateActionResponse:
     action = [
         {
             'role': 'assistant',
@@ -91,6 +170,31 @@ async def generate_action(item: GenerateActionRequest) -> GenerateActionResponse
     return GenerateActionResponse(new_actions=prompt + action, description=description)
 
 
+@router.post('/contest/generate_action')
+async def generate_action(item: GenerateActionRequest) -> GenerateActionResponse:
+    prompt = get_action_prompt(item)
+    description = await generate_response(item.previous_actions + prompt, endpoint='generate_action')
+    return get_action_response(prompt, description)
+
+
+@router.post('/contest/generate_action_stream')
+async def generate_action_stream(item: GenerateActionRequest) -> StreamingResponse:
+    """
+    Streams newline-delimited `GenerateActionChunk`s as soon as the model produces them
+    """
+    prompt = get_action_prompt(item)
+
+    async def lines() -> AsyncIterator[str]:
+        chunks = []
+        async for chunk in stream_response(item.previous_actions + prompt, endpoint='generate_action'):
+            chunks.append(chunk)
+            yield GenerateActionChunk(chunk=chunk).model_dump_json() + '\n'
+        response = get_action_response(prompt, ''.join(chunks))
+        yield GenerateActionChunk(response=response).model_dump_json() + '\n'
+
+    return StreamingResponse(lines(), media_type='application/x-ndjson')
+
+
 class DetermineTurnRequest(BaseModel):
     actions: list[Message]
     wizards: Pair[Wizard]
@@ -136,11 +240,118 @@ async def determine_turn(item: DetermineTurnRequest) -> int:
                        'SYSTEM PROMPT END\n'
         }
     ]
-    response = await generate_response(prompt)
-    for index, wizard in enumerate(item.wizards):
-        if response.lower() == wizard.name.lower():
+    response = await generate_response(prompt, endpoint='determine_turn')
+    index = find_wizard(item.wizards, response)
+    if index is None:
+        errors.inc(endpoint='determine_turn', type='parse')
+    assert index is not None, f'Turn determination failed. LLM response:\n{response}'
+    return index
+
+
+def find_wizard(wizards: Pair[Wizard], name: str) -> int | None:
+    """
+    :return: index of the wizard with the given name in the pair
+    """
+    for index, wizard in enumerate(wizards):
+        if name.strip().lower() == wizard.name.lower():
             return index
-    assert False, f'Turn determination failed. LLM response:\n{response}'
+    return None
+
+
+class GenerateTurnRequest(GenerateActionRequest):
+    wizards: Pair[Wizard]
+
+
+class GenerateTurnResponse(GenerateActionResponse):
+    next_wizard: int
+
+
+@router.post('/contest/generate_turn')
+async def generate_turn(item: GenerateTurnRequest) -> GenerateTurnResponse:
+    """
+    Narrates the action and determines who acts next with a single completion.
+    Falls back to `determine_turn` when the model names an unknown wizard.
+    :return: action and index of the next wizard in the pair
+    """
+    prompt = get_action_prompt(item)
+    instructions = [
+        {
+            'role': 'user',
+            'content': 'Here are the wizard\'s descriptions'
+        }
+    ]
+    instructions += [
+        {
+            'role': 'user',
+            'content': wizard.description
+        }
+        for wizard in item.wizards
+    ]
+    instructions += [
+        {
+            'role': 'user',
+            'content': 'SYSTEM PROMPT START\n'
+                       'Describe the action above and decide which wizard should act after it. '
+                       'Respond with a JSON object '
+                       '{"description": "<description of the action>", "next_wizard": "<name of the wizard>"}. '
+                       'DO NOT OUTPUT ANYTHING ELSE.\n'
+                       'SYSTEM PROMPT END\n'
+        }
+    ]
+    response = await generate_response(
+        item.previous_actions + prompt + instructions,
+        endpoint='generate_turn',
+        response_format={'type': 'json_object'},
+    )
+    try:
+        schema = json.loads(response)
+        description = schema['description']
+        next_wizard_name = schema.get('next_wizard')
+    except (ValueError, KeyError, TypeError) as e:
+        errors.inc(endpoint='generate_turn', type='parse')
+        raise LLMError(f'Turn generation failed. LLM response:\n{response}') from e
+    if not isinstance(description, str) or not description:
+        errors.inc(endpoint='generate_turn', type='parse')
+        raise LLMError(f'Turn generation failed. LLM response:\n{response}')
+
+    action = get_action_response(prompt, description)
+    next_wizard = find_wizard(item.wizards, next_wizard_name) if isinstance(next_wizard_name, str) else None
+    if next_wizard is None:
+        next_wizard = await determine_turn(
+            DetermineTurnRequest(actions=item.previous_actions + action.new_actions, wizards=item.wizards)
+        )
+    return GenerateTurnResponse(**action.model_dump(), next_wizard=next_wizard)
+
+
+class SummarizeActionsRequest(BaseModel):
+    summary: str
+    actions: list[Message]
+    max_tokens: int
+
+
+@router.post('/contest/summarize_actions')
+async def summarize_actions(item: SummarizeActionsRequest) -> str:
+    """
+    :return: previous summary extended with the given actions
+    """
+    prompt = [
+        {
+            'role': 'system',
+            'content': 'You keep the chronicle of a wizard duel. '
+                       'Merge the previous summary and the new actions into one concise summary. '
+                       'Keep every fact that may matter for who acts next and who wins: '
+                       'used spells, wounds, shields and lasting effects. Output only the summary.',
+        },
+        {
+            'role': 'user',
+            'content': f'Previous summary:\n{item.summary or "The duel has just started."}',
+        },
+        {
+            'role': 'user',
+            'content': 'New actions:\n' + '\n\n'.join(action['content'] for action in item.actions),
+        },
+    ]
+    return await generate_response(prompt, endpoint='summarize_actions', max_tokens=item.max_tokens)
 
 
 @router.post('/contest/pick_winner')
@@ -151,9 +362,137 @@ async def pick_winner(actions: list[Message]) -> str | None:
     prompt = get_messages('pick_winner', has_schema=True)
     response = await generate_response(
         actions + prompt,
+        endpoint='pick_winner',
         response_format={'type': 'json_object'},
     )
     schema = json.loads(response)
     if schema['is_tie']:
         return None
     return schema['winner']
+
+
+def get_session(session_id: str) -> Session:
+    try:
+        return sessions.get(session_id)
+    except SessionNotFoundError:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f'No session {session_id}') from None
+
+
+class SessionActionRequest(BaseModel):
+    wizard_index: int = Field(ge=0, le=1)
+    spell: SpellBase
+
+
+def get_session_action_request[R: GenerateActionRequest](
+    session: Session,
+    item: SessionActionRequest,
+    request_type: type[R] = GenerateActionRequest,
+) -> R:
+    # the session data is already validated
+    return request_type.model_construct(
+        previous_actions=session.actions,
+        wizard=session.wizards[item.wizard_index],
+        spell=item.spell,
+        wizards=session.wizards,
+    )
+
+
+@router.post('/session/create')
+async def create_session(wizards: Pair[Wizard]) -> str:
+    """
+    Keeps the wizards and the actions of the match, so that the session endpoints
+    receive only the data of the current turn
+    :return: session id
+    """
+    try:
+        return sessions.create(wizards)
+    except SessionStoreFullError as e:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=str(e),
+            headers={'Retry-After': '5'},
+        ) from None
+
+
+@router.post('/session/append_actions')
+async def append_session_actions(session_id: str, actions: list[Message]) -> None:
+    get_session(session_id).actions.extend(actions)
+
+
+@router.post('/session/generate_action')
+async def session_generate_action(session_id: str, item: SessionActionRequest) -> GenerateActionResponse:
+    session = get_session(session_id)
+    response = await generate_action(get_session_action_request(session, item))
+    session.actions.extend(response.new_actions)
+    return response
+
+
+@router.post('/session/generate_action_stream')
+async def session_generate_action_stream(session_id: str, item: SessionActionRequest) -> StreamingResponse:
+    session = get_session(session_id)
+    prompt = get_action_prompt(get_session_action_request(session, item))
+
+    async def lines() -> AsyncIterator[str]:
+        chunks = []
+        async for chunk in stream_response(session.actions + prompt, endpoint='generate_action'):
+            chunks.append(chunk)
+            yield GenerateActionChunk(chunk=chunk).model_dump_json() + '\n'
+        response = get_action_response(prompt, ''.join(chunks))
+        session.actions.extend(response.new_actions)
+        yield GenerateActionChunk(response=response).model_dump_json() + '\n'
+
+    return StreamingResponse(lines(), media_type='application/x-ndjson')
+
+
+@router.post('/session/generate_turn')
+async def session_generate_turn(session_id: str, item: SessionActionRequest) -> GenerateTurnResponse:
+    session = get_session(session_id)
+    response = await generate_turn(get_session_action_request(session, item, GenerateTurnRequest))
+    session.actions.extend(response.new_actions)
+    return response
+
+
+@router.post('/session/determine_turn')
+async def session_determine_turn(session_id: str) -> int:
+    session = get_session(session_id)
+    return await determine_turn(DetermineTurnRequest.model_construct(actions=session.actions, wizards=session.wizards))
+
+
+@router.post('/session/pick_winner')
+async def session_pick_winner(session_id: str) -> str | None:
+    return await pick_winner(get_session(session_id).actions)
+
+
+@router.post('/session/delete')
+async def delete_session(session_id: str) -> None:
+    sessions.delete(session_id)
+
+
+@router.get('/prompts/stats')
+async def prompts_stats() -> PromptStats:
+    return prompts.stats()
+
+
+@router.get('/spell/manacost_cache/stats')
+async def manacost_cache_stats() -> CacheStats:
+    return manacost_cache.stats()
+
+
+@router.get('/limiter/stats')
+async def limiter_stats() -> LimiterStats:
+    return limiter.stats()
+
+
+@router.get('/session/stats')
+async def session_stats() -> SessionStats:
+    return sessions.stats()
+
+
+@router.get('/singleflight/stats')
+async def singleflight_stats() -> SingleFlightStats:
+    return singleflight.stats()
+
+
+@router.get('/metrics', response_class=PlainTextResponse)
+async def metrics() -> str:
+    return registry.render()
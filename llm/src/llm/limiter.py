@@ -0,0 +1,186 @@
+import asyncio
+import time
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+
+from commonlib.models import Message
+from pydantic import BaseModel
+
+from .config import settings
+from .dispatcher import Dispatcher
+
+
+class LimiterError(Exception):
+    pass
+
+
+class QueueFullError(LimiterError):
+    pass
+
+
+class QueueTimeoutError(LimiterError):
+    pass
+
+
+class TokenBucket:
+    """
+    Bucket of `capacity` units refilled evenly over a minute, unlimited if `capacity` is None.
+    The balance may become negative when the actual usage exceeds the reservation.
+    """
+
+    def __init__(self, capacity: float | None):
+        self._capacity = capacity
+        self._rate = capacity / 60 if capacity is not None else 0
+        self._balance = capacity
+        self._updated = time.monotonic()
+
+    def delay(self, amount: float) -> float:
+        """
+        :return: seconds to wait until `amount` units are available
+        """
+        if self._capacity is None:
+            return 0
+        self._refill()
+        missing = min(amount, self._capacity) - self._balance
+        return max(missing, 0) / self._rate
+
+    def take(self, amount: float) -> None:
+        if self._capacity is None:
+            return
+        self._refill()
+        self._balance -= amount
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._balance = min(self._capacity, self._balance + (now - self._updated) * self._rate)
+        self._updated = now
+
+
+@dataclass
+class Reservation:
+    estimated_tokens: int
+    used_tokens: int | None = None
+
+
+class LimiterStats(BaseModel):
+    in_flight: int
+    queue_depth: int
+    max_queue_depth: int
+    admitted: int
+    rejected: int
+    timed_out: int
+    wait_seconds_total: float
+    wait_seconds_max: float
+
+
+class RateLimiter:
+    """
+    Admits requests to the LLM provider.
+    Bounds the number of requests in flight and keeps requests and tokens per minute within the quota.
+    The per minute quota is off unless `requests_per_minute` or `tokens_per_minute` is set.
+    Requests which can not be admitted wait in a bounded queue for at most `queue_timeout` seconds, if set.
+    The queue is ordered by the priority class of the request, see `Dispatcher`.
+    """
+
+    def __init__(
+        self,
+        max_in_flight: int,
+        requests_per_minute: int | None,
+        tokens_per_minute: int | None,
+        max_queue: int,
+        queue_timeout: float | None,
+        priority_weights: dict[str, int],
+        starvation_timeout: float,
+    ):
+        self._slots = asyncio.Semaphore(max_in_flight)
+        self._requests = TokenBucket(requests_per_minute)
+        self._tokens = TokenBucket(tokens_per_minute)
+        # only one request at a time waits for a slot and the quota, the rest wait for their turn
+        self._dispatcher = Dispatcher(1, priority_weights, starvation_timeout)
+        self._max_queue = max_queue
+        self._queue_timeout = queue_timeout
+
+        self._in_flight = 0
+        self._queue_depth = 0
+        self._max_queue_depth = 0
+        self._admitted = 0
+        self._rejected = 0
+        self._timed_out = 0
+        self._wait_seconds_total = 0.0
+        self._wait_seconds_max = 0.0
+
+    @staticmethod
+    def estimate_tokens(messages: list[Message], completion_tokens: int) -> int:
+        # roughly four characters per token for english text
+        return sum(len(message['content']) for message in messages) // 4 + completion_tokens
+
+    @asynccontextmanager
+    async def acquire(self, estimated_tokens: int, priority: str = 'interactive') -> AsyncIterator[Reservation]:
+        """
+        Waits for a free slot and enough quota.
+        Set `used_tokens` of the reservation to the actual usage to correct the token bucket.
+        """
+        if self._queue_depth >= self._max_queue:
+            self._rejected += 1
+            raise QueueFullError(f'{self._queue_depth} requests are already waiting')
+
+        self._queue_depth += 1
+        self._max_queue_depth = max(self._max_queue_depth, self._queue_depth)
+        start = time.monotonic()
+        try:
+            await asyncio.wait_for(self._admit(estimated_tokens, priority), self._queue_timeout)
+        except TimeoutError:
+            self._timed_out += 1
+            raise QueueTimeoutError(f'Not admitted in {self._queue_timeout} seconds') from None
+        finally:
+            self._queue_depth -= 1
+            waited = time.monotonic() - start
+            self._wait_seconds_total += waited
+            self._wait_seconds_max = max(self._wait_seconds_max, waited)
+
+        self._admitted += 1
+        self._in_flight += 1
+        reservation = Reservation(estimated_tokens)
+        try:
+            yield reservation
+        finally:
+            self._in_flight -= 1
+            self._slots.release()
+            if reservation.used_tokens is not None:
+                self._tokens.take(reservation.used_tokens - reservation.estimated_tokens)
+
+    def stats(self) -> LimiterStats:
+        return LimiterStats(
+            in_flight=self._in_flight,
+            queue_depth=self._queue_depth,
+            max_queue_depth=self._max_queue_depth,
+            admitted=self._admitted,
+            rejected=self._rejected,
+            timed_out=self._timed_out,
+            wait_seconds_total=self._wait_seconds_total,
+            wait_seconds_max=self._wait_seconds_max,
+        )
+
+    async def _admit(self, estimated_tokens: int, priority: str) -> None:
+        async with self._dispatcher.turn(priority):
+            await self._slots.acquire()
+            try:
+                while delay := max(self._requests.delay(1), self._tokens.delay(estimated_tokens)):
+                    await asyncio.sleep(delay)
+                self._requests.take(1)
+                self._tokens.take(estimated_tokens)
+            except BaseException:
+                self._slots.release()
+                raise
+
+
+limiter = RateLimiter(
+    max_in_flight=settings.LLM_MAX_IN_FLIGHT,
+    requests_per_minute=settings.LLM_REQUESTS_PER_MINUTE,
+    tokens_per_minute=settings.LLM_TOKENS_PER_MINUTE,
+    max_queue=settings.LLM_MAX_QUEUE,
+    queue_timeout=settings.LLM_QUEUE_TIMEOUT,
+    priority_weights=settings.LLM_PRIORITY_WEIGHTS,
+    starvation_timeout=settings.LLM_STARVATION_TIMEOUT,
+)
@@ -1,6 +1,45 @@
-from fastapi import FastAPI
+import asyncio
+from contextlib import asynccontextmanager
 
+from fastapi import FastAPI, Request, status
+from fastapi.responses import JSONResponse
+
+from .cache import manacost_cache
+from .client import DeadlineExceededError
+from .config import settings
 from .engine import router
+from .limiter import LimiterError
+from .prompts import registry as prompts
+
+
+@asynccontextmanager
+async def lifespan(_: FastAPI):
+    prompts.load()
+    watcher = None
+    if settings.PROMPTS_HOT_RELOAD:
+        watcher = asyncio.create_task(prompts.watch(settings.PROMPTS_RELOAD_INTERVAL))
+    yield
+    if watcher is not None:
+        watcher.cancel()
+    await manacost_cache.close()
+
 
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 app.include_router(router)
+
+
+@app.exception_handler(LimiterError)
+async def limiter_error_handler(_: Request, exc: LimiterError) -> JSONResponse:
+    return JSONResponse(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={'detail': str(exc)},
+        headers={'Retry-After': str(round(settings.LLM_QUEUE_TIMEOUT or 1))},
+    )
+
+
+@app.exception_handler(DeadlineExceededError)
+async def deadline_error_handler(_: Request, exc: DeadlineExceededError) -> JSONResponse:
+    return JSONResponse(
+        status_code=status.HTTP_504_GATEWAY_TIMEOUT,
+        content={'detail': str(exc)},
+    )
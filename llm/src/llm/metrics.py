@@ -0,0 +1,138 @@
+import bisect
+import math
+from collections import defaultdict
+
+# the same registry as contest/metrics.py plus `Histogram.quantile`,
+# the services are built separately and share nothing but commonlib
+LabelValues = tuple[tuple[str, str], ...]
+
+
+def _labels(labels: dict) -> LabelValues:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _format(name: str, labels: LabelValues, value: float, extra: LabelValues = ()) -> str:
+    pairs = labels + extra
+    if pairs:
+        name += '{' + ','.join(f'{key}="{value}"' for key, value in pairs) + '}'
+    return f'{name} {value:g}'
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str):
+        self.name = name
+        self.documentation = documentation
+        self._values: dict[LabelValues, float] = defaultdict(float)
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        self._values[_labels(labels)] += amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(_labels(labels), 0)
+
+    def render(self) -> list[str]:
+        return [_format(self.name, labels, value) for labels, value in self._values.items()]
+
+    type = 'counter'
+
+
+class Gauge(Counter):
+    def set(self, value: float, **labels) -> None:
+        self._values[_labels(labels)] = value
+
+    def dec(self, amount: float = 1, **labels) -> None:
+        self._values[_labels(labels)] -= amount
+
+    type = 'gauge'
+
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, buckets: tuple[float, ...]):
+        self.name = name
+        self.documentation = documentation
+        self._buckets = tuple(sorted(buckets)) + (math.inf,)
+        self._counts: dict[LabelValues, list[int]] = {}
+        self._sums: dict[LabelValues, float] = defaultdict(float)
+
+    def observe(self, value: float, **labels) -> None:
+        key = _labels(labels)
+        if key not in self._counts:
+            self._counts[key] = [0] * len(self._buckets)
+        self._counts[key][bisect.bisect_left(self._buckets, value)] += 1
+        self._sums[key] += value
+
+    def count(self, **labels) -> int:
+        return sum(self._counts.get(_labels(labels), ()))
+
+    def sum(self, **labels) -> float:
+        return self._sums.get(_labels(labels), 0)
+
+    def quantile(self, q: float, **labels) -> float | None:
+        """
+        Estimates the quantile by linear interpolation within the bucket, like `histogram_quantile` does
+        :return: None if nothing was observed
+        """
+        counts = self._counts.get(_labels(labels))
+        if not counts:
+            return None
+        rank = q * sum(counts)
+        cumulative = 0
+        for index, count in enumerate(counts):
+            if count and cumulative + count >= rank:
+                upper = self._buckets[index]
+                if upper == math.inf:
+                    return self._buckets[-2]
+                lower = self._buckets[index - 1] if index else 0
+                return lower + (upper - lower) * (rank - cumulative) / count
+            cumulative += count
+        return None
+
+    def render(self) -> list[str]:
+        lines = []
+        for labels, counts in self._counts.items():
+            cumulative = 0
+            for bucket, count in zip(self._buckets, counts):
+                cumulative += count
+                le = '+Inf' if bucket == math.inf else f'{bucket:g}'
+                lines.append(_format(f'{self.name}_bucket', labels, cumulative, (('le', le),)))
+            lines.append(_format(f'{self.name}_sum', labels, self._sums[labels]))
+            lines.append(_format(f'{self.name}_count', labels, cumulative))
+        return lines
+
+    type = 'histogram'
+
+
+class Registry:
+    """
+    Metrics of the service in the Prometheus text format.
+    Values are plain numbers updated from the event loop, so no locking is needed.
+    """
+
+    def __init__(self):
+        self._metrics: list[Counter | Histogram] = []
+
+    def counter(self, name: str, documentation: str) -> Counter:
+        return self._register(Counter(name, documentation))
+
+    def gauge(self, name: str, documentation: str) -> Gauge:
+        return self._register(Gauge(name, documentation))
+
+    def histogram(self, name: str, documentation: str, buckets: tuple[float, ...]) -> Histogram:
+        return self._register(Histogram(name, documentation, buckets))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.type}')
+            lines += metric.render()
+        return '\n'.join(lines) + '\n'
+
+    def _register[M: Counter | Histogram](self, metric: M) -> M:
+        self._metrics.append(metric)
+        return metric
+
+
+registry = Registry()
+
+SECONDS_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
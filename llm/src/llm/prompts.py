@@ -0,0 +1,166 @@
+import asyncio
+import hashlib
+import json
+import re
+import time
+from pathlib import Path
+
+from commonlib.models import Message
+from pydantic import BaseModel
+
+PROMPTS_PATH = Path(__file__).parent / 'prompts'
+
+PLACEHOLDER_RE = re.compile(r'<(\w+)>')
+
+SCHEMA_SUFFIX = '_schema'
+
+
+class PromptTemplate:
+    """
+    Prompt file compiled once into literal segments and placeholder names.
+    Rendering is a single join per message instead of a `str.replace` per placeholder.
+    `version` is a short digest of the compiled contents, it changes whenever the prompt is edited.
+    """
+
+    def __init__(self, messages: list[dict]):
+        compiled = []
+        for message in messages:
+            content = message['content']
+            if not isinstance(content, str):
+                content = json.dumps(content)
+            fields = {key: value for key, value in message.items() if key != 'content'}
+            # odd indexes hold placeholder names, even ones hold literal text
+            compiled.append((fields, PLACEHOLDER_RE.split(content)))
+        self._compile(compiled)
+
+    def _compile(self, messages: list[tuple[dict, list[str]]]) -> None:
+        self._messages = messages
+        self.version = hashlib.sha256(repr(messages).encode()).hexdigest()[:16]
+
+    def bind(self, **replacements) -> 'PromptTemplate':
+        """
+        :return: template with given placeholders substituted permanently
+        """
+        compiled = []
+        for fields, parts in self._messages:
+            bound = [parts[0]]
+            for index in range(1, len(parts), 2):
+                name, literal = parts[index], parts[index + 1]
+                if name in replacements:
+                    # substituted text stays literal and is never treated as a placeholder
+                    bound[-1] += str(replacements[name]) + literal
+                else:
+                    bound += [name, literal]
+            compiled.append((fields, bound))
+        template = PromptTemplate([])
+        template._compile(compiled)
+        return template
+
+    def render(self, **replacements) -> list[Message]:
+        return [{**fields, 'content': self._join(parts, replacements)} for fields, parts in self._messages]
+
+    @staticmethod
+    def _join(parts: list[str], replacements: dict) -> str:
+        if len(parts) == 1:
+            return parts[0]
+        chunks = []
+        for index, part in enumerate(parts):
+            if index % 2 == 0:
+                chunks.append(part)
+            elif part in replacements:
+                chunks.append(str(replacements[part]))
+            else:
+                chunks.append(f'<{part}>')
+        return ''.join(chunks)
+
+
+class PromptStats(BaseModel):
+    templates: int
+    reloads: int
+    render_count: int
+    render_seconds: float
+
+
+class PromptRegistry:
+    """
+    Loads every prompt file of the directory once and keeps compiled templates in memory.
+    `load` runs at the startup, the files added later are picked up by the hot reload.
+    Files named `<name>_schema.json` are bound into `<name>` as the `<schema>` placeholder.
+    """
+
+    def __init__(self, path: Path):
+        self._path = path
+        self._templates: dict[tuple[str, bool], PromptTemplate] = {}
+        self._snapshot: dict[str, int] = {}
+
+        self.reloads = 0
+        self.render_count = 0
+        self.render_seconds = 0.0
+
+    def load(self) -> None:
+        templates = {}
+        schemas = {}
+        for file in self._path.glob('*.json'):
+            if file.stem.endswith(SCHEMA_SUFFIX):
+                schemas[file.stem.removesuffix(SCHEMA_SUFFIX)] = file.read_text()
+            else:
+                templates[file.stem] = PromptTemplate(json.loads(file.read_text()))
+        compiled = {}
+        for name, template in templates.items():
+            compiled[name, False] = template
+            if name in schemas:
+                compiled[name, True] = template.bind(schema=schemas[name])
+        self._templates = compiled
+        self._snapshot = self._scan()
+
+    def __contains__(self, name: str) -> bool:
+        """
+        Whether the prompt is loaded, a file added later is found by the hot reload
+        """
+        return (name, False) in self._templates
+
+    def get(self, name: str, has_schema: bool = False) -> PromptTemplate:
+        template = self._templates.get((name, has_schema))
+        if template is None:
+            suffix = SCHEMA_SUFFIX if has_schema else ''
+            raise FileNotFoundError(self._path / f'{name}{suffix}.json')
+        return template
+
+    def render(self, name: str, /, has_schema: bool = False, **replacements) -> list[Message]:
+        start = time.perf_counter()
+        messages = self.get(name, has_schema).render(**replacements)
+        self.render_seconds += time.perf_counter() - start
+        self.render_count += 1
+        return messages
+
+    def version(self, name: str, has_schema: bool = False) -> str:
+        return self.get(name, has_schema).version
+
+    def reload_if_changed(self) -> bool:
+        """
+        :return: whether the prompt files were changed and reloaded
+        """
+        if self._scan() == self._snapshot:
+            return False
+        self.load()
+        self.reloads += 1
+        return True
+
+    async def watch(self, interval: float) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            self.reload_if_changed()
+
+    def stats(self) -> PromptStats:
+        return PromptStats(
+            templates=len(self._templates),
+            reloads=self.reloads,
+            render_count=self.render_count,
+            render_seconds=self.render_seconds,
+        )
+
+    def _scan(self) -> dict[str, int]:
+        return {file.name: file.stat().st_mtime_ns for file in self._path.glob('*.json')}
+
+
+registry = PromptRegistry(PROMPTS_PATH)
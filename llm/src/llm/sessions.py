@@ -0,0 +1,85 @@
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass, field
+
+from commonlib.models import Message, Pair, Wizard
+from pydantic import BaseModel
+
+from .config import settings
+
+
+class SessionNotFoundError(KeyError):
+    pass
+
+
+class SessionStoreFullError(Exception):
+    pass
+
+
+@dataclass
+class Session:
+    wizards: Pair[Wizard]
+    actions: list[Message] = field(default_factory=list)
+    touched_at: float = field(default_factory=time.monotonic)
+
+
+class SessionStats(BaseModel):
+    created: int = 0
+    deleted: int = 0
+    rejected: int = 0
+    expirations: int = 0
+    size: int = 0
+
+
+class SessionStore:
+    """
+    Matches kept on the llm side, so the contest sends only the new data of every turn.
+    Sessions expire `ttl` seconds after the last access. When the store is full, new sessions are refused,
+    as evicting one would break a running match.
+    """
+
+    def __init__(self, max_size: int, ttl: float):
+        self._max_size = max_size
+        self._ttl = ttl
+        self._sessions: OrderedDict[str, Session] = OrderedDict()
+        self._stats = SessionStats()
+
+    def create(self, wizards: Pair[Wizard]) -> str:
+        self._expire()
+        if len(self._sessions) >= self._max_size:
+            self._stats.rejected += 1
+            raise SessionStoreFullError(f'{len(self._sessions)} sessions are already open')
+        session_id = uuid.uuid4().hex
+        self._sessions[session_id] = Session(wizards)
+        self._stats.created += 1
+        return session_id
+
+    def get(self, session_id: str) -> Session:
+        self._expire()
+        session = self._sessions.get(session_id)
+        if session is None:
+            raise SessionNotFoundError(session_id)
+        session.touched_at = time.monotonic()
+        self._sessions.move_to_end(session_id)
+        return session
+
+    def delete(self, session_id: str) -> None:
+        if self._sessions.pop(session_id, None) is not None:
+            self._stats.deleted += 1
+
+    def stats(self) -> SessionStats:
+        return self._stats.model_copy(update={'size': len(self._sessions)})
+
+    def _expire(self) -> None:
+        # sessions are ordered by the last access, so the expired ones are in the beginning
+        deadline = time.monotonic() - self._ttl
+        while self._sessions:
+            session_id, session = next(iter(self._sessions.items()))
+            if session.touched_at > deadline:
+                break
+            del self._sessions[session_id]
+            self._stats.expirations += 1
+
+
+sessions = SessionStore(max_size=settings.SESSIONS_MAX_SIZE, ttl=settings.SESSIONS_TTL)
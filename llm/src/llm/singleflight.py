@@ -0,0 +1,70 @@
+import asyncio
+import hashlib
+import json
+import typing as tp
+from collections.abc import Awaitable, Callable
+from dataclasses import dataclass
+
+from pydantic import BaseModel
+
+T = tp.TypeVar('T')
+
+
+@dataclass
+class _Call:
+    task: asyncio.Task
+    waiters: int = 0
+
+
+class SingleFlightStats(BaseModel):
+    calls: int
+    saved: int
+    in_flight: int
+
+
+class SingleFlight:
+    """
+    Deduplicates identical concurrent calls.
+    The first caller starts the call, the others await the same task.
+    A cancelled caller does not affect the rest; the call is cancelled only when nobody waits for it.
+    """
+
+    def __init__(self):
+        self._calls: dict[str, _Call] = {}
+        self._started = 0
+        self._saved = 0
+
+    @staticmethod
+    def key(*parts) -> str:
+        payload = json.dumps(parts, sort_keys=True, separators=(',', ':'), default=str)
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    async def do(self, key: str, function: Callable[[], Awaitable[T]]) -> T:
+        call = self._calls.get(key)
+        if call is None:
+            call = _Call(asyncio.ensure_future(function()))
+            self._calls[key] = call
+            call.task.add_done_callback(lambda _: self._forget(key, call))
+            self._started += 1
+        else:
+            self._saved += 1
+
+        call.waiters += 1
+        try:
+            return await asyncio.shield(call.task)
+        finally:
+            call.waiters -= 1
+            if call.waiters == 0 and not call.task.done():
+                # forgotten now, a caller arriving while the task winds down starts a new call
+                self._forget(key, call)
+                call.task.cancel()
+
+    def stats(self) -> SingleFlightStats:
+        return SingleFlightStats(calls=self._started, saved=self._saved, in_flight=len(self._calls))
+
+    def _forget(self, key: str, call: _Call) -> None:
+        if self._calls.get(key) is call:
+            del self._calls[key]
+
+
+singleflight = SingleFlight()
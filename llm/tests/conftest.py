@@ -12,6 +12,7 @@ def mock_groq_response(mocker):
                 )
             )
         ]
+        mock.usage = mocker.Mock(prompt_tokens=10, completion_tokens=1, total_tokens=11)
         return mock
 
     return _mock_response
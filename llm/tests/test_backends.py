@@ -0,0 +1,111 @@
+import json
+
+import httpx
+import pytest
+from groq import APIConnectionError, APITimeoutError
+
+from llm.backends import GroqBackend, LocalBackend, UpstreamError
+
+wizard_messages = [
+    {'role': 'user', 'content': "Wizard's name is Merlin\nThey have following spells:\n\n"},
+    {'role': 'user', 'content': "Wizard's name is Gandalf\nThey have following spells:\n\n"},
+]
+
+action_messages = [
+    {'role': 'user', 'content': "Merlin uses Fireball. It's description: Launches a fireball"},
+    {'role': 'assistant', 'content': 'Boom'},
+    {'role': 'user', 'content': "Gandalf uses Shield. It's description: Creates shield"},
+    {'role': 'assistant', 'content': 'Blocked'},
+]
+
+
+def make_backend(**kwargs) -> LocalBackend:
+    params = {
+        'seed': 1,
+        'latency_median': 0,
+        'latency_sigma': 0.5,
+        'tokens_per_second': 1e9,
+        'completion_tokens': 20,
+        'error_rate': 0,
+    }
+    params.update(kwargs)
+    return LocalBackend(**params)
+
+
+async def test_answers_are_deterministic():
+    backend = make_backend()
+
+    first = await backend.complete(action_messages, 'generate_action')
+    second = await backend.complete(action_messages, 'generate_action')
+
+    assert first == second
+    assert len(first.text.split()) == 20
+    assert first.usage.prompt_tokens > 0
+    assert first.usage.completion_tokens > 0
+
+
+async def test_answers_are_schema_valid():
+    backend = make_backend()
+
+    manacost = await backend.complete([{'role': 'user', 'content': 'spell'}], 'calculate_manacost')
+    turn = await backend.complete(wizard_messages, 'determine_turn')
+    winner = await backend.complete(action_messages, 'pick_winner')
+    fused = await backend.complete(action_messages + wizard_messages, 'generate_turn')
+
+    assert 1 <= int(manacost.text) <= 10
+    assert turn.text in ('Merlin', 'Gandalf')
+    schema = json.loads(winner.text)
+    assert schema['is_tie'] or schema['winner'] in ('Merlin', 'Gandalf')
+    schema = json.loads(fused.text)
+    assert schema['description']
+    assert schema['next_wizard'] in ('Merlin', 'Gandalf')
+
+
+async def test_stream():
+    backend = make_backend()
+
+    chunks = [chunk async for chunk in backend.stream(action_messages, 'generate_action')]
+    complete = await backend.complete(action_messages, 'generate_action')
+
+    assert ''.join(chunk.text for chunk in chunks[:-1]) == complete.text
+    assert chunks[-1].usage == complete.usage
+
+
+async def test_error_rate():
+    backend = make_backend(error_rate=1)
+
+    with pytest.raises(UpstreamError) as error:
+        await backend.complete(action_messages, 'generate_action')
+    assert error.value.status_code in (429, 500, 503)
+
+
+async def test_groq_connection_errors(mocker):
+    backend = GroqBackend(api_key='key', model='model')
+    request = httpx.Request('POST', 'https://api.groq.com')
+    mocker.patch.object(
+        backend.client.chat.completions,
+        'create',
+        side_effect=[APITimeoutError(request), APIConnectionError(request=request)],
+    )
+
+    # the provider was not reached, the errors are retried like the overloaded provider
+    with pytest.raises(UpstreamError) as error:
+        await backend.complete(action_messages, 'generate_action')
+    assert error.value.status_code == 504
+    with pytest.raises(UpstreamError) as error:
+        await anext(backend.stream(action_messages, 'generate_action'))
+    assert error.value.status_code == 503
+
+
+async def test_batch_manacost_answer():
+    backend = make_backend()
+    spells = [{'index': index, 'type': 'ACTIVE', 'description': 'spell'} for index in range(3)]
+
+    completion = await backend.complete(
+        [{'role': 'system', 'content': 'rules'}, {'role': 'user', 'content': json.dumps(spells)}],
+        'calculate_manacost_batch',
+    )
+
+    manacosts = json.loads(completion.text)['manacosts']
+    assert len(manacosts) == 3
+    assert all(1 <= manacost <= 10 for manacost in manacosts)
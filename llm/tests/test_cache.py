@@ -0,0 +1,85 @@
+import pytest
+from commonlib.models import SpellType
+
+from llm import engine
+from llm.cache import ManacostCache
+from llm.config import Route
+
+
+@pytest.fixture
+def cache_path(tmp_path):
+    return tmp_path / 'cache.sqlite3'
+
+
+def test_key_is_normalized():
+    key = ManacostCache.key(SpellType.ACTIVE, 'Launches  a\nFireball ', 'v1', 'model')
+
+    assert key == ManacostCache.key(SpellType.ACTIVE, 'launches a fireball', 'v1', 'model')
+    assert key != ManacostCache.key(SpellType.PASSIVE, 'launches a fireball', 'v1', 'model')
+    assert key != ManacostCache.key(SpellType.ACTIVE, 'launches a fireball', 'v2', 'model')
+    assert key != ManacostCache.key(SpellType.ACTIVE, 'launches a fireball', 'v1', 'other')
+
+
+async def test_memory_lru_eviction():
+    cache = ManacostCache(path=None, max_size=2, ttl=60)
+    await cache.set('a', 1)
+    await cache.set('b', 2)
+    assert await cache.get('a') == 1
+    await cache.set('c', 3)
+
+    assert await cache.get('b') is None
+    assert await cache.get('a') == 1
+    assert await cache.get('c') == 3
+    stats = cache.stats()
+    assert stats.evictions == 1
+    assert stats.memory_hits == 3
+    assert stats.misses == 1
+
+
+async def test_ttl_expiration(mocker):
+    cache = ManacostCache(path=None, max_size=2, ttl=60)
+    time = mocker.patch('llm.cache.time.time', return_value=1000)
+    await cache.set('a', 1)
+
+    time.return_value = 1061
+
+    assert await cache.get('a') is None
+    assert cache.stats().expirations == 1
+
+
+async def test_disk_tier_survives_restart(cache_path):
+    cache = ManacostCache(path=cache_path, max_size=2, ttl=60)
+    await cache.set('a', 7)
+    await cache.close()
+
+    restarted = ManacostCache(path=cache_path, max_size=2, ttl=60)
+
+    assert await restarted.get('a') == 7
+    assert await restarted.get('a') == 7
+    stats = restarted.stats()
+    assert stats.disk_hits == 1
+    assert stats.memory_hits == 1
+    await restarted.close()
+
+
+async def test_calculate_manacost_uses_cache(mocker, cache_path):
+    mocker.patch.object(engine, 'manacost_cache', ManacostCache(path=cache_path, max_size=2, ttl=60))
+    mocker.patch.object(engine.prompts, 'version', return_value='v1')
+    mocker.patch.object(engine, 'get_messages', return_value=[])
+    generate_response = mocker.patch.object(engine, 'generate_response', return_value='5')
+
+    first = await engine.calculate_manacost(engine.CalculateManacostRequest(type_=SpellType.ACTIVE, description='x'))
+    second = await engine.calculate_manacost(engine.CalculateManacostRequest(type_=SpellType.ACTIVE, description='X '))
+
+    assert first == second == 5
+    generate_response.assert_called_once()
+
+
+def test_key_follows_route(mocker):
+    mocker.patch.object(engine.prompts, 'version', return_value='v1')
+    item = engine.CalculateManacostRequest(type_=SpellType.ACTIVE, description='x')
+    key = engine.get_manacost_key(item)
+    mocker.patch('llm.client.settings.LLM_ROUTES', {'calculate_manacost': Route(model='small')})
+    mocker.patch.dict('llm.client.routed_backends', {'small': mocker.Mock(model='small')})
+
+    assert engine.get_manacost_key(item) != key
@@ -0,0 +1,60 @@
+import pytest
+
+from llm.backends import LocalBackend, UpstreamError
+from llm.cassette import Cassette, CassetteMissError, RecordingBackend, ReplayBackend
+
+messages = [{'role': 'user', 'content': "Merlin uses Fireball. It's description: Launches a fireball"}]
+
+
+def make_backend(**kwargs) -> LocalBackend:
+    params = {
+        'seed': 1,
+        'latency_median': 0.01,
+        'latency_sigma': 0,
+        'tokens_per_second': 1e9,
+        'completion_tokens': 5,
+        'error_rate': 0,
+    }
+    params.update(kwargs)
+    return LocalBackend(**params)
+
+
+async def test_record_and_replay(tmp_path, mocker):
+    path = tmp_path / 'cassette.jsonl.gz'
+    recorder = RecordingBackend(make_backend(), Cassette(path))
+    recorded = await recorder.complete(messages, 'generate_action')
+    streamed = [chunk async for chunk in recorder.stream(messages, 'generate_action')]
+
+    sleep = mocker.patch('llm.cassette.asyncio.sleep')
+    replay = ReplayBackend(Cassette(path), latency_scale=0.5)
+
+    assert await replay.complete(messages, 'generate_action') == recorded
+    assert 0.004 <= sleep.call_args.args[0] <= 0.01
+    replayed = [chunk async for chunk in replay.stream(messages, 'generate_action')]
+    assert [chunk.text for chunk in replayed] == [chunk.text for chunk in streamed]
+    assert replayed[-1].usage == streamed[-1].usage
+
+
+async def test_replay_errors_in_order(tmp_path, mocker):
+    path = tmp_path / 'cassette.jsonl.gz'
+    failing = RecordingBackend(make_backend(error_rate=1), Cassette(path))
+    with pytest.raises(UpstreamError):
+        await failing.complete(messages, 'calculate_manacost')
+    recorder = RecordingBackend(make_backend(), Cassette(path))
+    recorded = await recorder.complete(messages, 'calculate_manacost')
+
+    mocker.patch('llm.cassette.asyncio.sleep')
+    replay = ReplayBackend(Cassette(path), latency_scale=1)
+
+    with pytest.raises(UpstreamError):
+        await replay.complete(messages, 'calculate_manacost')
+    assert await replay.complete(messages, 'calculate_manacost') == recorded
+    with pytest.raises(CassetteMissError):
+        await replay.complete(messages, 'determine_turn')
+
+
+def test_key_is_canonical():
+    assert Cassette.key(messages, 'pick_winner', temperature=0, max_tokens=1) == Cassette.key(
+        messages, 'pick_winner', max_tokens=1, temperature=0
+    )
+    assert Cassette.key(messages, 'pick_winner') != Cassette.key(messages, 'determine_turn')
@@ -0,0 +1,167 @@
+import asyncio
+from contextlib import asynccontextmanager
+
+import pytest
+
+from llm import client
+from llm.backends import Completion, LocalBackend, UpstreamError
+from llm.client import DeadlineExceededError, generate_response
+from llm.config import Route
+
+messages = [{'role': 'user', 'content': 'client'}]
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(mocker):
+    mocker.patch('llm.client.settings.LLM_RETRY_BACKOFF', 0)
+
+
+async def test_retry(mocker):
+    complete = mocker.patch(
+        'llm.client.backend.complete',
+        side_effect=[UpstreamError(500), UpstreamError(429), Completion('ok')],
+    )
+
+    assert await generate_response(messages, endpoint='client_retry') == 'ok'
+    assert complete.call_count == 3
+    assert client.retries.value(endpoint='client_retry', status=500) == 1
+    assert client.retries.value(endpoint='client_retry', status=429) == 1
+
+
+async def test_retry_gives_up(mocker):
+    mocker.patch('llm.client.settings.LLM_RETRIES', 1)
+    complete = mocker.patch('llm.client.backend.complete', side_effect=UpstreamError(503))
+
+    with pytest.raises(UpstreamError):
+        await generate_response(messages, endpoint='client_give_up')
+    assert complete.call_count == 2
+
+
+async def test_client_errors_are_not_retried(mocker):
+    complete = mocker.patch('llm.client.backend.complete', side_effect=UpstreamError(400))
+
+    with pytest.raises(UpstreamError):
+        await generate_response(messages, endpoint='client_bad_request')
+    assert complete.call_count == 1
+
+
+async def test_fallback(mocker):
+    fallback = LocalBackend(
+        seed=0,
+        latency_median=0,
+        latency_sigma=0,
+        tokens_per_second=1e9,
+        completion_tokens=5,
+        error_rate=0,
+        model='fallback',
+    )
+    mocker.patch('llm.client.fallback_backends', [fallback])
+    mocker.patch('llm.client.backend.complete', side_effect=UpstreamError(429))
+
+    assert await generate_response(messages, endpoint='client_fallback')
+    assert client.fallbacks.value(endpoint='client_fallback', model='fallback') == 1
+
+
+async def test_deadline(mocker):
+    async def complete(*args, **kwargs):
+        await asyncio.sleep(1)
+
+    mocker.patch('llm.client.settings.LLM_ENDPOINT_TIMEOUTS', {'client_deadline': 0.01})
+    mocker.patch('llm.client.backend.complete', complete)
+
+    with pytest.raises(DeadlineExceededError):
+        await generate_response(messages, endpoint='client_deadline')
+    assert client.errors.value(endpoint='client_deadline', type='timeout') == 1
+
+
+async def test_deadline_in_queue(mocker):
+    @asynccontextmanager
+    async def acquire(*args, **kwargs):
+        await asyncio.sleep(1)
+        yield
+
+    mocker.patch('llm.client.settings.LLM_ENDPOINT_TIMEOUTS', {'client_queue_deadline': 0.01})
+    mocker.patch('llm.client.limiter.acquire', acquire)
+
+    with pytest.raises(DeadlineExceededError):
+        await generate_response(messages, endpoint='client_queue_deadline')
+    # the cancelled request left the queue
+    assert client.queued.value(endpoint='client_queue_deadline') == 0
+
+
+async def test_hedging(mocker):
+    calls = 0
+
+    async def complete(*args, **kwargs):
+        nonlocal calls
+        calls += 1
+        if calls == 1:
+            await asyncio.sleep(1)
+            return Completion('slow')
+        return Completion('fast')
+
+    mocker.patch('llm.client.settings.LLM_HEDGING', True)
+    mocker.patch('llm.client.settings.LLM_HEDGE_MIN_SAMPLES', 1)
+    mocker.patch('llm.client.settings.LLM_HEDGE_MIN_DELAY', 0.01)
+    client.upstream_seconds.observe(0.01, endpoint='client_hedge')
+    mocker.patch('llm.client.backend.complete', complete)
+
+    assert await generate_response(messages, endpoint='client_hedge') == 'fast'
+    assert client.hedges.value(endpoint='client_hedge') == 1
+    assert client.hedge_wins.value(endpoint='client_hedge') == 1
+
+
+async def test_route(mocker):
+    mocker.patch(
+        'llm.client.settings.LLM_ROUTES',
+        {
+            'client_route': Route(model='small', params={'temperature': 0}, max_tokens=8),
+        },
+    )
+    small = mocker.AsyncMock(model='small')
+    small.complete.return_value = Completion('ok')
+    mocker.patch.dict('llm.client.routed_backends', {'small': small})
+    primary = mocker.patch('llm.client.backend.complete')
+
+    assert await generate_response(messages, endpoint='client_route', max_tokens=4) == 'ok'
+    small.complete.assert_called_once_with(messages, 'client_route', temperature=0, max_tokens=4)
+    primary.assert_not_called()
+
+
+async def test_shadow(mocker):
+    mocker.patch(
+        'llm.client.settings.LLM_ROUTES',
+        {
+            'client_shadow': Route(shadow_model='small', shadow_rate=1),
+        },
+    )
+    small = mocker.AsyncMock(model='small')
+    small.complete.side_effect = [Completion(' Merlin'), Completion('Gandalf')]
+    mocker.patch.dict('llm.client.routed_backends', {'small': small})
+    mocker.patch('llm.client.backend.complete', return_value=Completion('merlin'))
+
+    for content in ('first', 'second'):
+        await generate_response([{'role': 'user', 'content': content}], endpoint='client_shadow')
+    await asyncio.gather(*client.shadow_tasks)
+
+    assert client.shadows.value(endpoint='client_shadow', model='small', result='agree') == 1
+    assert client.shadows.value(endpoint='client_shadow', model='small', result='disagree') == 1
+    assert client.upstream_seconds.count(endpoint='client_shadow_shadow') == 2
+
+
+async def test_shadow_error(mocker):
+    mocker.patch(
+        'llm.client.settings.LLM_ROUTES',
+        {
+            'client_shadow_error': Route(shadow_model='small', shadow_rate=1),
+        },
+    )
+    small = mocker.AsyncMock(model='small')
+    small.complete.side_effect = UpstreamError(503)
+    mocker.patch.dict('llm.client.routed_backends', {'small': small})
+    mocker.patch('llm.client.backend.complete', return_value=Completion('merlin'))
+
+    assert await generate_response(messages, endpoint='client_shadow_error') == 'merlin'
+    await asyncio.gather(*client.shadow_tasks)
+
+    assert client.shadows.value(endpoint='client_shadow_error', model='small', result='error') == 1
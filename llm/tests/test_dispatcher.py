@@ -0,0 +1,67 @@
+import asyncio
+
+from llm.dispatcher import Dispatcher, dispatch_starved
+
+weights = {'interactive': 2, 'background': 1}
+
+
+async def _serve(dispatcher: Dispatcher, requests: list[str]) -> list[str]:
+    """
+    Queues the requests behind a held turn and releases it
+    :return: priorities in the order the turns were granted
+    """
+    served = []
+
+    async def request(priority: str):
+        async with dispatcher.turn(priority):
+            served.append(priority)
+
+    await dispatcher.acquire('interactive')
+    tasks = [asyncio.create_task(request(priority)) for priority in requests]
+    await asyncio.sleep(0)
+    dispatcher.release()
+    await asyncio.gather(*tasks)
+    return served
+
+
+async def test_weighted_order():
+    dispatcher = Dispatcher(1, weights, starvation_timeout=60)
+
+    served = await _serve(dispatcher, ['background'] * 3 + ['interactive'] * 6)
+
+    assert served == ['interactive', 'background', 'interactive'] * 3
+
+
+async def test_starvation(mocker):
+    monotonic = mocker.patch('llm.dispatcher.time.monotonic', return_value=0)
+    dispatcher = Dispatcher(1, weights, starvation_timeout=5)
+    starved = dispatch_starved.value(priority='background')
+
+    await dispatcher.acquire('interactive')
+    background = asyncio.create_task(dispatcher.acquire('background'))
+    await asyncio.sleep(0)
+    monotonic.return_value = 10
+    interactive = asyncio.create_task(dispatcher.acquire('interactive'))
+    await asyncio.sleep(0)
+
+    dispatcher.release()
+    await background
+    assert not interactive.done()
+    assert dispatch_starved.value(priority='background') == starved + 1
+    dispatcher.release()
+    await interactive
+
+
+async def test_cancelled_waiter():
+    dispatcher = Dispatcher(1, weights, starvation_timeout=60)
+
+    await dispatcher.acquire('interactive')
+    cancelled = asyncio.create_task(dispatcher.acquire('interactive'))
+    await asyncio.sleep(0)
+    cancelled.cancel()
+    await asyncio.sleep(0)
+    waiting = asyncio.create_task(dispatcher.acquire('background'))
+    await asyncio.sleep(0)
+
+    dispatcher.release()
+    await asyncio.wait_for(waiting, 1)
@@ -1,8 +1,25 @@
 import pytest
 from commonlib.models import Pair, Spell, SpellType, Wizard
 
+from llm.cache import ManacostCache
 from llm.client import LLMError
-from llm.engine import calculate_manacost, determine_turn, generate_action, pick_winner, start_contest
+from llm.engine import (
+    CalculateManacostRequest,
+    GenerateActionChunk,
+    GenerateActionRequest,
+    GenerateTurnRequest,
+    SummarizeActionsRequest,
+    calculate_manacost,
+    calculate_manacost_batch,
+    determine_turn,
+    generate_action,
+    generate_action_stream,
+    generate_turn,
+    pick_winner,
+    start_contest,
+    summarize_actions,
+)
+from llm.prompts import PromptRegistry
 
 test_wizard_1 = Wizard(
     id=3,
@@ -33,7 +50,7 @@ wizard_pair = Pair([test_wizard_1, test_wizard_2])
 
 @pytest.mark.asyncio
 async def test_calculate_manacost(mocker, mock_groq_response):
-    mock_create = mocker.patch('llm.client.client.chat.completions.create')
+    mock_create = mocker.patch('llm.client.backend.client.chat.completions.create')
     mock_create.return_value = mock_groq_response('5')
 
     result = await calculate_manacost(type_=SpellType.ACTIVE, description='test spell')
@@ -56,7 +73,7 @@ async def test_start_contest():
 
 @pytest.mark.asyncio
 async def test_generate_action(mocker, mock_groq_response):
-    mock_create = mocker.patch('llm.client.client.chat.completions.create')
+    mock_create = mocker.patch('llm.client.backend.client.chat.completions.create')
     mock_create.return_value = mock_groq_response("Merlin casts a powerful spell!")
 
     test_messages = [{"role": "user", "content": "test"}]
@@ -68,7 +85,7 @@ async def test_generate_action(mocker, mock_groq_response):
 
 @pytest.mark.asyncio
 async def test_determine_turn(mocker, mock_groq_response):
-    mock_create = mocker.patch('llm.client.client.chat.completions.create')
+    mock_create = mocker.patch('llm.client.backend.client.chat.completions.create')
     mock_create.return_value = mock_groq_response(wizard_pair[0].name)
 
     result = await determine_turn(
@@ -81,7 +98,7 @@ async def test_determine_turn(mocker, mock_groq_response):
 
 @pytest.mark.asyncio
 async def test_determine_turn_error(mocker, mock_groq_response):
-    mock_create = mocker.patch('llm.client.client.chat.completions.create')
+    mock_create = mocker.patch('llm.client.backend.client.chat.completions.create')
     mock_create.return_value = mock_groq_response("Invalid")
 
     with pytest.raises(LLMError):
@@ -93,7 +110,7 @@ async def test_determine_turn_error(mocker, mock_groq_response):
 
 @pytest.mark.asyncio
 async def test_pick_winner(mocker, mock_groq_response):
-    mock_create = mocker.patch('llm.client.client.chat.completions.create')
+    mock_create = mocker.patch('llm.client.backend.client.chat.completions.create')
     mock_create.return_value = mock_groq_response('{"winner": "Merlin", "is_tie": false}')
 
     result = await pick_winner([{"role": "user", "content": "test"}])
@@ -103,9 +120,122 @@ async def test_pick_winner(mocker, mock_groq_response):
 
 @pytest.mark.asyncio
 async def test_pick_winner_tie(mocker, mock_groq_response):
-    mock_create = mocker.patch('llm.client.client.chat.completions.create')
+    mock_create = mocker.patch('llm.client.backend.client.chat.completions.create')
     mock_create.return_value = mock_groq_response('{"winner": null, "is_tie": true}')
 
     result = await pick_winner([{"role": "user", "content": "test"}])
 
     assert result is None
+
+
+async def test_generate_action_stream(mocker):
+    async def stream():
+        for content in ['Merlin ', None, 'casts!']:
+            yield mocker.Mock(choices=[mocker.Mock(delta=mocker.Mock(content=content))], x_groq=None)
+
+    mock_create = mocker.patch('llm.client.backend.client.chat.completions.create')
+    mock_create.return_value = stream()
+
+    item = GenerateActionRequest(
+        previous_actions=[{"role": "user", "content": "test"}],
+        wizard=test_wizard_1,
+        spell=test_wizard_1.spells[0],
+    )
+    response = await generate_action_stream(item)
+    lines = [GenerateActionChunk.model_validate_json(line) async for line in response.body_iterator]
+
+    assert [line.chunk for line in lines[:-1]] == ['Merlin ', 'casts!']
+    assert lines[-1].response.description == 'Merlin casts!'
+    assert lines[-1].response.new_actions[-1] == {'role': 'assistant', 'content': 'Merlin casts!'}
+    assert mock_create.call_args.kwargs['stream'] is True
+
+
+async def test_calculate_manacost_batch(mocker):
+    mocker.patch('llm.engine.manacost_cache', ManacostCache(path=None, max_size=16, ttl=60))
+    mocker.patch('llm.engine.prompts.version', return_value='v1')
+    mocker.patch('llm.engine.get_messages', return_value=[])
+    mocker.patch.object(PromptRegistry, '__contains__', return_value=True)
+    generate_response = mocker.patch('llm.engine.generate_response')
+    generate_response.side_effect = ['{"manacosts": [3, "broken"]}', '7', '8']
+
+    items = [
+        CalculateManacostRequest(type_=SpellType.ACTIVE, description='fireball'),
+        CalculateManacostRequest(type_=SpellType.ACTIVE, description='ice bolt'),
+        CalculateManacostRequest(type_=SpellType.PASSIVE, description='fireball'),
+    ]
+
+    assert await calculate_manacost_batch(items) == [3, 7, 8]
+    endpoints = [call.kwargs['endpoint'] for call in generate_response.call_args_list]
+    assert endpoints == ['calculate_manacost_batch', 'calculate_manacost', 'calculate_manacost']
+
+    assert await calculate_manacost_batch(items[::-1]) == [8, 7, 3]
+    assert generate_response.call_count == 3
+
+
+async def test_calculate_manacost_batch_without_prompt(mocker):
+    mocker.patch('llm.engine.manacost_cache', ManacostCache(path=None, max_size=16, ttl=60))
+    mocker.patch('llm.engine.prompts.version', return_value='v1')
+    mocker.patch('llm.engine.get_messages', return_value=[])
+    mocker.patch.object(PromptRegistry, '__contains__', return_value=False)
+    generate_response = mocker.patch('llm.engine.generate_response', side_effect=['3', '7'])
+
+    items = [
+        CalculateManacostRequest(type_=SpellType.ACTIVE, description='fireball'),
+        CalculateManacostRequest(type_=SpellType.ACTIVE, description='ice bolt'),
+    ]
+
+    # every spell is priced with the prompt for one spell
+    assert await calculate_manacost_batch(items) == [3, 7]
+    endpoints = [call.kwargs['endpoint'] for call in generate_response.call_args_list]
+    assert endpoints == ['calculate_manacost', 'calculate_manacost']
+
+
+async def test_summarize_actions(mocker, mock_groq_response):
+    mock_create = mocker.patch('llm.client.backend.client.chat.completions.create')
+    mock_create.return_value = mock_groq_response('Merlin burned Gandalf')
+
+    item = SummarizeActionsRequest(
+        summary='',
+        actions=[{"role": "user", "content": "Merlin uses Fireball"}, {"role": "assistant", "content": "Burn"}],
+        max_tokens=50,
+    )
+    result = await summarize_actions(item)
+
+    assert result == 'Merlin burned Gandalf'
+    assert mock_create.call_args.kwargs['max_tokens'] == 50
+    assert 'Merlin uses Fireball' in mock_create.call_args.kwargs['messages'][-1]['content']
+
+
+async def test_generate_turn(mocker, mock_groq_response):
+    mock_create = mocker.patch('llm.client.backend.client.chat.completions.create')
+    mock_create.return_value = mock_groq_response('{"description": "Merlin casts!", "next_wizard": "gandalf"}')
+
+    item = GenerateTurnRequest(
+        previous_actions=[{"role": "user", "content": "test"}],
+        wizard=test_wizard_1,
+        spell=test_wizard_1.spells[0],
+        wizards=wizard_pair,
+    )
+    result = await generate_turn(item)
+
+    assert result.description == "Merlin casts!"
+    assert result.next_wizard == 1
+    assert result.new_actions[-1] == {'role': 'assistant', 'content': 'Merlin casts!'}
+    assert mock_create.call_count == 1
+
+
+async def test_generate_turn_falls_back_to_determine_turn(mocker, mock_groq_response):
+    mock_create = mocker.patch('llm.client.backend.client.chat.completions.create')
+    mock_create.return_value = mock_groq_response('{"description": "Merlin casts!", "next_wizard": "Saruman"}')
+    determine_turn = mocker.patch('llm.engine.determine_turn', return_value=0)
+
+    item = GenerateTurnRequest(
+        previous_actions=[],
+        wizard=test_wizard_1,
+        spell=test_wizard_1.spells[0],
+        wizards=wizard_pair,
+    )
+    result = await generate_turn(item)
+
+    assert result.next_wizard == 0
+    assert determine_turn.call_args.args[0].actions == result.new_actions
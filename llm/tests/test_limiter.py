@@ -0,0 +1,118 @@
+import asyncio
+
+import pytest
+
+from llm.limiter import QueueFullError, QueueTimeoutError, RateLimiter, TokenBucket
+
+
+def make_limiter(**kwargs) -> RateLimiter:
+    params = {
+        'max_in_flight': 1,
+        'requests_per_minute': 600,
+        'tokens_per_minute': 6000,
+        'max_queue': 8,
+        'queue_timeout': 1,
+        'priority_weights': {'interactive': 2, 'background': 1},
+        'starvation_timeout': 10,
+    }
+    params.update(kwargs)
+    return RateLimiter(**params)
+
+
+def test_token_bucket(mocker):
+    monotonic = mocker.patch('llm.limiter.time.monotonic', return_value=0)
+    bucket = TokenBucket(60)
+
+    assert bucket.delay(60) == 0
+    bucket.take(60)
+    assert bucket.delay(10) == 10
+    assert bucket.delay(1000) == 60
+
+    monotonic.return_value = 5
+    assert bucket.delay(10) == 5
+
+
+async def test_max_in_flight():
+    limiter = make_limiter()
+    entered = asyncio.Event()
+    release = asyncio.Event()
+
+    async def hold():
+        async with limiter.acquire(1):
+            entered.set()
+            await release.wait()
+
+    holder = asyncio.create_task(hold())
+    await entered.wait()
+    waiter = asyncio.create_task(hold())
+    await asyncio.sleep(0)
+
+    stats = limiter.stats()
+    assert stats.in_flight == 1
+    assert stats.queue_depth == 1
+
+    release.set()
+    await asyncio.gather(holder, waiter)
+    stats = limiter.stats()
+    assert stats.admitted == 2
+    assert stats.queue_depth == 0
+    assert stats.in_flight == 0
+
+
+def test_unlimited_token_bucket():
+    bucket = TokenBucket(None)
+
+    bucket.take(1000)
+    assert bucket.delay(1000) == 0
+
+
+async def test_no_quota():
+    limiter = make_limiter(requests_per_minute=None, tokens_per_minute=None, queue_timeout=None)
+
+    for _ in range(10):
+        async with limiter.acquire(10000) as reservation:
+            reservation.used_tokens = 20000
+    assert limiter.stats().admitted == 10
+
+
+async def test_queue_full():
+    limiter = make_limiter(max_queue=0)
+
+    with pytest.raises(QueueFullError):
+        async with limiter.acquire(1):
+            pass
+    assert limiter.stats().rejected == 1
+
+
+async def test_queue_timeout():
+    limiter = make_limiter(requests_per_minute=1, queue_timeout=0.01)
+    async with limiter.acquire(1):
+        pass
+
+    with pytest.raises(QueueTimeoutError):
+        async with limiter.acquire(1):
+            pass
+    stats = limiter.stats()
+    assert stats.timed_out == 1
+    assert stats.in_flight == 0
+
+    # the slot of the timed out request is released
+    limiter._requests.take(-1)
+    async with limiter.acquire(1):
+        pass
+
+
+async def test_actual_usage_corrects_tokens():
+    limiter = make_limiter(tokens_per_minute=100, queue_timeout=0.01)
+    async with limiter.acquire(10) as reservation:
+        reservation.used_tokens = 100
+
+    with pytest.raises(QueueTimeoutError):
+        async with limiter.acquire(10):
+            pass
+
+
+def test_estimate_tokens():
+    messages = [{'role': 'user', 'content': 'a' * 40}, {'role': 'user', 'content': 'b' * 8}]
+
+    assert RateLimiter.estimate_tokens(messages, completion_tokens=100) == 112
@@ -0,0 +1,74 @@
+import pytest
+
+from llm import client
+from llm.backends import UpstreamError
+from llm.client import generate_response
+from llm.metrics import Registry
+
+
+def test_render():
+    registry = Registry()
+    requests = registry.counter('requests_total', 'Requests')
+    in_flight = registry.gauge('in_flight', 'In flight')
+    latency = registry.histogram('latency_seconds', 'Latency', (0.1, 1))
+
+    requests.inc(endpoint='a')
+    in_flight.inc()
+    in_flight.dec()
+    latency.observe(0.5)
+
+    assert registry.render().splitlines() == [
+        '# HELP requests_total Requests',
+        '# TYPE requests_total counter',
+        'requests_total{endpoint="a"} 1',
+        '# HELP in_flight In flight',
+        '# TYPE in_flight gauge',
+        'in_flight 0',
+        '# HELP latency_seconds Latency',
+        '# TYPE latency_seconds histogram',
+        'latency_seconds_bucket{le="0.1"} 0',
+        'latency_seconds_bucket{le="1"} 1',
+        'latency_seconds_bucket{le="+Inf"} 1',
+        'latency_seconds_sum 0.5',
+        'latency_seconds_count 1',
+    ]
+
+
+async def test_completion_metrics(mocker, mock_groq_response):
+    mock_create = mocker.patch('llm.client.backend.client.chat.completions.create')
+    mock_create.return_value = mock_groq_response('5')
+
+    await generate_response([{'role': 'user', 'content': 'metrics'}], endpoint='metrics_ok')
+
+    assert client.requests.value(endpoint='metrics_ok') == 1
+    assert client.prompt_tokens.value(endpoint='metrics_ok') == 10
+    assert client.completion_tokens.value(endpoint='metrics_ok') == 1
+    assert client.queue_wait_seconds.count(endpoint='metrics_ok') == 1
+    assert client.upstream_seconds.count(endpoint='metrics_ok') == 1
+    assert client.queued.value(endpoint='metrics_ok') == 0
+    assert client.in_flight.value(endpoint='metrics_ok') == 0
+
+
+async def test_error_metrics(mocker):
+    mocker.patch('llm.client.settings.LLM_RETRIES', 0)
+    mocker.patch('llm.client.backend.complete', side_effect=UpstreamError(429, 'Too many requests'))
+
+    with pytest.raises(UpstreamError):
+        await generate_response([{'role': 'user', 'content': 'metrics'}], endpoint='metrics_error')
+
+    assert client.errors.value(endpoint='metrics_error', type='rate_limited') == 1
+    assert client.in_flight.value(endpoint='metrics_error') == 0
+
+
+def test_quantile():
+    registry = Registry()
+    latency = registry.histogram('latency_seconds', 'Latency', (1, 2, 4))
+
+    assert latency.quantile(0.5) is None
+    for value in (0.5, 1.5, 1.5, 3):
+        latency.observe(value)
+
+    assert latency.quantile(0.5) == 1.5
+    assert latency.quantile(1) == 4
+    latency.observe(10)
+    assert latency.quantile(1) == 4
@@ -0,0 +1,103 @@
+import json
+import os
+
+import pytest
+
+from llm.prompts import PromptRegistry, PromptTemplate
+
+
+@pytest.fixture
+def prompts_path(tmp_path):
+    (tmp_path / 'greet.json').write_text(
+        json.dumps(
+            [
+                {'role': 'system', 'content': 'Hello <name>, meet <other>. <unknown> stays'},
+                {'role': 'user', 'content': {'answer': '<name>'}},
+            ]
+        )
+    )
+    (tmp_path / 'judge.json').write_text(
+        json.dumps(
+            [
+                {'role': 'system', 'content': 'Answer with <schema>'},
+            ]
+        )
+    )
+    (tmp_path / 'judge_schema.json').write_text('{"winner": "<name>"}')
+    return tmp_path
+
+
+def test_template_render():
+    template = PromptTemplate([{'role': 'user', 'content': '<a> and <b>'}])
+
+    assert template.render(a=1, b='two') == [{'role': 'user', 'content': '1 and two'}]
+    assert template.render(a='<b>', b='x') == [{'role': 'user', 'content': '<b> and x'}]
+
+
+def test_template_version():
+    template = PromptTemplate([{'role': 'user', 'content': '<a> and <b>'}])
+
+    assert template.version == PromptTemplate([{'role': 'user', 'content': '<a> and <b>'}]).version
+    assert template.bind(a=1).version != template.version
+
+
+def test_render_returns_fresh_messages():
+    template = PromptTemplate([{'role': 'user', 'content': 'static'}])
+
+    messages = template.render()
+    messages[0]['content'] = 'changed'
+    messages.append({'role': 'user', 'content': 'extra'})
+
+    assert template.render() == [{'role': 'user', 'content': 'static'}]
+
+
+def test_registry_render(prompts_path):
+    registry = PromptRegistry(prompts_path)
+    registry.load()
+
+    messages = registry.render('greet', name='Merlin', other='Gandalf')
+
+    assert messages[0] == {'role': 'system', 'content': 'Hello Merlin, meet Gandalf. <unknown> stays'}
+    assert messages[1] == {'role': 'user', 'content': json.dumps({'answer': 'Merlin'})}
+    assert registry.render_count == 1
+    assert registry.render_seconds > 0
+
+
+def test_registry_schema_is_bound_literally(prompts_path):
+    registry = PromptRegistry(prompts_path)
+    registry.load()
+
+    messages = registry.render('judge', has_schema=True, name='Merlin')
+
+    assert messages == [{'role': 'system', 'content': 'Answer with {"winner": "<name>"}'}]
+
+
+def test_registry_contains(prompts_path):
+    registry = PromptRegistry(prompts_path)
+    registry.load()
+
+    assert 'greet' in registry
+    assert 'missing' not in registry
+
+
+def test_registry_missing_prompt(prompts_path):
+    registry = PromptRegistry(prompts_path)
+
+    with pytest.raises(FileNotFoundError):
+        registry.render('missing')
+    with pytest.raises(FileNotFoundError):
+        registry.render('greet', has_schema=True)
+
+
+def test_registry_reload(prompts_path):
+    registry = PromptRegistry(prompts_path)
+    registry.load()
+    assert not registry.reload_if_changed()
+
+    file = prompts_path / 'greet.json'
+    file.write_text(json.dumps([{'role': 'system', 'content': 'Bye <name>'}]))
+    os.utime(file, ns=(0, 0))
+
+    assert registry.reload_if_changed()
+    assert registry.render('greet', name='Merlin') == [{'role': 'system', 'content': 'Bye Merlin'}]
+    assert registry.reloads == 1
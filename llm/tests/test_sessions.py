@@ -0,0 +1,85 @@
+import pytest
+from commonlib.models import Pair, SpellBase, SpellType, Wizard
+from fastapi import HTTPException
+from pydantic import ValidationError
+
+from llm.engine import (
+    SessionActionRequest,
+    append_session_actions,
+    create_session,
+    session_determine_turn,
+    session_generate_action,
+)
+from llm.sessions import SessionNotFoundError, SessionStore, SessionStoreFullError
+
+wizards = Pair(
+    [
+        Wizard(id=1, name='Merlin', description='Powerful wizard', speed=1, power=4, spells=[]),
+        Wizard(id=2, name='Gandalf', description='Grey wizard', speed=3, power=3, spells=[]),
+    ]
+)
+spell = SpellBase(type_=SpellType.ACTIVE, name='Fireball', description='Launches a fireball', manacost=4)
+
+
+def test_ttl(mocker):
+    monotonic = mocker.patch('llm.sessions.time.monotonic', return_value=0)
+    store = SessionStore(max_size=8, ttl=10)
+    session_id = store.create(wizards)
+
+    monotonic.return_value = 5
+    assert store.get(session_id).wizards == wizards
+
+    # the access extends the lifetime
+    monotonic.return_value = 14
+    store.get(session_id)
+
+    monotonic.return_value = 25
+    with pytest.raises(SessionNotFoundError):
+        store.get(session_id)
+    assert store.stats().expirations == 1
+
+
+def test_max_size():
+    store = SessionStore(max_size=2, ttl=10)
+    first = store.create(wizards)
+    second = store.create(wizards)
+    # the sessions of running matches are not evicted
+    with pytest.raises(SessionStoreFullError):
+        store.create(wizards)
+    store.get(first)
+    store.get(second)
+
+    store.delete(first)
+    store.create(wizards)
+    stats = store.stats()
+    assert stats.rejected == 1
+    assert stats.size == 2
+
+
+async def test_session_flow(mocker, mock_groq_response):
+    mock_create = mocker.patch('llm.client.backend.client.chat.completions.create')
+    mocker.patch('llm.engine.get_messages', return_value=[])
+    session_id = await create_session(wizards)
+    await append_session_actions(session_id, [{'role': 'user', 'content': 'The duel starts'}])
+
+    mock_create.return_value = mock_groq_response('Merlin casts a fireball!')
+    response = await session_generate_action(session_id, SessionActionRequest(wizard_index=0, spell=spell))
+    assert response.description == 'Merlin casts a fireball!'
+
+    mock_create.return_value = mock_groq_response('Gandalf')
+    assert await session_determine_turn(session_id) == 1
+    # the history is kept on the llm side
+    sent = str(mock_create.call_args.kwargs['messages'])
+    assert 'The duel starts' in sent
+    assert 'Merlin casts a fireball!' in sent
+
+
+def test_wizard_index_is_validated():
+    with pytest.raises(ValidationError):
+        SessionActionRequest(wizard_index=2, spell=spell)
+
+
+async def test_unknown_session():
+    with pytest.raises(HTTPException) as error:
+        await session_determine_turn('unknown')
+    assert error.value.status_code == 404
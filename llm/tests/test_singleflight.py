@@ -0,0 +1,96 @@
+import asyncio
+
+import pytest
+
+from llm.singleflight import SingleFlight
+
+
+@pytest.fixture
+def singleflight() -> SingleFlight:
+    return SingleFlight()
+
+
+def test_key_is_canonical():
+    messages = [{'role': 'user', 'content': 'hi'}]
+
+    assert SingleFlight.key('a', messages, {'x': 1, 'y': 2}) == SingleFlight.key('a', messages, {'y': 2, 'x': 1})
+    assert SingleFlight.key('a', messages, {}) != SingleFlight.key('b', messages, {})
+
+
+async def test_identical_calls_are_coalesced(singleflight):
+    calls = 0
+    release = asyncio.Event()
+
+    async def function():
+        nonlocal calls
+        calls += 1
+        await release.wait()
+        return calls
+
+    waiters = [asyncio.create_task(singleflight.do('key', function)) for _ in range(3)]
+    await asyncio.sleep(0)
+    release.set()
+
+    assert await asyncio.gather(*waiters) == [1, 1, 1]
+    assert calls == 1
+    stats = singleflight.stats()
+    assert stats.calls == 1
+    assert stats.saved == 2
+    assert stats.in_flight == 0
+
+    assert await singleflight.do('key', function) == 2
+
+
+async def test_cancelled_waiter_does_not_cancel_others(singleflight):
+    release = asyncio.Event()
+
+    async def function():
+        await release.wait()
+        return 'done'
+
+    first = asyncio.create_task(singleflight.do('key', function))
+    second = asyncio.create_task(singleflight.do('key', function))
+    await asyncio.sleep(0)
+
+    first.cancel()
+    await asyncio.sleep(0)
+    release.set()
+
+    assert await second == 'done'
+    assert first.cancelled()
+
+
+async def test_call_is_cancelled_without_waiters(singleflight):
+    started = asyncio.Event()
+    cancelled = asyncio.Event()
+
+    async def function():
+        started.set()
+        try:
+            await asyncio.Event().wait()
+        except asyncio.CancelledError:
+            cancelled.set()
+            await asyncio.sleep(0.01)
+            raise
+
+    waiter = asyncio.create_task(singleflight.do('key', function))
+    await started.wait()
+    waiter.cancel()
+
+    await asyncio.wait_for(cancelled.wait(), 1)
+    # forgotten while the cancelled call winds down
+    assert singleflight.stats().in_flight == 0
+
+
+async def test_errors_are_shared(singleflight):
+    async def function():
+        await asyncio.sleep(0)
+        raise ValueError
+
+    results = await asyncio.gather(
+        singleflight.do('key', function),
+        singleflight.do('key', function),
+        return_exceptions=True,
+    )
+
+    assert all(isinstance(result, ValueError) for result in results)
@@ -0,0 +1,139 @@
+"""
+Match throughput of a sharded contest deployment by the number of workers.
+
+Starts an llm service with the local fake backend and, for every worker count, that many contest workers.
+Matches are placed on the workers by the coordinator's consistent hashing and played by simulated players
+who always cast the simple attack.
+
+    python tools/bench_sharding.py --workers 1 2 4 --matches 400 --concurrency 128
+"""
+
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import time
+from contextlib import ExitStack, contextmanager
+from pathlib import Path
+
+import httpx
+
+root = Path(__file__).parent.parent
+sys.path.insert(0, str(root / 'coordinator' / 'src'))
+
+from coordinator.sharding import Shards, shard_of
+
+
+@contextmanager
+def serve(app_dir: Path, app: str, port: int, env: dict[str, str]):
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'uvicorn', app, '--app-dir', str(app_dir), '--port', str(port), '--log-level', 'error'],
+        env={**os.environ, **env},
+    )
+    try:
+        yield f'http://127.0.0.1:{port}'
+    finally:
+        process.kill()
+        process.wait()
+
+
+async def wait_ready(client: httpx.AsyncClient, url: str) -> None:
+    for _ in range(100):
+        try:
+            await client.get(url + '/openapi.json')
+            return
+        except httpx.TransportError:
+            await asyncio.sleep(0.1)
+    raise RuntimeError(f'{url} did not start')
+
+
+async def play(client: httpx.AsyncClient, shards: Shards, key: str, turns: int) -> None:
+    for shard, url in shards.place(key):
+        response = await client.post(url + '/create_director')
+        if response.status_code != 503:
+            break
+    response.raise_for_status()
+    director_id = response.json()
+    url = shards.url_of(director_id)
+    assert shard_of(director_id) == shard
+    params = {'director_id': director_id}
+
+    async def player(user_id: int) -> None:
+        wizard = {'id': user_id, 'name': f'Wizard {user_id}', 'speed': 1, 'power': 1, 'spells': []}
+        response = await client.post(url + '/set_wizard', params={**params, 'user_id': user_id}, json=wizard)
+        response.raise_for_status()
+        for _ in range(turns):
+            response = await client.post(url + '/get_user_to_make_turn', params=params)
+            if response.json() == user_id:
+                await client.post(url + '/cast_spell', params={**params, 'user_id': user_id, 'spell_id': -1})
+            response = await client.post(url + '/get_action', params=params)
+            response.raise_for_status()
+
+    await asyncio.gather(player(1), player(2))
+
+
+async def bench(workers: int, args: argparse.Namespace, llm_url: str) -> float:
+    env = {
+        'LLM_SERVICE_URL': llm_url,
+        'TURNS_COUNT': str(args.turns),
+        'STREAM_ACTIONS': 'false',
+        'DIRECTORS_MAX_LIVE': str(args.concurrency),
+    }
+    with ExitStack() as stack:
+        urls = [
+            stack.enter_context(
+                serve(
+                    root / 'contest' / 'src',
+                    'contest.main:app',
+                    args.port + 1 + shard,
+                    {**env, 'SHARD_ID': str(shard)},
+                )
+            )
+            for shard in range(workers)
+        ]
+        shards = Shards(dict(enumerate(urls)))
+        limits = httpx.Limits(max_connections=None, max_keepalive_connections=None)
+        async with httpx.AsyncClient(timeout=None, limits=limits) as client:
+            for url in urls:
+                await wait_ready(client, url)
+            semaphore = asyncio.Semaphore(args.concurrency)
+
+            async def match(index: int) -> None:
+                async with semaphore:
+                    await play(client, shards, f'match-{index}', args.turns)
+
+            start = time.monotonic()
+            await asyncio.gather(*(match(index) for index in range(args.matches)))
+            return args.matches / (time.monotonic() - start)
+
+
+async def main(args: argparse.Namespace) -> None:
+    env = {
+        'LLM_BACKEND': 'local',
+        'LOCAL_LATENCY_MEDIAN': str(args.llm_latency),
+        'LOCAL_TOKENS_PER_SECOND': '1000000',
+        'LLM_MAX_IN_FLIGHT': '100000',
+        'LLM_MAX_QUEUE': '100000',
+        'MANACOST_CACHE_PATH': '',
+    }
+    with serve(root / 'llm' / 'src', 'llm.main:app', args.port, env) as llm_url:
+        async with httpx.AsyncClient() as client:
+            await wait_ready(client, llm_url)
+        print(f'{"workers":>8} {"matches/s":>10} {"speedup":>8}')
+        baseline = None
+        for workers in args.workers:
+            throughput = await bench(workers, args, llm_url)
+            baseline = baseline or throughput
+            print(f'{workers:>8} {throughput:>10.1f} {throughput / baseline:>8.2f}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--matches', type=int, default=400)
+    parser.add_argument('--concurrency', type=int, default=128)
+    parser.add_argument('--turns', type=int, default=4)
+    parser.add_argument('--llm-latency', type=float, default=0.05)
+    parser.add_argument('--port', type=int, default=8100)
+    asyncio.run(main(parser.parse_args()))
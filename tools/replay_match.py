@@ -0,0 +1,66 @@
+"""
+Replays matches from the journal of a contest worker, JOURNAL_PATH, against the director.
+
+The LLM answers are served from the journal, instantly by default, so the time per turn is the overhead
+of the director and the battlefield alone. Replayed actions which differ from the recorded ones are reported.
+
+    python tools/replay_match.py journal.jsonl
+    python tools/replay_match.py journal.jsonl --director 1234 --latency
+"""
+
+import argparse
+import asyncio
+import statistics
+import sys
+from pathlib import Path
+
+root = Path(__file__).parent.parent
+sys.path.insert(0, str(root / 'contest' / 'src'))
+
+from contest.journal import ReplayError, read_journal
+from contest.replay import is_replayable, replay_match
+
+
+async def main(args: argparse.Namespace) -> int:
+    matches = read_journal(args.journal)
+    if args.director is not None:
+        matches = {args.director: matches[args.director]}
+    skipped = [director_id for director_id, records in matches.items() if not is_replayable(records)]
+    print(f'{len(matches)} matches, {len(skipped)} resumed from snapshots are skipped')
+
+    per_turn = []
+    diverged = 0
+    for director_id, records in matches.items():
+        if director_id in skipped:
+            continue
+        for _ in range(args.repeat):
+            try:
+                replay = await replay_match(director_id, records, latency=args.latency)
+            except ReplayError as e:
+                print(f'{director_id}: {e}')
+                diverged += 1
+                break
+            if replay.mismatches:
+                print(f'{director_id}: ' + '; '.join(replay.mismatches))
+                diverged += 1
+                break
+            if replay.turns:
+                per_turn.append(replay.seconds / replay.turns)
+
+    if per_turn:
+        per_turn.sort()
+        print(f'{"replays":>8} {"ms/turn":>8} {"p50":>8} {"p99":>8}')
+        print(
+            f'{len(per_turn):>8} {statistics.mean(per_turn) * 1000:>8.2f} '
+            f'{per_turn[len(per_turn) // 2] * 1000:>8.2f} {per_turn[int(len(per_turn) * 0.99)] * 1000:>8.2f}'
+        )
+    return 1 if diverged else 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('journal', type=Path)
+    parser.add_argument('--director', type=int, help='replay only this match')
+    parser.add_argument('--latency', action='store_true', help='answer after the recorded LLM latency')
+    parser.add_argument('--repeat', type=int, default=1, help='replays of every match')
+    sys.exit(asyncio.run(main(parser.parse_args())))